@@ -0,0 +1,63 @@
+# Render time of the balance trend chart with and without decimation.
+#
+#   python benchmarks/bench_balance_trend.py [--sizes 10000 100000 1000000]
+#
+# "full" draws every transaction the way show_balance_trend used to (markers
+# and fill on each point); "decimated" goes through BalanceTrendLine.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from finance_core import BalanceTrendLine
+
+LINE_STYLE = dict(marker='o', linestyle='-', linewidth=3, color='#4a86e8', markersize=8,
+                  markerfacecolor='#252525', markeredgewidth=2, markeredgecolor='#4a86e8')
+FILL_STYLE = dict(alpha=0.3, color='#4a86e8')
+
+
+def synthetic_balance(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = np.datetime64('2015-01-01T00:00:00') + np.cumsum(rng.integers(1, 3600, rows)).astype('timedelta64[s]')
+    balances = np.cumsum(rng.normal(0, 50, rows))
+    return dates, balances
+
+
+def render(dates, balances, decimated):
+    fig = Figure(figsize=(8, 5), dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    start = time.perf_counter()
+    if decimated:
+        BalanceTrendLine(ax, dates, balances, LINE_STYLE, FILL_STYLE)
+    else:
+        ax.plot(dates, balances, **LINE_STYLE)
+        ax.fill_between(dates, balances, **FILL_STYLE)
+    fig.tight_layout()
+    canvas.draw()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Balance trend render benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--max-full', type=int, default=1_000_000,
+                        help="skip the undecimated render above this many rows")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'full (s)':>10} {'decimated (s)':>14}")
+    for rows in args.sizes:
+        dates, balances = synthetic_balance(rows)
+        full = f"{render(dates, balances, decimated=False):10.3f}" if rows <= args.max_full else f"{'skipped':>10}"
+        print(f"{rows:>10} {full} {render(dates, balances, decimated=True):14.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# Memory growth of the statistics tab across repeated chart switches.
+#
+#   python benchmarks/bench_chart_memory.py [--switches 500] [--rows 5000]
+#                                           [--max-growth 512]
+#
+# Runs the real window under the offscreen Qt platform and alternates
+# between the pie chart and the balance trend, waiting for each background
+# render to be shown. The chart cache is cleared before every switch, so
+# each one renders into the surface's figure again instead of putting back a
+# cached image. Reports traced Python memory, matplotlib figures, axes and
+# Qt widgets before and after; figures, axes or widgets that accumulate, or
+# memory growing by more than --max-growth KiB, are listed and the exit
+# status is 1. tests/test_charts.py checks the same on a short run.
+
+import argparse
+import gc
+import os
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from matplotlib.figure import Figure
+from PyQt6.QtWidgets import QApplication
+
+import finance_calculator
+
+
+def make_window(rows):
+    workdir = tempfile.mkdtemp(prefix='finance-bench-')
+    shutil.copytree(os.path.join(ROOT, 'icons'), os.path.join(workdir, 'icons'))
+    os.chdir(workdir)
+
+    window = finance_calculator.FinanceCalculator()
+    window.wait_loaded()
+    rng = random.Random(0)
+    for i in range(rows):
+        window.amount_edit.setText(f"{rng.uniform(1, 500):.2f}")
+        window.type_combo.setCurrentIndex(rng.randrange(2))
+        window.category_edit.setText(f"category-{rng.randrange(12)}")
+        window.add_transaction()
+    return window, workdir
+
+
+def count_figures():
+    # Bare Figures are not registered with pyplot, so they are counted on the heap
+    gc.collect()
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, Figure))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chart switching memory benchmark")
+    parser.add_argument('--switches', type=int, default=500)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--max-growth', type=float, default=512,
+                        help="allowed growth of traced memory over all switches, in KiB")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    # Loads are started by make_window, not by the first paint
+    finance_calculator.startup_timer.mark('first paint')
+    window, workdir = make_window(args.rows)
+    window.resize(1200, 900)
+    window.show()
+    app.processEvents()
+
+    def switch(times):
+        for i in range(times):
+            window.chart_cache.clear()
+            if i % 2:
+                window.show_balance_trend()
+            else:
+                window.show_expense_pie_chart()
+            # Charts render on a background thread; wait until it's shown
+            window.chart_surface.wait()
+            app.processEvents()
+
+    # Make the figure and fill matplotlib's bounded caches (text
+    # layout, tick locators). Traced from the start, or the entries those
+    # caches replace later would be counted as growth.
+    tracemalloc.start()
+    switch(300)
+    figures = count_figures()
+    axes = len(window.chart_surface.figure.axes)
+    widgets = len(QApplication.allWidgets())
+    before = tracemalloc.get_traced_memory()[0]
+    switch(args.switches)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    figures_after = count_figures()
+    axes_after = len(window.chart_surface.figure.axes)
+    widgets_after = len(QApplication.allWidgets())
+    growth = (after - before) / 1024
+
+    print(f"switches:        {args.switches}")
+    print(f"traced memory:   {before / 1024:.0f} KiB -> {after / 1024:.0f} KiB "
+          f"({(after - before) / args.switches:.1f} B/switch)")
+    print(f"figures:         {figures} -> {figures_after}")
+    print(f"axes:            {axes} -> {axes_after}")
+    print(f"widgets:         {widgets} -> {widgets_after}")
+
+    window.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    leaks = []
+    if figures_after > figures:
+        leaks.append(f"{figures_after - figures} figures")
+    if axes_after > axes:
+        leaks.append(f"{axes_after - axes} axes")
+    if widgets_after > widgets:
+        leaks.append(f"{widgets_after - widgets} widgets")
+    if growth > args.max_growth:
+        leaks.append(f"{growth:.0f} KiB of memory (limit {args.max_growth:.0f} KiB)")
+    for leak in leaks:
+        print(f"LEAK {leak} over {args.switches} switches")
+    if leaks:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
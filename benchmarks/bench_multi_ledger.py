@@ -0,0 +1,69 @@
+# Scaling of aggregate_ledgers over one ledger file per year.
+#
+#   python benchmarks/bench_multi_ledger.py [--rows 1000000] [--years 10] [--workers 1 2 4 8]
+#
+# Splits a synthetic ledger into yearly JSON files and times the report with
+# each worker count, checking that every run matches the in-process one
+# exactly. Expect close to linear speedup up to the number of files or
+# cores, whichever is lower.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from finance_core import aggregate_ledgers
+from synthetic import make_columns, write_ledger
+
+
+def write_yearly(directory, rows, years):
+    columns = make_columns(rows, years=years)
+    year_of = columns['date'].astype('datetime64[Y]').astype(np.int64) + 1970
+    paths = []
+    for year in np.unique(year_of).tolist():
+        selected = np.flatnonzero(year_of == year)
+        part = {field: np.asarray(values)[selected] for field, values in columns.items()}
+        for field in ('type', 'category', 'currency'):
+            part[field] = part[field].tolist()
+        os.makedirs(os.path.join(directory, str(year)))
+        paths.append(write_ledger(os.path.join(directory, str(year)), part))
+    return paths
+
+
+def same(a, b):
+    return (a.summary == b.summary and a.rollups.totals == b.rollups.totals and
+            a.rollups.categories == b.rollups.categories and a.files == b.files and a.balance == b.balance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-file aggregation benchmark")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='finance-bench-')
+    try:
+        paths = write_yearly(directory, args.rows, args.years)
+        print(f"{len(paths)} files, {args.rows} rows, {os.cpu_count()} CPUs")
+        reference = None
+        for workers in args.workers:
+            start = time.perf_counter()
+            report = aggregate_ledgers(paths, workers=workers)
+            seconds = time.perf_counter() - start
+            if reference is None:
+                reference, baseline = report, seconds
+            print(f"workers {workers:3}: {seconds:7.2f} s  speedup {baseline / seconds:5.2f}  "
+                  f"{'identical' if same(report, reference) else 'DIFFERENT'}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
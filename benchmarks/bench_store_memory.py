@@ -0,0 +1,88 @@
+# Memory per transaction of the in-memory ledger representations.
+#
+#   python benchmarks/bench_store_memory.py [--sizes 100000 1000000]
+#
+# Builds synthetic ledgers and reports traced Python memory per row for the
+# plain list of dicts (as json.load returns it) and the ColumnarStore, then
+# the peak while opening the ledger written as a JSON snapshot: json.load of
+# the file against JournalStorage.load_store(), which streams it into
+# columns.
+
+import argparse
+import gc
+import os
+import json
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from finance_core import ColumnarStore, JournalStorage
+
+CURRENCIES = ["USD - $", "EUR - €", "GBP - £", "JPY - ¥"]
+
+
+def make_records(count):
+    rng = random.Random(0)
+    records = []
+    for i in range(count):
+        amount = round(rng.uniform(1, 500), 2)
+        expense = rng.random() < 0.7
+        records.append({
+            "id": i + 1,
+            "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                    f"{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}",
+            # Fresh string objects per record, as a JSON parser produces them
+            "type": "".join(["Expense"]) if expense else "".join(["Income"]),
+            "category": "".join(["category-", str(rng.randrange(40))]),
+            "amount": -amount if expense else amount,
+            "currency": "".join([rng.choice(CURRENCIES)])
+        })
+    return records
+
+
+def traced(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ledger memory benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'dict list':>12} {'ColumnarStore':>15} {'json.load peak':>16} {'load_store peak':>17}")
+    workdir = tempfile.mkdtemp(prefix='finance-bench-')
+    try:
+        for size in args.sizes:
+            records, dicts, peak = traced(lambda: make_records(size))
+            columnar, columns, peak = traced(lambda: ColumnarStore(records))
+            path = os.path.join(workdir, f'ledger-{size}.json')
+            JournalStorage.write_snapshot_file(path, columnar)
+            del records, columnar
+
+            def read():
+                with open(path, encoding='utf-8') as f:
+                    return json.load(f)
+            records, size_read, json_peak = traced(read)
+            del records
+            storage = JournalStorage(path)
+            store, size_read, load_peak = traced(storage.load_store)
+            storage.close()
+            del store
+            print(f"{size:>10} {dicts / size:>10.0f} B {columns / size:>13.0f} B "
+                  f"{json_peak / 2 ** 20:>12.0f} MiB {load_peak / 2 ** 20:>13.0f} MiB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
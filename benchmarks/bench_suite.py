@@ -0,0 +1,231 @@
+# Timings of the window's hot paths on synthetic ledgers, compared against a
+# stored baseline.
+#
+#   python benchmarks/bench_suite.py [--sizes 1000 10000 100000 1000000] [--storage json sqlite binary]
+#                                    [--categories 12] [--currencies 1] [--repeat 3]
+#                                    [--output results.json] [--baseline benchmarks/baseline.json]
+#                                    [--save-baseline]
+#
+# For every storage engine and ledger size a synthetic ledger (see
+# synthetic.py) is written to a temporary directory and opened in the real
+# window under the offscreen Qt platform. Timed paths:
+#
+#   load      wait_loaded() on a fresh window (the old load_data)
+#   save      100 add_transaction() calls written through the save queue
+#   snapshot  compact() of the whole ledger (JSON and binary; the old save_data)
+#   refresh   update_transaction_list() and a repaint of the table
+#   pie, trend, bars, areas
+#             the chart buttons of the statistics tab including the draw, with
+#             the chart cache cleared before each run
+#   pie-cached, trend-cached, bars-cached, areas-cached
+#             the same buttons again, answered from the chart cache
+#
+# The best of --repeat runs is kept, plus the first run where it differs
+# (caches are cold then). Results are written as JSON; with a baseline, paths
+# more than --tolerance slower (and more than --min-delta seconds) are
+# listed and the exit status is 1.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import matplotlib
+import numpy as np
+from PyQt6.QtCore import QT_VERSION_STR
+from PyQt6.QtWidgets import QApplication
+
+import finance_calculator
+from synthetic import make_columns, write_ledger, write_rates
+
+SAVED_ROWS = 100
+CHARTS = ('pie', 'trend', 'bars', 'areas')
+
+
+def timed(function, repeat):
+    # (first, best) wall time of `repeat` calls
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times[0], min(times)
+
+
+def open_window(storage):
+    window = finance_calculator.FinanceCalculator(storage=storage)
+    # The offscreen platform starts windows tiny; give the table some rows
+    window.resize(1200, 900)
+    window.show()
+    # Until the window is exposed the table doesn't paint
+    QApplication.processEvents()
+    return window
+
+
+def close_window(window):
+    window.close()
+    window.deleteLater()
+    QApplication.sendPostedEvents()
+
+
+def bench_ledger(app, storage, rows, args):
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='finance-bench-')
+    shutil.copytree(os.path.join(ROOT, 'icons'), os.path.join(workdir, 'icons'))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        columns = make_columns(rows, categories=args.categories, currencies=args.currencies)
+        write_ledger(workdir, columns, storage)
+        if args.currencies > 1:
+            write_rates(workdir, args.currencies)
+        del columns
+
+        # Every load needs a window that hasn't loaded yet
+        loads = []
+        for i in range(args.repeat):
+            window = open_window(storage)
+            start = time.perf_counter()
+            window.wait_loaded()
+            loads.append(time.perf_counter() - start)
+            if i < args.repeat - 1:
+                close_window(window)
+        results['load'] = loads[0], min(loads)
+
+        def save():
+            for i in range(SAVED_ROWS):
+                window.amount_edit.setText(f"{i % 500 + 1}.25")
+                window.type_combo.setCurrentIndex(i % 2)
+                window.category_edit.setText(f"category-{i % args.categories}")
+                window.add_transaction()
+            window.save_queue.close()
+            QApplication.sendPostedEvents()
+        results['save'] = timed(save, args.repeat)
+
+        if storage != 'sqlite':
+            results['snapshot'] = timed(lambda: window.storage.compact(window.transactions, wait=True), args.repeat)
+
+        def refresh():
+            window.update_transaction_list()
+            window.transaction_table.viewport().repaint()
+        results['refresh'] = timed(refresh, args.repeat)
+
+        charts = {
+            'pie': window.show_expense_pie_chart,
+            'trend': window.show_balance_trend,
+            'bars': window.show_period_chart,
+            'areas': window.show_category_trend
+        }
+        for name in CHARTS:
+            def chart(show=charts[name]):
+                # Charts render on a background thread; time until it's shown
+                show()
+                window.chart_surface.wait()
+                app.processEvents()
+
+            def cold_chart():
+                window.chart_cache.clear()
+                chart()
+            results[name] = timed(cold_chart, args.repeat)
+            results[f'{name}-cached'] = timed(chart, args.repeat)
+        close_window(window)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {path: {'first': first, 'best': best} for path, (first, best) in results.items()}
+
+
+def compare(results, baseline, tolerance, min_delta):
+    # [(key, baseline seconds, current seconds)] of the paths that got slower
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        if result['best'] > previous['best'] * (1 + tolerance) and result['best'] - previous['best'] > min_delta:
+            regressions.append((key, previous['best'], result['best']))
+    return regressions
+
+
+def main():
+    default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+    parser = argparse.ArgumentParser(description="Load, save, table and chart benchmark suite")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--storage', choices=['json', 'sqlite', 'binary'], nargs='+',
+                        default=['json', 'sqlite', 'binary'])
+    parser.add_argument('--categories', type=int, default=12, help="distinct categories in the ledger")
+    parser.add_argument('--currencies', type=int, default=1,
+                        help="currencies in the ledger; above 1 an exchange rate table is written too")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--baseline', default=default_baseline, help="results to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="allowed slowdown, as a fraction")
+    parser.add_argument('--min-delta', type=float, default=0.02,
+                        help="slowdowns below this many seconds are noise")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv[:1])
+    # Only the first window would start loading on its first paint; keep the
+    # loads under the benchmark's control
+    finance_calculator.startup_timer.mark('first paint')
+    results = {}
+    for storage in args.storage:
+        for rows in args.sizes:
+            for path, result in bench_ledger(app, storage, rows, args).items():
+                key = f"{storage}/{rows}/{path}"
+                results[key] = result
+                print(f"{key:28} best {result['best'] * 1000:10.1f} ms   first {result['first'] * 1000:10.1f} ms",
+                      flush=True)
+
+    report = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'matplotlib': matplotlib.__version__,
+            'qt': QT_VERSION_STR,
+            'categories': args.categories,
+            'currencies': args.currencies,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if (baseline['meta']['categories'], baseline['meta']['currencies']) != (args.categories, args.currencies):
+        print("baseline was recorded with another ledger shape; not compared")
+        return
+    regressions = compare(results, baseline['results'], args.tolerance, args.min_delta)
+    for key, previous, current in regressions:
+        print(f"REGRESSION {key}: {previous * 1000:.1f} ms -> {current * 1000:.1f} ms")
+    if regressions:
+        sys.exit(1)
+    print(f"no regressions against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
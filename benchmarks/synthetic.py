@@ -0,0 +1,78 @@
+# Synthetic ledgers for the benchmarks.
+#
+# make_columns() builds a column batch (the shape read_statement returns and
+# ColumnarStore.extend_columns / storage.write_columns take) with NumPy, so
+# a million rows take about a second. write_ledger() stores it the way the
+# app keeps its data; write_rates() adds an exchange rate table covering
+# the ledger's currencies.
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from finance_core import JournalStorage, SQLiteStorage, BinaryStorage, ColumnarStore, CURRENCIES, currency_code
+
+LEDGER_FILES = {'json': "finance_data.json", 'sqlite': "finance_data.db", 'binary': "finance_data.fin"}
+
+
+def make_columns(rows, categories=12, currencies=1, income_share=0.3, years=10, seed=0):
+    # `rows` transactions over `years` years up to 2024, spread over
+    # `categories` categories and the first `currencies` entries of CURRENCIES
+    # (the first one carrying half the rows, the rest shared equally)
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2024-12-31T23:59:59') - np.timedelta64(years * 365 * 86400, 's')
+    dates = np.sort(start + rng.integers(0, years * 365 * 86400, rows).astype('timedelta64[s]'))
+
+    income = rng.random(rows) < income_share
+    amounts = np.round(rng.uniform(1, 500, rows), 2)
+    amounts[~income] *= -1
+
+    labels = np.array([f"category-{i}" for i in range(categories)], dtype=object)
+    weights = np.full(currencies, 0.5 / max(currencies - 1, 1))
+    weights[0] = 1.0 if currencies == 1 else 0.5
+    currency_labels = np.array(CURRENCIES[:currencies], dtype=object)
+    return {
+        'id': np.arange(1, rows + 1, dtype=np.int64),
+        'date': dates,
+        'type': np.where(income, "Income", "Expense").astype(object).tolist(),
+        'category': labels[rng.integers(0, categories, rows)].tolist(),
+        'amount': amounts,
+        'currency': currency_labels[rng.choice(currencies, rows, p=weights)].tolist()
+    }
+
+
+def write_ledger(directory, columns, storage='json'):
+    # Writes the batch as a JSON or binary snapshot or an SQLite database in
+    # `directory`
+    path = os.path.join(directory, LEDGER_FILES[storage])
+    if storage == 'sqlite':
+        ledger = SQLiteStorage(path)
+        ledger.load_store()
+        ledger.write_columns(columns)
+        ledger.finish_columns()
+    else:
+        store = ColumnarStore()
+        store.extend_columns(columns)
+        ledger = BinaryStorage(path) if storage == 'binary' else JournalStorage(path)
+        ledger.compact(store, wait=True)
+    ledger.close()
+    return path
+
+
+def write_rates(directory, currencies=1, years=10, seed=0):
+    # Monthly rates for the first `currencies` currencies, base USD
+    rng = np.random.default_rng(seed)
+    months = np.arange(np.datetime64('2024-12', 'M') - years * 12, np.datetime64('2025-01', 'M'))
+    path = os.path.join(directory, "exchange_rates.csv")
+    codes = [currency_code(label) for label in CURRENCIES[:currencies]]
+    base = rng.uniform(0.5, 150, len(codes))
+    base[0] = 1.0
+    with open(path, 'w') as f:
+        f.write(",".join(["date"] + codes) + "\n")
+        for month in months:
+            drift = rng.normal(1, 0.02, len(codes))
+            drift[0] = 1.0
+            f.write(",".join([str(month.astype('datetime64[D]'))] + [f"{rate:.6f}" for rate in base * drift]) + "\n")
+    return path
@@ -1,20 +1,832 @@
+import time
+
+# Reference point for the --startup-report timings
+_IMPORT_STARTED = time.perf_counter()
+
 import sys
-import json
+import functools
+import logging
 import os
+import argparse
+import sqlite3
 from datetime import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
+import numpy as np
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                           QLabel, QLineEdit, QComboBox, QPushButton, QTableWidget, 
-                           QTableWidgetItem, QTabWidget, QMessageBox, QDialog, QFormLayout,
+                           QLabel, QLineEdit, QComboBox, QPushButton, QTableView, 
+                           QTabWidget, QMessageBox, QDialog, QFormLayout,
                            QHeaderView, QFrame, QSplitter, QMenu, QSizePolicy, QToolButton,
-                           QGraphicsDropShadowEffect)
-from PyQt6.QtCore import Qt, QSize, QPoint
-from PyQt6.QtGui import QAction, QColor, QPalette, QFont, QIcon, QPixmap
+                           QGraphicsDropShadowEffect, QProgressBar, QFileDialog, QCheckBox,
+                           QTableWidget, QTableWidgetItem)
+from PyQt6.QtCore import (Qt, QSize, QPoint, QAbstractTableModel, QModelIndex, QTimer, QObject,
+                          QRunnable, QThreadPool, pyqtSignal)
+from PyQt6.QtGui import QAction, QColor, QPalette, QFont, QIcon, QKeySequence, QPixmap, QResizeEvent
+
+from finance_core import (JournalStorage, SQLiteStorage, BinaryStorage, ColumnarStore, CategoryTotals,
+                          CurrencyAggregates, ExchangeRates, Rollups, TransactionIndex, TransactionQuery,
+                          ChartCache, ChartFigure, CommandLog, CURRENCIES, currency_symbol, diagnostics,
+                          read_statement)
+
+# pandas and matplotlib are only needed by the statistics tab and are
+# imported on first use there, keeping them off the startup path
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    # Wall-clock marks taken during startup, relative to the start of this
+    # module's imports
+
+    def __init__(self, started=_IMPORT_STARTED):
+        self.started = started
+        self.marks = {}
+        self.durations = {}
+
+    def mark(self, name):
+        self.marks.setdefault(name, time.perf_counter() - self.started)
+
+    def measure(self, name, seconds):
+        self.durations[name] = seconds
+
+    def report(self):
+        lines = ["Startup timings:"]
+        for name, seconds in sorted(self.marks.items(), key=lambda item: item[1]):
+            lines.append(f"  {name:<20} {seconds * 1000:8.1f} ms after start")
+        for name, seconds in self.durations.items():
+            lines.append(f"  {name:<20} {seconds * 1000:8.1f} ms")
+        return "\n".join(lines)
+
+
+startup_timer = StartupTimer()
+startup_timer.mark('imports done')
+
+
+class RenderSignals(QObject):
+    finished = pyqtSignal(object, object)
+    failed = pyqtSignal(object)
+
+
+class RenderTask(QRunnable):
+    # Shows a chart in `chart`, the surface's ChartFigure, and rasterizes it
+    # off the GUI thread on `canvas`, the pool's Agg canvas (made by the
+    # first task). `method` is the ChartFigure method showing the chart and
+    # `args` its arguments; neither they nor the figure may be touched by the
+    # GUI until the task reports back. Every task reports back once: finished
+    # with the image, or with None if it was cancelled (it stops at the next
+    # step), or failed.
+
+    def __init__(self, name, method, args, key, toolbar, chart, canvas):
+        super().__init__()
+        self.name = name
+        self.method = method
+        self.args = args
+        self.key = key
+        self.toolbar = toolbar
+        self.chart = chart
+        self.canvas = canvas
+        self.cancelled = False
+        self.signals = RenderSignals()
+
+    def run(self):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        image = None
+        try:
+            if not self.cancelled:
+                with diagnostics.measure(f'{self.name}: render'):
+                    figure = self.chart.figure
+                    if self.canvas is None:
+                        self.canvas = FigureCanvasAgg(figure)
+                    else:
+                        figure.set_canvas(self.canvas)
+                    getattr(self.chart, self.method)(*self.args)
+                    if not self.cancelled:
+                        self.canvas.draw()
+                        image = self.canvas.copy_from_bbox(figure.bbox)
+        except Exception:
+            logger.exception("Could not render the %s", self.name)
+            # Possibly half-changed, so the next render starts from an
+            # empty figure
+            self.chart.clear()
+            self.signals.failed.emit(self)
+            return
+        self.signals.finished.emit(self, image)
+
+
+class ChartSurface(QWidget):
+    # The statistics tab's chart: a Qt canvas showing one ChartFigure, with
+    # the toolbar below it. The figure holds only the shown chart's axes and
+    # is reused by every chart, so switching charts leaves no figures behind.
+    #
+    # Charts are built and rasterized in the figure by RenderTasks on the
+    # render pool, one at a time. Until every started task has reported
+    # back the GUI leaves the figure alone: the canvas keeps its last pixels
+    # (under a note), skips draws, keeps the figure's size and takes no
+    # mouse input. Only the latest request is shown: older ones are
+    # cancelled, or dropped if they finish anyway. The finished image is put
+    # on the canvas, so the GUI thread doesn't draw the chart again.
+    #
+    # Charts are shown with the key they were computed for (see
+    # FinanceCalculator.chart_key), and every draw leaves the image in the
+    # chart cache under the key. Showing the chart the figure already holds
+    # puts its image back without rendering; switching back to another
+    # chart whose image is cached shows the image at once while the figure
+    # is rebuilt behind it.
+
+    def __init__(self, cache, pool, note, parent=None):
+        super().__init__(parent)
+        from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
+        from matplotlib.backends.backend_qtagg import NavigationToolbar2QT as NavigationToolbar
+
+        # Global rcParams, read by every artist the render pool makes
+        ChartFigure.use_style()
+        self.cache = cache
+        self.pool = pool
+        self.box = QVBoxLayout(self)
+        self.box.setContentsMargins(0, 0, 0, 0)
+        self.chart = ChartFigure()
+        self.figure = self.chart.figure
+        # Key of the chart the figure holds, None while it's being changed
+        self.key = None
+        self.canvas = FigureCanvas(self.figure)
+        self.box.addWidget(self.canvas)
+        self.toolbar = NavigationToolbar(self.canvas, self)
+        # Keep the canvas size when the toolbar comes and goes, or every
+        # switch between charts with and without it would redraw
+        policy = self.toolbar.sizePolicy()
+        policy.setRetainSizeWhenHidden(True)
+        self.toolbar.setSizePolicy(policy)
+        self.toolbar.setVisible(False)
+        self.box.addWidget(self.toolbar)
+        # Re-decimates the shown balance trend after zooms, pans and resizes
+        self.trend_timer = self.canvas.new_timer(interval=50)
+        self.trend_timer.single_shot = True
+        self.trend_timer.add_callback(self.refresh_trend)
+        self.canvas.mpl_connect('resize_event', self.on_resize)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        # The RenderTask whose chart is to be shown next
+        self.task = None
+        # RenderTasks started and not reported back yet
+        self.pending = 0
+        # A draw or resize the canvas put off while tasks were pending
+        self.stale = False
+        # The render pool's Agg canvas, kept so that its renderer is reused
+        # from one render to the next
+        self.offscreen = None
+
+        self.note = QLabel(note, self.canvas)
+        self.note.setStyleSheet("color: #9e9e9e; background: transparent;")
+        self.note.move(8, 8)
+        self.note.hide()
+
+        # The figure is rendered on the canvas' (idle) draws
+        draw = self.canvas.draw
+        def measured_draw():
+            if self.pending:
+                self.stale = True
+                return
+            with diagnostics.measure('chart draw'):
+                draw()
+        self.canvas.draw = measured_draw
+        resize = self.canvas.resizeEvent
+        def resize_event(event):
+            if self.pending:
+                QWidget.resizeEvent(self.canvas, event)
+                self.stale = True
+            else:
+                resize(event)
+        self.canvas.resizeEvent = resize_event
+
+    def image_key(self, key):
+        return ('image', key) + self.canvas.get_width_height()
+
+    def on_draw(self, event):
+        # Zoomed, panned or resized, the latest image is still what the
+        # figure's artists show. The render pool's draws fire this too.
+        if event.canvas is self.canvas and self.key is not None:
+            image = self.canvas.copy_from_bbox(self.figure.bbox)
+            self.cache.put(self.image_key(self.key), image, memoryview(image).nbytes)
+
+    def on_resize(self, event):
+        if self.chart.trend_line is not None:
+            self.chart.trend_line.on_view_changed()
+
+    def refresh_trend(self):
+        if not self.pending and self.chart.trend_line is not None:
+            self.chart.trend_line.refresh()
+
+    def put_image(self, image):
+        self.canvas.restore_region(image)
+        self.canvas.update()
+
+    def rendering(self):
+        return self.task is not None
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancelled = True
+            self.task = None
+        self.note.hide()
+
+    def wait(self):
+        # Blocks until the requested chart is on the canvas
+        self.pool.waitForDone()
+        QApplication.sendPostedEvents()
+
+    def clear(self):
+        # Empties the figure, unless it is already
+        if self.pending or self.chart.kind is not None:
+            self.show_chart('empty chart', 'clear', (), None, False)
+        else:
+            self.cancel()
+
+    def show_chart(self, name, method, args, key, toolbar):
+        if key is not None and key == self.key and not self.pending:
+            image = self.cache.get(self.image_key(key))
+            if image is not None:
+                self.cancel()
+                self.toolbar.setVisible(toolbar)
+                self.put_image(image)
+                return
+        self.cancel()
+        # The task changes the figure, so it can't be shown under its old
+        # key any more
+        self.key = None
+        self.task = RenderTask(name, method, args, key, toolbar, self.chart, self.offscreen)
+        self.task.signals.finished.connect(self.on_rendered)
+        self.task.signals.failed.connect(self.on_render_failed)
+        image = None if key is None else self.cache.get(self.image_key(key))
+        if image is not None:
+            self.put_image(image)
+        else:
+            self.note.show()
+        if not self.pending:
+            # The figure belongs to the render pool until every task is back
+            self.trend_timer.stop()
+            self.canvas.setEnabled(False)
+            self.toolbar.setEnabled(False)
+        self.pending += 1
+        self.pool.start(self.task)
+
+    def settle(self, task):
+        # Counts a task as reported back; with none pending the GUI takes
+        # the figure back. True if the canvas was resized or asked to draw
+        # meanwhile, and now sizes the figure to itself and redraws it.
+        self.offscreen = task.canvas
+        self.pending -= 1
+        if self.pending:
+            return False
+        self.figure.set_canvas(self.canvas)
+        self.canvas.setEnabled(True)
+        self.toolbar.setEnabled(True)
+        if self.chart.trend_line is not None:
+            self.chart.trend_line.connect(self.trend_timer)
+        if not self.stale:
+            return False
+        self.stale = False
+        size = self.canvas.size()
+        self.canvas.resizeEvent(QResizeEvent(size, size))
+        return True
+
+    def on_rendered(self, task, image):
+        redrawn = self.settle(task)
+        if task is not self.task:
+            return
+        self.task = None
+        self.note.hide()
+        self.key = task.key
+        # Home, back and forward refer to the views of the chart shown before
+        self.toolbar.update()
+        self.toolbar.setVisible(task.toolbar)
+        if redrawn:
+            return
+        self.put_image(image)
+        if task.key is not None:
+            self.cache.put(self.image_key(task.key), image, memoryview(image).nbytes)
+
+    def on_render_failed(self, task):
+        self.settle(task)
+        if task is self.task:
+            self.task = None
+            self.note.hide()
+            # The figure is empty now; the last pixels stay up until the
+            # next draw
+            self.toolbar.setVisible(False)
+
+    def show_pie(self, expenses, title, key=None):
+        self.show_chart('pie chart', 'show_pie', (expenses, title), key, False)
+
+    def show_period_bars(self, *args, key=None):
+        self.show_chart('period chart', 'show_period_bars', args, key, True)
+
+    def show_category_areas(self, *args, key=None):
+        self.show_chart('category chart', 'show_category_areas', args, key, True)
+
+    def show_trend(self, dates, balances, title, xlabel, ylabel, key=None):
+        self.show_chart('trend chart', 'show_trend', (dates, balances, title, xlabel, ylabel), key, True)
+
+
+# Icons are shared by every widget and table cell that shows them, loaded
+# once per process on first use (QIcon needs the QApplication)
+_ICONS = {}
+
+
+def load_icon(name):
+    icon = _ICONS.get(name)
+    if icon is None:
+        icon = _ICONS[name] = QIcon(f"icons/{name}.svg")
+    return icon
+
+
+INCOME_COLOR = QColor("#66bb6a")
+EXPENSE_COLOR = QColor("#ff5252")
+AMOUNT_CACHE_SIZE = 65536
+
+
+@functools.lru_cache(maxsize=AMOUNT_CACHE_SIZE)
+def format_amount(amount, currency):
+    # Amount cell text; ledgers repeat the same amounts a lot
+    return f"{abs(amount):.2f} {currency_symbol(currency)}"
+
+
+class TransactionTableModel(QAbstractTableModel):
+    # Table model over the transaction list. Cells are produced on demand for
+    # the rows the view actually paints, and mutations are reported as
+    # row-level signals instead of rebuilding the whole table.
+    #
+    # With a filter set (set_query) the model shows only the matching rows,
+    # found through a TransactionIndex; changes then re-run the query and
+    # reset the model, which stays cheap because queries are.
+
+    DATE_COLUMN, TYPE_COLUMN, CATEGORY_COLUMN, AMOUNT_COLUMN = range(4)
+
+    def __init__(self, transactions, headers, income_label, default_currency, columns=None, parent=None):
+        super().__init__(parent)
+        self.transactions = transactions
+        self.headers = headers
+        self.income_label = income_label
+        self.default_currency = default_currency
+        # Source of the store's aggregate columns (see TransactionIndex)
+        self.columns = columns
+        self.filter_index = TransactionIndex(transactions, default_currency, columns)
+        self.query = None
+        # Store rows shown, in order, while a query is set
+        self.rows = None
+        # (store version, store row, record) of the last row read; the view
+        # asks for every role of every column of a row in a row
+        self.last_record = None
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.transactions) if self.rows is None else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.headers[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        column = index.column()
+
+        if role == Qt.ItemDataRole.TextAlignmentRole:
+            if column == self.AMOUNT_COLUMN:
+                return Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+            return Qt.AlignmentFlag.AlignCenter
+
+        # Only these roles need the record
+        if not (role == Qt.ItemDataRole.DisplayRole or
+                role == Qt.ItemDataRole.DecorationRole and column == self.TYPE_COLUMN or
+                role == Qt.ItemDataRole.ForegroundRole and column == self.AMOUNT_COLUMN):
+            return None
+        transaction = self.record(index.row())
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == self.DATE_COLUMN:
+                return transaction['date']
+            if column == self.TYPE_COLUMN:
+                return transaction['type']
+            if column == self.CATEGORY_COLUMN:
+                return transaction['category']
+            return format_amount(transaction['amount'], transaction.get('currency', self.default_currency))
+
+        if role == Qt.ItemDataRole.DecorationRole:
+            return load_icon('income_icon' if transaction['type'] == self.income_label else 'expense_icon')
+
+        # Red for expenses, green for income
+        return EXPENSE_COLOR if transaction['amount'] < 0 else INCOME_COLOR
+
+    def record(self, row):
+        row = self.store_row(row)
+        last = self.last_record
+        if last is not None and last[0] == self.transactions.version and last[1] == row:
+            return last[2]
+        transaction = self.transactions[row]
+        self.last_record = (self.transactions.version, row, transaction)
+        return transaction
+
+    # Above this many separate row ranges a batch delete (or restore) resets
+    # the model instead of emitting one rowsRemoved (rowsInserted) per range
+    MAX_REMOVED_RANGES = 32
+
+    def store_row(self, row):
+        return row if self.rows is None else int(self.rows[row])
+
+    def transaction_at(self, row):
+        return self.transactions[self.store_row(row)]
+
+    def ids_at(self, rows):
+        return [self.transactions[self.store_row(row)]['id'] for row in rows]
+
+    def transactions_at(self, rows):
+        return [self.transactions[self.store_row(row)] for row in rows]
+
+    def set_transactions(self, transactions):
+        self.beginResetModel()
+        self.transactions = transactions
+        self.last_record = None
+        self.filter_index = TransactionIndex(transactions, self.default_currency, self.columns)
+        self._select()
+        self.endResetModel()
+
+    def set_query(self, query):
+        # None (or an empty query) shows every row
+        self.beginResetModel()
+        self.query = None if query is None or query.is_empty() else query
+        self._select()
+        self.endResetModel()
+
+    def _select(self):
+        self.rows = None if self.query is None else self.filter_index.select(self.query)
+
+    def append_columns(self, columns):
+        # A bulk import: one reset instead of per-row notifications
+        self.beginResetModel()
+        self.transactions.extend_columns(columns)
+        self.filter_index.changed()
+        self._select()
+        self.endResetModel()
+
+    def append_transactions(self, transactions):
+        if not transactions:
+            return
+        if self.query is not None:
+            self.beginResetModel()
+            self.transactions.extend(transactions)
+            self._select()
+            self.endResetModel()
+            return
+        row = len(self.transactions)
+        self.beginInsertRows(QModelIndex(), row, row + len(transactions) - 1)
+        self.transactions.extend(transactions)
+        self.endInsertRows()
+
+    def remove_transactions(self, record_ids):
+        self.filter_index.changed()
+        if self.query is not None:
+            self.beginResetModel()
+            removed = self.transactions.remove(record_ids)
+            self._select()
+            self.endResetModel()
+            return removed
+
+        rows = sorted((self.transactions.row_of(record_id) for record_id in record_ids), reverse=True)
+        ranges = []
+        for row in rows:
+            if ranges and ranges[-1][0] == row + 1:
+                ranges[-1][0] = row
+            else:
+                ranges.append([row, row])
+
+        if len(ranges) > self.MAX_REMOVED_RANGES:
+            self.beginResetModel()
+            removed = self.transactions.remove(record_ids)
+            self.endResetModel()
+            return removed
+
+        removed = []
+        # Bottom-up, so earlier row numbers stay valid
+        for first, last in ranges:
+            self.beginRemoveRows(QModelIndex(), first, last)
+            removed.extend(self.transactions.remove_rows(first, last))
+            self.endRemoveRows()
+        return removed
+
+    def restore_transactions(self, records):
+        # Records added under their own ids (see the stores' restore): new
+        # ones at the end, undone deletes back at their rows. Inserts are
+        # announced a block of adjacent rows at a time.
+        records = sorted(records, key=lambda record: record['id'])
+        if not records:
+            return
+        blocks = []
+        for record in records:
+            row = self.transactions.restore_row(record['id'])
+            if blocks and blocks[-1][0] == row:
+                blocks[-1][1].append(record)
+            else:
+                blocks.append((row, [record]))
+        if blocks[0][0] < len(self.transactions):
+            # Rows moved down; appends alone are picked up by the index
+            self.filter_index.changed()
+
+        if self.query is not None:
+            self.beginResetModel()
+            self.transactions.restore(records)
+            self._select()
+            self.endResetModel()
+            return
+
+        if len(blocks) > self.MAX_REMOVED_RANGES:
+            self.beginResetModel()
+            self.transactions.restore(records)
+            self.endResetModel()
+            return
+
+        # Top-down, counting the rows inserted above each block
+        inserted = 0
+        for row, block in blocks:
+            first = row + inserted
+            self.beginInsertRows(QModelIndex(), first, first + len(block) - 1)
+            self.transactions.restore(block)
+            self.endInsertRows()
+            inserted += len(block)
+
+    def transaction_changed(self, record_id):
+        self.filter_index.changed()
+        if self.query is not None:
+            # The row may no longer match
+            self.set_query(self.query)
+            return
+        row = self.transactions.row_of(record_id)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+
+    def currency_changed(self):
+        if self.rowCount():
+            self.dataChanged.emit(
+                self.index(0, self.AMOUNT_COLUMN),
+                self.index(self.rowCount() - 1, self.AMOUNT_COLUMN)
+            )
+
+
+class LedgerLoaderSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
+
+
+class LedgerLoader(QRunnable):
+    # Reads the ledger and the exchange rates and builds the aggregates in
+    # the reporting currency off the GUI thread. The store is handed over
+    # whole once it's open; JSON snapshots report progress while they
+    # stream in.
+
+    def __init__(self, storage, rates_file, currency, aggregates):
+        super().__init__()
+        self.storage = storage
+        self.rates_file = rates_file
+        self.currency = currency
+        # An empty CurrencyAggregates to fill in
+        self.aggregates = aggregates
+        self.signals = LedgerLoaderSignals()
+
+    def run(self):
+        aggregates = self.aggregates
+        if os.path.exists(self.rates_file):
+            try:
+                aggregates.rates = ExchangeRates.load(self.rates_file)
+            except (OSError, ValueError) as e:
+                # Still usable, just without conversion
+                logger.error("Ignoring exchange rates in %s: %s", self.rates_file, e)
+        try:
+            # In KiB, so large files stay within the progress bar's int range
+            store = self.storage.load_store(
+                progress=lambda done, total: self.signals.progress.emit(done // 1024, total // 1024))
+            aggregates.reset(store)
+            # A database-backed store builds them in SQL on first use
+            if not self.storage.lazy:
+                aggregates.in_currency(self.currency)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            logger.exception("Could not load the ledger")
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(store, aggregates)
+
+
+class ImportSignals(QObject):
+    finished = pyqtSignal(object, list)
+    failed = pyqtSignal(str)
+
+
+class ImportTask(QRunnable):
+    # Parses a statement and writes the valid rows to the storage in one
+    # batch; the window then appends them to its store in one go
+    def __init__(self, storage, path, options):
+        super().__init__()
+        self.storage = storage
+        self.path = path
+        self.options = options
+        self.signals = ImportSignals()
+
+    def run(self):
+        try:
+            with diagnostics.measure('import'):
+                columns, errors = read_statement(self.path, **self.options)
+                count = len(columns['amount'])
+                first = self.storage.reserve_ids(count)
+                columns['id'] = np.arange(first, first + count, dtype=np.int64)
+                self.storage.write_columns(columns)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            logger.exception("Could not import %s", self.path)
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(columns, errors)
+        # The rows are committed and shown from here; index upkeep (see
+        # SQLiteStorage.write_columns) holds back only later saves, which
+        # queue behind this task
+        try:
+            with diagnostics.measure('import: finish'):
+                self.storage.finish_columns()
+        except sqlite3.Error:
+            logger.exception("Could not finish importing %s", self.path)
+
+
+class SaveTask(QRunnable):
+    def __init__(self, queue, operations):
+        super().__init__()
+        self.queue = queue
+        self.operations = operations
+
+    def run(self):
+        try:
+            with diagnostics.measure('save'):
+                self.queue.storage.write_batch(self.operations)
+        except (OSError, sqlite3.Error) as e:
+            logger.exception("Could not save %d changes", len(self.operations))
+            self.queue.failed.emit(str(e))
+            return
+        self.queue.saved.emit([payload['id'] for op, payload in self.operations if op != 'delete'])
+
+
+class SaveQueue(QObject):
+    # Collects changes made in quick succession and writes them as one batch
+    # on the I/O pool. Records are copied when queued, so later in-place
+    # edits can't leak into an earlier write.
+    saved = pyqtSignal(list)
+    failed = pyqtSignal(str)
+
+    def __init__(self, storage, pool, delay=200, parent=None):
+        super().__init__(parent)
+        self.storage = storage
+        self.pool = pool
+        self.pending = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self.flush)
+
+    def add(self, record):
+        self.pending.append(('add', dict(record)))
+
+    def edit(self, record):
+        self.pending.append(('edit', dict(record)))
+
+    def delete(self, record_ids):
+        self.pending.append(('delete', list(record_ids)))
+
+    def schedule(self):
+        if self.pending and not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        self.timer.stop()
+        if self.pending:
+            operations, self.pending = self.pending, []
+            self.pool.start(SaveTask(self, operations))
+
+    def close(self):
+        # Write whatever is still queued and wait for it to reach the storage
+        self.flush()
+        self.pool.waitForDone()
+
+
+def format_bytes(count):
+    return f"{count / 2 ** 20:.1f} MiB"
+
+
+def resident_memory():
+    # Bytes of this process currently in RAM, from /proc on Linux or psutil
+    # elsewhere if it's installed; None if neither is available
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class DiagnosticsDialog(QDialog):
+    # Timings recorded by finance_core.diagnostics and the window's memory
+    # use, refreshed while open. Profiling covers the GUI thread only.
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.main_window = window
+        self.setWindowTitle(window.get_text('diagnostics'))
+        self.setMinimumSize(560, 380)
+
+        layout = QVBoxLayout(self)
+        self.enabled_box = QCheckBox(window.get_text('record_timings'))
+        self.enabled_box.setChecked(diagnostics.enabled)
+        self.enabled_box.toggled.connect(self.set_enabled)
+        layout.addWidget(self.enabled_box)
+
+        self.table = QTableWidget(0, 5)
+        self.table.setHorizontalHeaderLabels([window.get_text(key) for key in
+                                              ('operation', 'calls', 'total_ms', 'mean_ms', 'max_ms')])
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        self.memory_label = QLabel()
+        self.memory_label.setWordWrap(True)
+        layout.addWidget(self.memory_label)
+
+        button_layout = QHBoxLayout()
+        reset_button = QPushButton(window.get_text('reset'))
+        reset_button.clicked.connect(self.reset)
+        self.profile_button = QPushButton()
+        self.profile_button.clicked.connect(self.toggle_profile)
+        button_layout.addWidget(reset_button)
+        button_layout.addStretch()
+        button_layout.addWidget(self.profile_button)
+        layout.addLayout(button_layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.timer.start()
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def set_enabled(self, enabled):
+        diagnostics.enabled = enabled
+
+    def reset(self):
+        diagnostics.reset()
+        self.refresh()
+
+    def toggle_profile(self):
+        if diagnostics.profiler is None:
+            diagnostics.start_profile()
+        else:
+            path, _ = QFileDialog.getSaveFileName(self, self.main_window.get_text('save_profile'), "finance.prof",
+                                                  self.main_window.get_text('profiles'))
+            if path:
+                diagnostics.dump_profile(path)
+        self.refresh()
+
+    def refresh(self):
+        rows = diagnostics.report()
+        self.table.setRowCount(len(rows))
+        for row, (name, calls, total, mean, slowest) in enumerate(rows):
+            cells = [name, str(calls), f"{total * 1000:.1f}", f"{mean * 1000:.2f}", f"{slowest * 1000:.1f}"]
+            for column, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if column:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+        # The chart surface's figure plus any pyplot keeps open; no heap scan,
+        # which would stall the GUI thread it is measuring
+        figures = 1 if self.main_window.stats_tab_ready else 0
+        if 'matplotlib.pyplot' in sys.modules:
+            figures += len(sys.modules['matplotlib.pyplot'].get_fignums())
+        rss = resident_memory()
+        transactions = self.main_window.transactions
+        self.memory_label.setText(self.main_window.get_text('memory').format(
+            rows=len(transactions), store=format_bytes(transactions.nbytes()), figures=figures,
+            rss="?" if rss is None else format_bytes(rss)))
+        self.profile_button.setText(self.main_window.get_text(
+            'start_profile' if diagnostics.profiler is None else 'save_profile'))
+
 
 class FinanceCalculator(QMainWindow):
-    def __init__(self):
+    def __init__(self, storage='json', startup_report=False, undo_depth=100):
         super().__init__()
         
         # Dictionary with translations
@@ -41,28 +853,106 @@ class FinanceCalculator(QMainWindow):
                 'fill_fields': "Please fill all fields",
                 'invalid_amount': "Please enter a valid amount",
                 'no_expenses': "No expense data available",
+                'rendering_chart': "Rendering chart…",
                 'expenses_by_category': "Expenses by Category",
                 'balance_dynamics': "Balance Dynamics",
                 'currency': "Currency:",
-                'balance': "Balance"
+                'balance': "Balance",
+                'balance_change': "{change} in range, {balance} at its end",
+                'load_failed': "Could not load the ledger",
+                'save_failed': "Could not save changes",
+                'import': "Import...",
+                'import_statement': "Import Statement",
+                'statements': "Statements (*.csv *.ofx *.qfx *.qif);;All files (*)",
+                'import_done': "Imported {count} transactions",
+                'import_skipped': "{count} rows were skipped, see details",
+                'import_failed': "Could not import the statement",
+                'search': "Search category...",
+                'all_types': "All types",
+                'all_currencies': "All currencies",
+                'date_from': "From YYYY-MM-DD",
+                'date_to': "To YYYY-MM-DD",
+                'min_amount': "Min amount",
+                'max_amount': "Max amount",
+                'filtered': "filtered",
+                'show_periods': "Income vs Expenses",
+                'show_category_trend': "Categories over Time",
+                'periods': ["Day", "Week", "Month", "Year"],
+                'income_expenses': "Income and Expenses",
+                'expenses_over_time': "Expenses by Category over Time",
+                'net': "Net",
+                'other': "Other",
+                'diagnostics': "Diagnostics",
+                'record_timings': "Record timings",
+                'operation': "Operation",
+                'calls': "Calls",
+                'total_ms': "Total, ms",
+                'mean_ms': "Mean, ms",
+                'max_ms': "Max, ms",
+                'reset': "Reset",
+                'start_profile': "Start profiling",
+                'save_profile': "Save profile...",
+                'profiles': "Profiles (*.prof);;All files (*)",
+                'memory': "{rows} transactions, {store} in the store, {figures} chart figures, {rss} process memory in use",
+                'undo': "Undo",
+                'redo': "Redo"
             }
         }
         
         # List of currencies
-        self.currencies = [
-            "USD - $", "EUR - €", "GBP - £", "JPY - ¥", "CNY - ¥", "RUB - ₽",
-            "AUD - $", "CAD - $", "CHF - Fr", "HKD - $", "SGD - $", "SEK - kr",
-            "KRW - ₩", "TRY - ₺", "INR - ₹", "BRL - R$", "ZAR - R", "AED - د.إ",
-            "THB - ฿", "MXN - $"
-        ]
+        self.currencies = list(CURRENCIES)
         
         self.current_lang = 'en'
         self.current_currency = self.currencies[0]  # Default to USD
         
         self.data_file = "finance_data.json"
-        self.transactions = self.load_data()
+        if storage == 'sqlite':
+            self.storage = SQLiteStorage("finance_data.db", self.data_file, self.currencies[0])
+        elif storage == 'binary':
+            self.storage = BinaryStorage("finance_data.fin", self.data_file)
+        else:
+            self.storage = JournalStorage(self.data_file)
+            
+        # The ledger is loaded on the I/O pool once the window has been
+        # painted; saves go through the same single thread so they stay in order
+        self.ledger_state = 'pending'
+        # Actions asked for before the ledger was in (see ensure_loaded)
+        self.after_load = []
+        self.io_pool = QThreadPool(self)
+        self.io_pool.setMaxThreadCount(1)
+        # Charts are built and rasterized on a thread of their own
+        self.render_pool = QThreadPool(self)
+        self.render_pool.setMaxThreadCount(1)
+        self.save_queue = SaveQueue(self.storage, self.io_pool, parent=self)
+        self.save_queue.saved.connect(self.on_saved)
+        self.save_queue.failed.connect(self.on_save_failed)
+        self.import_signals = None
+        self.transactions = ColumnarStore()
+        # Expense totals and balances per reporting currency, converted with
+        # the rates in exchange_rates.csv when there is one
+        self.rates_file = "exchange_rates.csv"
+        self.aggregates = CurrencyAggregates(None, self.currencies[0],
+                                             verify=os.environ.get('FINANCE_VERIFY_AGGREGATES') == '1')
+        self.aggregates.reset(self.transactions)
+        # The chart on the statistics tab, redrawn when the currency changes
+        self.shown_chart = None
+        # Chart data and images of unchanged charts (see chart_key); the
+        # generation counts store replacements, as a new store starts over
+        # at version 0
+        self.chart_cache = ChartCache()
+        self.ledger_generation = 0
+        # The last undo_depth adds, edits and deletes, for undo/redo
+        self.command_log = CommandLog(undo_depth)
+        self.startup_report = startup_report
+        # FINANCE_PROFILE=<file> profiles the GUI thread until the window
+        # closes and writes the result there
+        self.profile_file = os.environ.get('FINANCE_PROFILE')
+        if self.profile_file:
+            diagnostics.start_profile()
+        self.diagnostics_dialog = None
         
         self.init_ui()
+        startup_timer.mark('window built')
         
     def init_ui(self):
         # Main window setup
@@ -70,7 +960,7 @@ class FinanceCalculator(QMainWindow):
         self.setMinimumSize(900, 700)
         
         # Set application icon
-        self.setWindowIcon(QIcon("icons/app_icon.svg"))
+        self.setWindowIcon(load_icon('app_icon'))
         
         # Dark theme with improved styling
         self.setStyleSheet("""
@@ -103,7 +993,7 @@ class FinanceCalculator(QMainWindow):
                 background-color: #333333;
                 color: #d0d0d0;
             }
-            QTableWidget {
+            QTableView {
                 gridline-color: #3a3a3a;
                 background-color: #252525;
                 border: 1px solid #3a3a3a;
@@ -112,11 +1002,11 @@ class FinanceCalculator(QMainWindow):
                 selection-background-color: #4a86e8;
                 selection-color: #ffffff;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
                 border-bottom: 1px solid #2a2a2a;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #4a86e8;
             }
             QHeaderView::section {
@@ -217,13 +1107,172 @@ class FinanceCalculator(QMainWindow):
         
         # Transactions tab
         self.transaction_tab = QWidget()
-        self.tab_widget.addTab(self.transaction_tab, QIcon("icons/income_icon.svg"), self.get_text('add_transaction'))
+        self.tab_widget.addTab(self.transaction_tab, load_icon('income_icon'), self.get_text('add_transaction'))
         self.setup_transaction_tab()
         
-        # Statistics tab
+        # Statistics tab, built on first visit since it pulls in pandas and matplotlib
         self.stats_tab = QWidget()
-        self.tab_widget.addTab(self.stats_tab, QIcon("icons/stats_icon.svg"), self.get_text('statistics'))
-        self.setup_stats_tab()
+        self.stats_tab_ready = False
+        self.tab_widget.addTab(self.stats_tab, load_icon('stats_icon'), self.get_text('statistics'))
+        self.tab_widget.currentChanged.connect(self.on_tab_changed)
+        
+    def on_tab_changed(self, index):
+        if self.tab_widget.widget(index) is self.stats_tab:
+            self.ensure_stats_tab()
+            
+    def ensure_stats_tab(self):
+        if not self.stats_tab_ready:
+            self.stats_tab_ready = True
+            self.setup_stats_tab()
+            
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if 'first paint' not in startup_timer.marks:
+            startup_timer.mark('first paint')
+            # Let this frame reach the screen before loading the ledger
+            QTimer.singleShot(0, self.start_loading)
+            
+    def start_loading(self, background=True):
+        if self.ledger_state != 'pending':
+            return
+        self.ledger_state = 'loading'
+        self.load_started = time.perf_counter()
+        self.set_editable(False)
+        self.load_progress.setRange(0, 0)
+        self.load_progress.show()
+        
+        loader = LedgerLoader(self.storage, self.rates_file, self.current_currency,
+                              CurrencyAggregates(None, self.currencies[0], self.aggregates.verify))
+        loader.signals.progress.connect(self.on_ledger_progress)
+        loader.signals.finished.connect(self.on_ledger_loaded)
+        loader.signals.failed.connect(self.on_ledger_failed)
+        # Keep the signals object alive until its queued signals are delivered
+        self.loader_signals = loader.signals
+        if background:
+            self.io_pool.start(loader)
+        else:
+            loader.run()
+            
+    def ensure_loaded(self, then=None):
+        # Called by actions that need the whole ledger. While it's still
+        # being loaded or imported the action is skipped, and `then` (the
+        # action itself) runs once the ledger is in, so the window never
+        # waits for the I/O pool. Adding and importing are disabled
+        # meanwhile and just return.
+        if self.ledger_state == 'pending':
+            self.start_loading()
+        if self.ledger_state in ('loading', 'importing'):
+            if then is not None and then not in self.after_load:
+                self.after_load.append(then)
+            return False
+        return self.ledger_state == 'loaded'
+        
+    def wait_loaded(self):
+        # Blocks until the ledger is in, for scripts and benchmarks
+        if self.ledger_state == 'pending':
+            self.start_loading(background=False)
+        elif self.ledger_state in ('loading', 'importing'):
+            self.io_pool.waitForDone()
+            QApplication.sendPostedEvents()
+        return self.ledger_state == 'loaded'
+        
+    def run_after_load(self):
+        actions, self.after_load = self.after_load, []
+        for action in actions:
+            action()
+        
+    def on_ledger_progress(self, loaded, total):
+        self.load_progress.setRange(0, total)
+        self.load_progress.setValue(loaded)
+        
+    def on_ledger_loaded(self, store, aggregates):
+        # Cached charts were drawn from the old store (and rates)
+        self.ledger_generation += 1
+        self.command_log.clear()
+        self.transactions = store
+        self.update_transaction_list()
+        self.aggregates = aggregates
+        self.ledger_state = 'loaded'
+        self.loader_signals = None
+        self.load_progress.hide()
+        self.set_editable(True)
+        self.restart_chart()
+        self.run_after_load()
+        
+        startup_timer.measure('ledger load', time.perf_counter() - self.load_started)
+        if diagnostics.enabled:
+            diagnostics.record('load', time.perf_counter() - self.load_started)
+        startup_timer.mark('ledger loaded')
+        if self.startup_report:
+            print(startup_timer.report(), file=sys.stderr)
+            
+    def set_editable(self, editable):
+        self.add_button.setEnabled(editable)
+        self.import_button.setEnabled(editable)
+        self.update_undo_actions()
+        
+    def import_statement(self):
+        if not self.ensure_loaded():
+            return
+        path, _ = QFileDialog.getOpenFileName(self, self.get_text('import_statement'), "",
+                                              self.get_text('statements'))
+        if not path:
+            return
+            
+        # Edits are blocked until the batch is in; queued ones go first
+        self.ledger_state = 'importing'
+        self.set_editable(False)
+        self.load_progress.setRange(0, 0)
+        self.load_progress.show()
+        self.save_queue.flush()
+        
+        task = ImportTask(self.storage, path, dict(
+            income_label=self.get_text('income'),
+            expense_label=self.get_text('expense'),
+            currency=self.current_currency,
+            currencies=self.currencies
+        ))
+        task.signals.finished.connect(self.on_import_finished)
+        task.signals.failed.connect(self.on_import_failed)
+        self.import_signals = task.signals
+        self.io_pool.start(task)
+        
+    def on_import_finished(self, columns, errors):
+        self.transaction_model.append_columns(columns)
+        self.aggregates.reset(self.transactions)
+        self.end_import()
+        self.restart_chart()
+        if self.storage.needs_compaction():
+            self.storage.compact(self.transactions)
+            
+        message = QMessageBox(self)
+        message.setWindowTitle(self.get_text('import_statement'))
+        message.setText(self.get_text('import_done').format(count=len(columns['amount'])))
+        if errors:
+            message.setIcon(QMessageBox.Icon.Warning)
+            message.setInformativeText(self.get_text('import_skipped').format(count=len(errors)))
+            message.setDetailedText("\n".join(errors))
+        message.exec()
+        
+    def on_import_failed(self, message):
+        self.end_import()
+        QMessageBox.critical(self, self.get_text('error'), f"{self.get_text('import_failed')}: {message}")
+        
+    def end_import(self):
+        self.ledger_state = 'loaded'
+        self.import_signals = None
+        self.load_progress.hide()
+        self.set_editable(True)
+        self.run_after_load()
+        
+    def on_ledger_failed(self, message):
+        # Leave the form disabled so nothing gets written over a ledger we
+        # couldn't read
+        self.ledger_state = 'failed'
+        self.after_load = []
+        self.loader_signals = None
+        self.load_progress.hide()
+        QMessageBox.critical(self, self.get_text('error'), f"{self.get_text('load_failed')}: {message}")
         
     def setup_settings_panel(self, main_layout):
         settings_frame = QFrame()
@@ -262,17 +1311,29 @@ class FinanceCalculator(QMainWindow):
         settings_layout.addWidget(currency_label)
         settings_layout.addWidget(self.currency_combo)
         
+        diagnostics_button = QPushButton(self.get_text('diagnostics'))
+        diagnostics_button.clicked.connect(self.show_diagnostics)
+        settings_layout.addWidget(diagnostics_button)
+        
         main_layout.addWidget(settings_frame)
         
+    def show_diagnostics(self):
+        if self.diagnostics_dialog is None:
+            self.diagnostics_dialog = DiagnosticsDialog(self)
+        self.diagnostics_dialog.show()
+        self.diagnostics_dialog.raise_()
+        
     def on_currency_change(self, currency):
         self.current_currency = currency
-        self.update_transaction_list()
+        self.transaction_model.currency_changed()
+        if self.shown_chart is not None:
+            self.shown_chart()
         
     def get_text(self, key):
         return self.translations[self.current_lang].get(key, key)
         
     def get_currency_symbol(self):
-        return self.current_currency.split(' - ')[1]
+        return currency_symbol(self.current_currency)
         
     def setup_transaction_tab(self):
         layout = QVBoxLayout(self.transaction_tab)
@@ -310,8 +1371,8 @@ class FinanceCalculator(QMainWindow):
         self.type_combo.addItems([self.get_text('income'), self.get_text('expense')])
         
         # Добавляем иконки к типам транзакций
-        self.type_combo.setItemIcon(0, QIcon("icons/income_icon.svg"))
-        self.type_combo.setItemIcon(1, QIcon("icons/expense_icon.svg"))
+        self.type_combo.setItemIcon(0, load_icon('income_icon'))
+        self.type_combo.setItemIcon(1, load_icon('expense_icon'))
         
         form_layout.addRow(QLabel(self.get_text('type')), self.type_combo)
         
@@ -325,11 +1386,30 @@ class FinanceCalculator(QMainWindow):
         button_layout.addStretch()
         
         self.add_button = QPushButton(self.get_text('add'))
-        self.add_button.setIcon(QIcon("icons/income_icon.svg"))
+        self.add_button.setIcon(load_icon('income_icon'))
         self.add_button.setIconSize(QSize(16, 16))
         self.add_button.clicked.connect(self.add_transaction)
         button_layout.addWidget(self.add_button)
         
+        self.import_button = QPushButton(self.get_text('import'))
+        self.import_button.clicked.connect(self.import_statement)
+        button_layout.addWidget(self.import_button)
+        
+        # Undo/redo of adds, edits and deletes, also on Ctrl+Z / Ctrl+Shift+Z
+        # wherever a text field doesn't take them
+        self.undo_button = QPushButton(self.get_text('undo'))
+        self.undo_button.clicked.connect(self.undo)
+        button_layout.addWidget(self.undo_button)
+        self.redo_button = QPushButton(self.get_text('redo'))
+        self.redo_button.clicked.connect(self.redo)
+        button_layout.addWidget(self.redo_button)
+        for key, slot in ((QKeySequence.StandardKey.Undo, self.undo), (QKeySequence.StandardKey.Redo, self.redo)):
+            action = QAction(self)
+            action.setShortcut(key)
+            action.triggered.connect(slot)
+            self.addAction(action)
+        self.update_undo_actions()
+        
         form_layout.addRow("", button_layout)
         
         layout.addWidget(form_frame)
@@ -353,23 +1433,38 @@ class FinanceCalculator(QMainWindow):
         table_header.setStyleSheet("font-size: 16px; font-weight: bold; color: #4a86e8;")
         table_layout.addWidget(table_header)
         
-        self.transaction_table = QTableWidget()
-        self.transaction_table.setColumnCount(4)
-        self.transaction_table.setHorizontalHeaderLabels([
-            self.get_text('date'),
-            self.get_text('type'),
-            self.get_text('category'),
-            self.get_text('amount')
-        ])
+        self.setup_filter_bar(table_layout)
+        
+        self.load_progress = QProgressBar()
+        self.load_progress.setMaximumHeight(6)
+        self.load_progress.setTextVisible(False)
+        self.load_progress.hide()
+        table_layout.addWidget(self.load_progress)
+        
+        self.transaction_model = TransactionTableModel(
+            self.transactions,
+            [self.get_text('date'), self.get_text('type'), self.get_text('category'), self.get_text('amount')],
+            self.get_text('income'),
+            self.currencies[0],
+            # Shared with the charts, so a lazy store is read once for both
+            columns=lambda: self.aggregates.columns()
+        )
+        self.transaction_table = QTableView()
+        self.transaction_table.setModel(self.transaction_model)
+        self.transaction_table.verticalHeader().setVisible(False)
         
         # Table setup
         self.transaction_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         self.transaction_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
-        self.transaction_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
-        self.transaction_table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        # Dates all have the same width; size the column from the visible
+        # rows instead of reading the first thousand on every reset
+        self.transaction_table.horizontalHeader().setResizeContentsPrecision(0)
+        self.transaction_table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.transaction_table.setSelectionMode(QTableView.SelectionMode.ExtendedSelection)
+        self.transaction_table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
         self.transaction_table.setAlternatingRowColors(True)
         self.transaction_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 alternate-background-color: #2a2a2a;
             }
         """)
@@ -381,8 +1476,88 @@ class FinanceCalculator(QMainWindow):
         table_layout.addWidget(self.transaction_table)
         layout.addWidget(table_frame)
         
-        # Fill table with data
-        self.update_transaction_list()
+    def setup_filter_bar(self, table_layout):
+        # Filters the table (and the charts) as you type; the query runs once
+        # typing pauses
+        filter_layout = QHBoxLayout()
+        filter_layout.setSpacing(8)
+        
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(250)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText(self.get_text('search'))
+        self.search_edit.setClearButtonEnabled(True)
+        filter_layout.addWidget(self.search_edit, 2)
+        
+        self.filter_type_combo = QComboBox()
+        self.filter_type_combo.addItems([self.get_text('all_types'), self.get_text('income'), self.get_text('expense')])
+        filter_layout.addWidget(self.filter_type_combo)
+        
+        self.filter_currency_combo = QComboBox()
+        self.filter_currency_combo.addItems([self.get_text('all_currencies')] + self.currencies)
+        filter_layout.addWidget(self.filter_currency_combo)
+        
+        self.filter_edits = {}
+        for key in ('date_from', 'date_to', 'min_amount', 'max_amount'):
+            edit = QLineEdit()
+            edit.setPlaceholderText(self.get_text(key))
+            edit.setFixedWidth(120)
+            edit.textChanged.connect(self.schedule_filter)
+            filter_layout.addWidget(edit)
+            self.filter_edits[key] = edit
+            
+        self.search_edit.textChanged.connect(self.schedule_filter)
+        self.filter_type_combo.currentIndexChanged.connect(self.filter_timer.start)
+        self.filter_currency_combo.currentIndexChanged.connect(self.filter_timer.start)
+        table_layout.addLayout(filter_layout)
+        
+    def schedule_filter(self):
+        # Restarts the wait on every keystroke
+        self.filter_timer.start()
+        
+    def filter_query(self):
+        # The filter bar as a TransactionQuery; fields that don't parse are
+        # marked and left out
+        values = {}
+        for key, edit in self.filter_edits.items():
+            text = edit.text().strip()
+            value = None
+            try:
+                if text and key.startswith('date'):
+                    TransactionQuery(start=text)
+                    value = text
+                elif text:
+                    value = abs(float(text))
+                edit.setStyleSheet("")
+            except ValueError:
+                edit.setStyleSheet("border: 1px solid #ff5252;")
+            values[key] = value
+        type_index = self.filter_type_combo.currentIndex()
+        currency_index = self.filter_currency_combo.currentIndex()
+        return TransactionQuery(
+            self.search_edit.text(),
+            type=[None, self.get_text('income'), self.get_text('expense')][type_index],
+            currency=self.currencies[currency_index - 1] if currency_index > 0 else None,
+            start=values['date_from'],
+            end=values['date_to'],
+            min_amount=values['min_amount'],
+            max_amount=values['max_amount']
+        )
+        
+    def apply_filter(self):
+        if not self.ensure_loaded(self.apply_filter):
+            return
+        self.transaction_model.set_query(self.filter_query())
+        if self.shown_chart is not None:
+            self.shown_chart()
+            
+    def filtered_aggregates(self, query):
+        # (expense summary, BalanceIndex) in the selected currency over the
+        # rows matching `query`
+        return self.aggregates.subset(self.current_currency, query, self.transaction_model.filter_index)
         
     def show_context_menu(self, position):
         menu = QMenu()
@@ -399,33 +1574,20 @@ class FinanceCalculator(QMainWindow):
         
     def delete_selected_transaction(self):
         selected_rows = self.transaction_table.selectionModel().selectedRows()
-        if not selected_rows:
+        if not selected_rows or self.ledger_state != 'loaded':
             return
             
-        row = selected_rows[0].row()
-        date_str = self.transaction_table.item(row, 0).text()
-        
-        for i, transaction in enumerate(self.transactions):
-            if transaction['date'] == date_str:
-                self.transactions.pop(i)
-                break
-                
-        self.save_data()
-        self.update_transaction_list()
+        with diagnostics.measure('delete'):
+            records = self.transaction_model.transactions_at(index.row() for index in selected_rows)
+            self.change('delete', [dict(record) for record in records])
         
     def edit_selected_transaction(self):
         selected_rows = self.transaction_table.selectionModel().selectedRows()
-        if not selected_rows:
+        if not selected_rows or self.ledger_state != 'loaded':
             return
             
-        row = selected_rows[0].row()
-        date_str = self.transaction_table.item(row, 0).text()
-        
-        transaction = None
-        for t in self.transactions:
-            if t['date'] == date_str:
-                transaction = t
-                break
+        record_id = self.transaction_model.ids_at([selected_rows[0].row()])[0]
+        transaction = self.transactions.get(record_id)
                 
         if transaction:
             dialog = QDialog(self)
@@ -487,12 +1649,15 @@ class FinanceCalculator(QMainWindow):
                     if type_combo.currentText() == self.get_text('expense'):
                         amount = -amount
                         
-                    transaction['amount'] = amount
-                    transaction['type'] = type_combo.currentText()
-                    transaction['category'] = category_edit.text()
-                    
-                    self.save_data()
-                    self.update_transaction_list()
+                    with diagnostics.measure('edit'):
+                        old_transaction = dict(transaction)
+                        new_transaction = dict(
+                            old_transaction,
+                            amount=amount,
+                            type=type_combo.currentText(),
+                            category=category_edit.text()
+                        )
+                        self.change('edit', [(old_transaction, new_transaction)])
                     
                 except ValueError:
                     QMessageBox.critical(self, self.get_text('error'), self.get_text('invalid_amount'))
@@ -523,17 +1688,36 @@ class FinanceCalculator(QMainWindow):
         button_layout.addStretch()
         
         expenses_button = QPushButton(self.get_text('show_expenses'))
-        expenses_button.setIcon(QIcon("icons/expense_icon.svg"))
+        expenses_button.setIcon(load_icon('expense_icon'))
         expenses_button.setIconSize(QSize(16, 16))
         expenses_button.clicked.connect(self.show_expense_pie_chart)
         
         balance_button = QPushButton(self.get_text('show_balance'))
-        balance_button.setIcon(QIcon("icons/stats_icon.svg"))
+        balance_button.setIcon(load_icon('stats_icon'))
         balance_button.setIconSize(QSize(16, 16))
         balance_button.clicked.connect(self.show_balance_trend)
         
+        periods_button = QPushButton(self.get_text('show_periods'))
+        periods_button.setIcon(load_icon('stats_icon'))
+        periods_button.setIconSize(QSize(16, 16))
+        periods_button.clicked.connect(self.show_period_chart)
+        
+        category_trend_button = QPushButton(self.get_text('show_category_trend'))
+        category_trend_button.setIcon(load_icon('expense_icon'))
+        category_trend_button.setIconSize(QSize(16, 16))
+        category_trend_button.clicked.connect(self.show_category_trend)
+        
+        # Bucket size of the two period charts
+        self.period_combo = QComboBox()
+        self.period_combo.addItems(self.get_text('periods'))
+        self.period_combo.setCurrentIndex(2)
+        self.period_combo.currentIndexChanged.connect(self.on_period_change)
+        
         button_layout.addWidget(expenses_button)
         button_layout.addWidget(balance_button)
+        button_layout.addWidget(periods_button)
+        button_layout.addWidget(category_trend_button)
+        button_layout.addWidget(self.period_combo)
         
         layout.addWidget(button_frame)
         
@@ -551,9 +1735,16 @@ class FinanceCalculator(QMainWindow):
         self.plot_layout = QVBoxLayout(self.plot_frame)
         self.plot_layout.setContentsMargins(25, 25, 25, 25)
         
+        # One canvas showing every chart, rendered on the render pool
+        self.chart_surface = ChartSurface(self.chart_cache, self.render_pool, self.get_text('rendering_chart'),
+                                          self.plot_frame)
+        self.plot_layout.addWidget(self.chart_surface)
+        
         layout.addWidget(self.plot_frame)
         
     def add_transaction(self):
+        if not self.ensure_loaded():
+            return
         try:
             amount_text = self.amount_edit.text()
             transaction_type = self.type_combo.currentText()
@@ -568,6 +1759,7 @@ class FinanceCalculator(QMainWindow):
                 amount = -amount
                 
             transaction = {
+                "id": self.storage.new_id(),
                 "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "type": transaction_type,
                 "category": category,
@@ -575,9 +1767,8 @@ class FinanceCalculator(QMainWindow):
                 "currency": self.current_currency
             }
             
-            self.transactions.append(transaction)
-            self.save_data()
-            self.update_transaction_list()
+            with diagnostics.measure('add'):
+                self.change('add', [transaction])
             
             # Clear input fields
             self.amount_edit.clear()
@@ -588,191 +1779,284 @@ class FinanceCalculator(QMainWindow):
             QMessageBox.critical(self, self.get_text('error'), self.get_text('invalid_amount'))
             
     def update_transaction_list(self):
-        self.transaction_table.setRowCount(0)
-        
-        for transaction in self.transactions:
-            currency = transaction.get('currency', self.currencies[0])
-            currency_symbol = currency.split(' - ')[1]
-            
-            row = self.transaction_table.rowCount()
-            self.transaction_table.insertRow(row)
-            
-            # Date
-            date_item = QTableWidgetItem(transaction['date'])
-            date_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            self.transaction_table.setItem(row, 0, date_item)
-            
-            # Type
-            type_item = QTableWidgetItem(transaction['type'])
-            type_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            
-            # Добавляем иконку к типу транзакции
-            if transaction['type'] == self.get_text('income'):
-                type_item.setIcon(QIcon("icons/income_icon.svg"))
-            else:
-                type_item.setIcon(QIcon("icons/expense_icon.svg"))
-                
-            self.transaction_table.setItem(row, 1, type_item)
-            
-            # Category
-            category_item = QTableWidgetItem(transaction['category'])
-            category_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-            self.transaction_table.setItem(row, 2, category_item)
-            
-            # Amount
-            amount_str = f"{abs(transaction['amount']):.2f} {currency_symbol}"
-            amount_item = QTableWidgetItem(amount_str)
-            amount_item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
-            
-            # Set color for amount depending on transaction type
-            if transaction['amount'] < 0:
-                amount_item.setForeground(QColor("#ff5252"))  # Red for expenses
-            else:
-                amount_item.setForeground(QColor("#66bb6a"))  # Green for income
-                
-            self.transaction_table.setItem(row, 3, amount_item)
+        # Full refresh, e.g. after the ledger was reloaded from disk
+        with diagnostics.measure('table refresh'):
+            self.transaction_model.set_transactions(self.transactions)
             
+    def ledger_version(self):
+        # Changes with every edit of the store and when it's replaced
+        return (self.ledger_generation, self.transactions.version)
+        
+    def chart_key(self, chart):
+        # What a chart depends on: the filter, currency, period and ledger
+        query = self.transaction_model.query
+        period = self.selected_period() if chart in ('bars', 'areas') else None
+        return (chart, None if query is None else query.key(), self.current_currency, period,
+                self.ledger_version())
+        
+    def chart_data(self, key, compute):
+        # compute()'s result for `key`, memoized in the chart cache
+        self.chart_cache.invalidate(key[-1])
+        data = self.chart_cache.get(('data', key))
+        if data is None:
+            data = compute()
+            self.chart_cache.put(('data', key), data)
+        return data
+        
     def show_expense_pie_chart(self):
-        # Clear previous chart
-        for i in reversed(range(self.plot_layout.count())):
-            self.plot_layout.itemAt(i).widget().setParent(None)
-            
-        # Create DataFrame from transactions
-        df = pd.DataFrame(self.transactions)
+        if not self.ensure_loaded(self.show_expense_pie_chart):
+            return
+        self.ensure_stats_tab()
         
-        # Filter only expenses and group by category
-        if not df.empty:
-            expenses = df[df['amount'] < 0].groupby('category')['amount'].sum().abs()
-            
-            if expenses.empty:
-                QMessageBox.information(self, self.get_text('error'), self.get_text('no_expenses'))
-                return
-                
-            # Create chart
-            plt.style.use('dark_background')
-            fig, ax = plt.subplots(figsize=(8, 6), dpi=100, facecolor='#252525')
-            
-            # Color scheme - улучшенная цветовая схема
-            colors = ['#4a86e8', '#ff9900', '#9c27b0', '#e53935', '#43a047', 
-                     '#795548', '#607d8b', '#f44336', '#3f51b5', '#009688',
-                     '#ff5722', '#8bc34a', '#ffc107', '#03a9f4', '#673ab7']
-            
-            wedges, texts, autotexts = ax.pie(
-                expenses, 
-                labels=expenses.index,
-                autopct='%1.1f%%',
-                textprops={'fontsize': 10, 'color': '#f0f0f0', 'fontweight': 'bold'},
-                pctdistance=0.85,
-                labeldistance=1.1,
-                colors=colors,
-                wedgeprops={'edgecolor': '#252525', 'linewidth': 2, 'antialiased': True},
-                shadow=True
-            )
-            
-            # Configure appearance
-            ax.set_title(self.get_text('expenses_by_category'), fontsize=16, pad=20, color='#f0f0f0', fontweight='bold')
-            
-            # Add legend with improved styling
-            ax.legend(
-                wedges, 
-                expenses.index,
-                title="Categories",
-                loc="center left",
-                bbox_to_anchor=(1, 0, 0.5, 1),
-                fontsize=10,
-                frameon=False,
-                title_fontsize=12
-            )
-            
-            plt.axis('equal')
-            plt.tight_layout()
-            
-            # Add chart to form
-            canvas = FigureCanvas(fig)
-            self.plot_layout.addWidget(canvas)
+        key = self.chart_key('pie')
+        with diagnostics.measure('pie chart: data'):
+            expenses, title = self.chart_data(key, self.pie_chart_data)
+        
+        if not expenses.empty:
+            self.chart_surface.show_pie(expenses, title, key=key)
+            self.shown_chart = self.show_expense_pie_chart
         else:
+            self.chart_surface.clear()
+            self.shown_chart = None
             QMessageBox.information(self, self.get_text('error'), self.get_text('no_expenses'))
             
-    def show_balance_trend(self):
-        # Clear previous chart
-        for i in reversed(range(self.plot_layout.count())):
-            self.plot_layout.itemAt(i).widget().setParent(None)
-            
-        # Create DataFrame from transactions
-        df = pd.DataFrame(self.transactions)
-        
-        if not df.empty:
-            # Convert dates and sort
-            df['date'] = pd.to_datetime(df['date'])
-            df = df.sort_values('date')
-            
-            # Calculate cumulative sum for balance
-            df['balance'] = df['amount'].cumsum()
-            
-            # Create chart
-            plt.style.use('dark_background')
-            fig, ax = plt.subplots(figsize=(8, 5), dpi=100, facecolor='#252525')
-            
-            # Configure balance line with improved styling
-            ax.plot(
-                df['date'], 
-                df['balance'], 
-                marker='o', 
-                linestyle='-', 
-                linewidth=3, 
-                color='#4a86e8',
-                markersize=8,
-                markerfacecolor='#252525',
-                markeredgewidth=2,
-                markeredgecolor='#4a86e8'
-            )
+    def pie_chart_data(self):
+        # Expense totals per category, maintained incrementally; with the
+        # table filtered, summed over the matching rows instead
+        query = self.transaction_model.query
+        title = self.get_text('expenses_by_category')
+        if query is None:
+            totals = self.aggregates.category_totals(self.current_currency)
+            return totals.expenses_by_category(self.transactions), title
+        summary, index = self.filtered_aggregates(query)
+        return CategoryTotals(summary).expenses_by_category(), f"{title} ({self.get_text('filtered')})"
             
-            # Add fill under line with gradient
-            ax.fill_between(
-                df['date'], 
-                df['balance'], 
-                alpha=0.3, 
-                color='#4a86e8'
+    def show_balance_trend(self):
+        if not self.ensure_loaded(self.show_balance_trend):
+            return
+        self.ensure_stats_tab()
+        
+        key = self.chart_key('trend')
+        with diagnostics.measure('trend chart: data'):
+            dates, balances, title = self.chart_data(key, self.trend_chart_data)
+        
+        if len(dates):
+            self.chart_surface.show_trend(
+                dates,
+                balances,
+                title,
+                self.get_text('date'),
+                f"{self.get_text('balance')} ({self.get_currency_symbol()})",
+                key=key
             )
+            self.shown_chart = self.show_balance_trend
+        else:
+            self.chart_surface.clear()
+            self.shown_chart = None
+            QMessageBox.information(self, self.get_text('error'), self.get_text('no_expenses'))
             
-            # Configure appearance with improved styling
-            ax.set_title(self.get_text('balance_dynamics'), fontsize=16, pad=20, color='#f0f0f0', fontweight='bold')
-            ax.set_xlabel(self.get_text('date'), fontsize=12, color='#e0e0e0', fontweight='bold')
-            ax.set_ylabel(f"{self.get_text('balance')} ({self.get_currency_symbol()})", fontsize=12, color='#e0e0e0', fontweight='bold')
-            
-            # Grid setup with improved styling
-            ax.grid(True, linestyle='--', alpha=0.3, color='#505050', linewidth=0.8)
+    def trend_chart_data(self):
+        # Running balance ordered by date, maintained incrementally. With the
+        # table filtered it runs over the matching rows, and a date range
+        # clips it rather than dropping the opening balance.
+        query = self.transaction_model.query
+        title = self.get_text('balance_dynamics')
+        # The series are views of the index, which later edits change in
+        # place, so the chart gets copies
+        if query is None:
+            dates, balances = self.aggregates.balance_index(self.current_currency).series()
+            return dates.copy(), balances.copy(), title
+        summary, index = self.filtered_aggregates(query.without_dates())
+        bound = lambda time: None if time is None else np.datetime64(time, 's')
+        start, end = bound(query.start_time), bound(query.end_time)
+        dates, balances = index.series(start, end)
+        title = f"{title} ({self.get_text('filtered')})"
+        if len(dates) and (start is not None or end is not None):
+            # Looked up on the index, so the range's change leaves out the
+            # opening balance carried in from before it
+            start = dates[0] if start is None else start
+            end = dates[-1] if end is None else end
+            symbol = self.get_currency_symbol()
+            title += "\n" + self.get_text('balance_change').format(
+                change=f"{index.change_between(start, end):+,.2f} {symbol}",
+                balance=f"{index.balance_at(end):,.2f} {symbol}")
+        return dates.copy(), balances.copy(), title
             
-            # Axis formatting with improved styling
-            ax.spines['top'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-            ax.spines['left'].set_color('#505050')
-            ax.spines['bottom'].set_color('#505050')
+    def period_rollups(self):
+        # (Rollups, title suffix) in the selected currency, over the rows
+        # matching the table filter if one is set
+        query = self.transaction_model.query
+        if query is None:
+            return self.aggregates.rollups(self.current_currency), ""
+        return self.aggregates.subset_rollups(self.current_currency, query, self.transaction_model.filter_index), \
+            f" ({self.get_text('filtered')})"
+        
+    def selected_period(self):
+        return Rollups.PERIODS[self.period_combo.currentIndex()]
+        
+    def on_period_change(self, index):
+        if self.shown_chart in (self.show_period_chart, self.show_category_trend):
+            self.shown_chart()
             
-            # Улучшенное форматирование меток осей
-            ax.tick_params(axis='both', colors='#e0e0e0', labelsize=10)
+    def show_period_chart(self):
+        if not self.ensure_loaded(self.show_period_chart):
+            return
+        self.ensure_stats_tab()
+        
+        key = self.chart_key('bars')
+        with diagnostics.measure('period chart: data'):
+            starts, income, expenses, suffix = self.chart_data(key, self.period_chart_data)
+        
+        if len(starts):
+            self.chart_surface.show_period_bars(
+                self.selected_period(), starts, income, expenses,
+                self.get_text('income_expenses') + suffix,
+                (self.get_text('income'), self.get_text('expense'), self.get_text('net')),
+                self.get_text('date'),
+                self.get_currency_symbol(),
+                key=key
+            )
+            self.shown_chart = self.show_period_chart
+        else:
+            self.chart_surface.clear()
+            self.shown_chart = None
+            QMessageBox.information(self, self.get_text('error'), self.get_text('no_expenses'))
             
-            plt.tight_layout()
+    def period_chart_data(self):
+        # Income and expenses per period, read from the rollups
+        rollups, suffix = self.period_rollups()
+        starts, income, expenses, net = rollups.series(self.selected_period())
+        return starts, income, expenses, suffix
             
-            # Add chart to form
-            canvas = FigureCanvas(fig)
-            self.plot_layout.addWidget(canvas)
+    def show_category_trend(self):
+        if not self.ensure_loaded(self.show_category_trend):
+            return
+        self.ensure_stats_tab()
+        
+        key = self.chart_key('areas')
+        with diagnostics.measure('category chart: data'):
+            starts, categories, values, suffix = self.chart_data(key, self.category_chart_data)
+        
+        if len(starts):
+            self.chart_surface.show_category_areas(
+                starts, categories, values,
+                self.get_text('expenses_over_time') + suffix,
+                self.get_text('date'),
+                self.get_currency_symbol(),
+                key=key
+            )
+            self.shown_chart = self.show_category_trend
         else:
+            self.chart_surface.clear()
+            self.shown_chart = None
             QMessageBox.information(self, self.get_text('error'), self.get_text('no_expenses'))
             
-    def load_data(self):
-        if os.path.exists(self.data_file):
-            with open(self.data_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return []
+    def category_chart_data(self):
+        # Expenses per category per period, stacked, read from the rollups
+        rollups, suffix = self.period_rollups()
+        starts, categories, values = rollups.category_series(self.selected_period(), other=self.get_text('other'))
+        return starts, categories, values, suffix
+            
+    def change(self, kind, changes):
+        # A user action (see CommandLog for the shape of `changes`): applied,
+        # and recorded so it can be undone
+        self.apply_change(kind, changes)
+        self.command_log.record(kind, changes)
+        self.update_undo_actions()
+        
+    def apply_change(self, kind, changes):
+        # Applies a change to the store, the table and the aggregates as a
+        # delta and queues it for saving
+        if kind == 'add':
+            # New records get the highest ids and go to the end; undone
+            # deletes go back to their old rows
+            self.transaction_model.restore_transactions([dict(record) for record in changes])
+            for record in changes:
+                self.aggregates.add(record)
+                self.save_queue.add(record)
+        elif kind == 'delete':
+            record_ids = [record['id'] for record in changes]
+            for transaction in self.transaction_model.remove_transactions(record_ids):
+                self.aggregates.remove(transaction)
+            self.save_queue.delete(record_ids)
+        else:
+            for before, after in changes:
+                fields = {field: value for field, value in after.items() if field != 'id'}
+                transaction = self.transactions.update(after['id'], **fields)
+                self.aggregates.replace(before, transaction)
+                self.save_queue.edit(transaction)
+                self.transaction_model.transaction_changed(after['id'])
+        self.save_data()
+        self.restart_chart()
+        
+    def restart_chart(self):
+        # A chart still rendering shows the ledger from before a change;
+        # start it over with the current data
+        if self.stats_tab_ready and self.chart_surface.rendering() and self.shown_chart is not None:
+            self.shown_chart()
+        
+    def undo(self):
+        if self.ledger_state != 'loaded' or not self.command_log.can_undo():
+            return
+        with diagnostics.measure('undo'):
+            self.apply_change(*self.command_log.undo())
+        self.update_undo_actions()
+        
+    def redo(self):
+        if self.ledger_state != 'loaded' or not self.command_log.can_redo():
+            return
+        with diagnostics.measure('redo'):
+            self.apply_change(*self.command_log.redo())
+        self.update_undo_actions()
+        
+    def update_undo_actions(self):
+        loaded = self.ledger_state == 'loaded'
+        self.undo_button.setEnabled(loaded and self.command_log.can_undo())
+        self.redo_button.setEnabled(loaded and self.command_log.can_redo())
         
     def save_data(self):
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.transactions, f, ensure_ascii=False, indent=2)
+        # Queued changes are written in the background shortly after the
+        # last one
+        self.save_queue.schedule()
+        
+    def on_saved(self, record_ids):
+        self.transactions.mark_saved(record_ids)
+        # Changes are journaled; only fold them into a new snapshot once the
+        # journal gets large
+        if self.storage.needs_compaction():
+            self.storage.compact(self.transactions)
+            
+    def on_save_failed(self, message):
+        QMessageBox.critical(self, self.get_text('error'), f"{self.get_text('save_failed')}: {message}")
+        
+    def closeEvent(self, event):
+        # Nothing queued may be lost on exit. A running import still
+        # finishes writing, but there's no window left to report to.
+        if self.import_signals is not None:
+            self.import_signals.finished.disconnect()
+            self.import_signals.failed.disconnect()
+        if self.stats_tab_ready:
+            self.chart_surface.cancel()
+        self.render_pool.waitForDone()
+        self.save_queue.close()
+        QApplication.sendPostedEvents()
+        self.storage.close()
+        if self.profile_file and diagnostics.profiler is not None:
+            diagnostics.dump_profile(self.profile_file)
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="Finance Calculator")
+    parser.add_argument('--storage', choices=['json', 'sqlite', 'binary'], default='json',
+                        help="ledger storage engine (sqlite and binary import finance_data.json on first run)")
+    parser.add_argument('--startup-report', action='store_true',
+                        help="print import, ledger load and first paint timings to stderr")
+    parser.add_argument('--undo-depth', type=int, default=100,
+                        help="number of adds, edits and deletes that can be undone")
+    args, qt_args = parser.parse_known_args()
+    
+    app = QApplication(sys.argv[:1] + qt_args)
     
     # Set global styles for application
     app.setStyle("Fusion")
@@ -781,7 +2065,7 @@ if __name__ == "__main__":
     font = QFont("Segoe UI", 10)
     app.setFont(font)
     
-    window = FinanceCalculator()
+    window = FinanceCalculator(storage=args.storage, startup_report=args.startup_report, undo_depth=args.undo_depth)
     window.show()
     
     sys.exit(app.exec())
@@ -0,0 +1,307 @@
+# Command-line access to a ledger without starting the GUI, e.g. for
+# nightly jobs:
+#
+#   python finance_cli.py import statements.csv
+#   python finance_cli.py totals --format json
+#   python finance_cli.py --rates exchange_rates.csv totals --currency EUR
+#   python finance_cli.py balance --start 2024-01-01 > balance.csv
+#   python finance_cli.py balance --at 2024-06-30
+#   python finance_cli.py rollup --period month
+#   python finance_cli.py chart trend -o balance.png
+#   python finance_cli.py report --period year 2022.json 2023.json 2024.json
+#   python finance_cli.py convert finance_data.json finance_data.fin
+#   python finance_cli.py --profile totals.prof totals
+#
+# Only finance_core is used, so PyQt6 is never imported.
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+from finance_core import (JournalStorage, SQLiteStorage, BinaryStorage, Ledger, ExchangeRates, Rollups, ChartFigure,
+                          TransactionQuery, CURRENCIES, aggregate_ledgers, currency_code, diagnostics,
+                          iter_transactions)
+
+DEFAULT_LEDGERS = {'json': "finance_data.json", 'sqlite': "finance_data.db", 'binary': "finance_data.fin"}
+DEFAULT_RATES = "exchange_rates.csv"
+
+
+def currency_label(value):
+    # Accepts a code ("EUR") or a full label ("EUR - €")
+    for label in CURRENCIES:
+        if currency_code(label) == currency_code(value).upper():
+            return label
+    raise argparse.ArgumentTypeError(f"unknown currency {value!r}")
+
+
+def load_rates(args):
+    if args.rates or os.path.exists(DEFAULT_RATES):
+        return ExchangeRates.load(args.rates or DEFAULT_RATES)
+    return None
+
+
+def open_ledger(args):
+    path = args.ledger or DEFAULT_LEDGERS[args.storage]
+    rates = load_rates(args)
+    if args.storage == 'sqlite':
+        return Ledger(SQLiteStorage(path), rates)
+    if args.storage == 'binary':
+        return Ledger(BinaryStorage(path), rates)
+    return Ledger(JournalStorage(path), rates)
+
+
+def snapshot_storage(path):
+    # JSON or, for ".fin", binary snapshot storage of a ledger file
+    return BinaryStorage(path) if path.endswith('.fin') else JournalStorage(path)
+
+
+def import_files(ledger, args):
+    for path in args.files:
+        if path.lower().endswith('.json'):
+            count = ledger.import_records(iter_transactions(path), chunk_size=args.chunk_size)
+            errors = []
+        else:
+            count, errors = ledger.import_statement(path, currency=args.currency, currencies=CURRENCIES,
+                                                   dayfirst=args.dayfirst)
+        for error in errors:
+            print(f"{path}: {error}", file=sys.stderr)
+        print(f"{path}: imported {count} transactions, skipped {len(errors)}", file=sys.stderr)
+
+
+def print_totals(ledger, args):
+    totals, index = ledger.aggregates.in_currency(args.currency)
+    expenses = totals.expenses_by_category()
+    counts = totals.counts
+    if args.format == 'json':
+        json.dump({category: {'total': total, 'count': counts[category]} for category, total in expenses.items()},
+                  sys.stdout, indent=2, ensure_ascii=False)
+        print()
+        return
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['category', 'total', 'count'])
+    for category, total in expenses.items():
+        writer.writerow([category, f"{total:.2f}", counts[category]])
+
+
+def print_balance(ledger, args):
+    index = ledger.aggregates.balance_index(args.currency)
+    # A bare end date covers the whole day, as in the window's filter
+    try:
+        query = TransactionQuery(start=args.start, end=args.at or args.end)
+    except ValueError as e:
+        sys.exit(f"Invalid date: {e}")
+    bound = lambda time: None if time is None else np.datetime64(time, 's')
+    if args.at or args.change:
+        if args.at:
+            row = {'date': args.at, 'balance': index.balance_at(bound(query.end_time))}
+        else:
+            dates = index.series()[0]
+            if not len(dates):
+                sys.exit("No transactions")
+            start = dates[0] if query.start_time is None else bound(query.start_time)
+            end = dates[-1] if query.end_time is None else bound(query.end_time)
+            row = {'start': str(start).replace('T', ' '), 'end': str(end).replace('T', ' '),
+                   'change': index.change_between(start, end)}
+        if args.format == 'json':
+            json.dump(row, sys.stdout, indent=2)
+            print()
+            return
+        writer = csv.writer(sys.stdout)
+        writer.writerow(list(row))
+        writer.writerow([f"{value:.2f}" if isinstance(value, float) else value for value in row.values()])
+        return
+    dates, balances = index.series(args.start, args.end)
+    dates = dates.astype(str)
+    if args.format == 'json':
+        json.dump([{'date': date.replace('T', ' '), 'balance': balance}
+                   for date, balance in zip(dates.tolist(), balances.tolist())], sys.stdout, indent=2)
+        print()
+        return
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['date', 'balance'])
+    writer.writerows((date.replace('T', ' '), f"{balance:.2f}") for date, balance in zip(dates.tolist(), balances.tolist()))
+
+
+def print_rollup(ledger, args):
+    starts, income, expenses, net = ledger.aggregates.rollups(args.currency).series(args.period)
+    rows = zip(starts.astype(str).tolist(), income.tolist(), expenses.tolist(), net.tolist())
+    if args.format == 'json':
+        json.dump([{'start': start, 'income': i, 'expenses': e, 'net': n} for start, i, e, n in rows],
+                  sys.stdout, indent=2)
+        print()
+        return
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['start', 'income', 'expenses', 'net'])
+    writer.writerows((start, f"{i:.2f}", f"{e:.2f}", f"{n:.2f}") for start, i, e, n in rows)
+
+
+def render_chart(ledger, args):
+    ChartFigure.use_style()
+    chart = ChartFigure()
+    totals, index = ledger.aggregates.in_currency(args.currency)
+    if args.chart in ('bars', 'areas'):
+        rollups = ledger.aggregates.rollups(args.currency)
+        if not rollups.totals[args.period]:
+            sys.exit("No transactions")
+        if args.chart == 'bars':
+            starts, income, expenses, net = rollups.series(args.period)
+            chart.show_period_bars(args.period, starts, income, expenses, "Income and Expenses",
+                                   ("Income", "Expense", "Net"), "Date", currency_code(args.currency))
+        else:
+            chart.show_category_areas(*rollups.category_series(args.period), "Expenses by Category over Time",
+                                      "Date", currency_code(args.currency))
+    elif args.chart == 'pie':
+        expenses = totals.expenses_by_category()
+        if expenses.empty:
+            sys.exit("No expense data available")
+        chart.show_pie(expenses, "Expenses by Category")
+    else:
+        dates, balances = index.series(args.start, args.end)
+        if not len(dates):
+            sys.exit("No transactions")
+        chart.show_trend(dates, balances, "Balance Dynamics", "Date", "Balance")
+    chart.save(args.output)
+
+
+def print_report(args):
+    # Several ledger files, e.g. one per year, aggregated on a process pool
+    missing = [path for path in args.files
+               if not os.path.exists(path) and not os.path.exists(path + ".journal")]
+    if missing:
+        sys.exit(f"No such ledger: {', '.join(missing)}")
+    rates = load_rates(args)
+    if rates is None and args.currency != CURRENCIES[0]:
+        print(f"No exchange rates ({DEFAULT_RATES} or --rates); amounts are not converted", file=sys.stderr)
+    report = aggregate_ledgers(args.files, args.currency, rates, args.period, args.workers)
+    if args.show == 'totals':
+        rows = [(category, total, count) for category, (total, count) in sorted(report.summary.items())]
+        header = ['category', 'total', 'count']
+    elif args.show == 'files':
+        rows = [(f['path'], f['count'], str(f['first']).replace('T', ' '), str(f['last']).replace('T', ' '),
+                 f['opening'], f['closing']) for f in report.files]
+        header = ['path', 'count', 'first', 'last', 'opening', 'closing']
+    else:
+        starts, income, expenses, net = report.rollups.series(args.period)
+        starts, balances = report.balances()
+        rows = list(zip(starts.astype(str).tolist(), income.tolist(), expenses.tolist(), net.tolist(),
+                        balances.tolist()))
+        header = ['start', 'income', 'expenses', 'net', 'balance']
+    if args.format == 'json':
+        json.dump([dict(zip(header, row)) for row in rows], sys.stdout, indent=2, ensure_ascii=False)
+        print()
+        return
+    writer = csv.writer(sys.stdout)
+    writer.writerow(header)
+    writer.writerows([f"{value:.2f}" if isinstance(value, float) else value for value in row] for row in rows)
+
+
+def convert_ledger(args):
+    # Rewrites a ledger (snapshot plus journal) as a single snapshot in the
+    # other format, e.g. to inspect a binary ledger as JSON and back
+    if not os.path.exists(args.source) and not os.path.exists(args.source + ".journal"):
+        sys.exit(f"No such ledger: {args.source}")
+    source = snapshot_storage(args.source)
+    try:
+        store = source.load_store()
+    except ValueError as e:
+        sys.exit(str(e))
+    finally:
+        source.close()
+    target = snapshot_storage(args.target)
+    # Compaction writes the snapshot and drops an old journal of the target
+    target.compact(store, wait=True)
+    target.close()
+    print(f"{args.source} -> {args.target}: {len(store)} transactions", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Finance Calculator batch tools")
+    parser.add_argument('--storage', choices=['json', 'sqlite', 'binary'], default='json',
+                        help="ledger storage engine")
+    parser.add_argument('--ledger', help="ledger file (default: finance_data.json, .db or .fin)")
+    parser.add_argument('--rates', help=f"exchange rate table for --currency (default: {DEFAULT_RATES} if present)")
+    parser.add_argument('--profile', metavar='FILE', help="write a cProfile of the command to FILE")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('import', help="append transactions from statements or JSON files")
+    command.add_argument('files', nargs='+',
+                         help="CSV (date and amount columns, optionally type, category, currency), "
+                              "OFX/QFX, QIF, or a JSON array in the ledger's format")
+    command.add_argument('--currency', default=CURRENCIES[0], type=currency_label,
+                         help="currency of rows that don't name one")
+    command.add_argument('--dayfirst', action='store_true', help="read ambiguous dates as day/month")
+    command.add_argument('--chunk-size', type=int, default=10000, help="JSON transactions written per batch")
+    command.set_defaults(run=import_files)
+
+    command = commands.add_parser('totals', help="expense totals by category")
+    command.add_argument('--format', choices=['csv', 'json'], default='csv')
+    command.add_argument('--currency', default=CURRENCIES[0], type=currency_label, help="reporting currency")
+    command.set_defaults(run=print_totals)
+
+    command = commands.add_parser('balance', help="running balance series")
+    command.add_argument('--start', help="first date to include")
+    command.add_argument('--end', help="last date to include")
+    command.add_argument('--at', metavar='DATE', help="only the balance at the end of DATE")
+    command.add_argument('--change', action='store_true',
+                         help="only the net change from --start to --end instead of the series")
+    command.add_argument('--format', choices=['csv', 'json'], default='csv')
+    command.add_argument('--currency', default=CURRENCIES[0], type=currency_label, help="reporting currency")
+    command.set_defaults(run=print_balance)
+
+    command = commands.add_parser('rollup', help="income, expenses and net per period")
+    command.add_argument('--period', choices=Rollups.PERIODS, default='month')
+    command.add_argument('--format', choices=['csv', 'json'], default='csv')
+    command.add_argument('--currency', default=CURRENCIES[0], type=currency_label, help="reporting currency")
+    command.set_defaults(run=print_rollup)
+
+    command = commands.add_parser('chart', help="render a chart to PNG or SVG")
+    command.add_argument('chart', choices=['pie', 'trend', 'bars', 'areas'])
+    command.add_argument('--period', choices=Rollups.PERIODS, default='month', help="bucket size of bars and areas")
+    command.add_argument('-o', '--output', required=True, help="image file; the extension picks the format")
+    command.add_argument('--start', help="first date of the balance trend")
+    command.add_argument('--end', help="last date of the balance trend")
+    command.add_argument('--currency', default=CURRENCIES[0], type=currency_label, help="reporting currency")
+    command.set_defaults(run=render_chart)
+
+    command = commands.add_parser('report', help="aggregate several ledger files, e.g. one per year")
+    command.add_argument('files', nargs='+', help="ledger files (JSON, SQLite for .db or binary for .fin)")
+    command.add_argument('--show', choices=['rollup', 'totals', 'files'], default='rollup',
+                         help="per-period totals and balance, category totals, or per-file balances")
+    command.add_argument('--period', choices=Rollups.PERIODS, default='month')
+    command.add_argument('--format', choices=['csv', 'json'], default='csv')
+    command.add_argument('--currency', default=CURRENCIES[0], type=currency_label, help="reporting currency")
+    command.add_argument('--workers', type=int, help="worker processes (default: one per CPU; 1 runs in-process)")
+    command.set_defaults(run=print_report)
+
+    command = commands.add_parser('convert', help="convert a ledger between JSON and the binary format")
+    command.add_argument('source', help="ledger to read: JSON, or a binary snapshot for .fin")
+    command.add_argument('target', help="snapshot to write, in the format its extension picks")
+    command.set_defaults(run=convert_ledger)
+
+    args = parser.parse_args(argv)
+    if args.profile:
+        diagnostics.start_profile()
+    if args.command in ('report', 'convert'):
+        try:
+            args.run(args)
+        finally:
+            if args.profile:
+                diagnostics.dump_profile(args.profile)
+        return
+    ledger = open_ledger(args)
+    if args.command != 'import' and ledger.aggregates.rates is None and args.currency != CURRENCIES[0]:
+        print(f"No exchange rates ({DEFAULT_RATES} or --rates); amounts are not converted", file=sys.stderr)
+    try:
+        args.run(ledger, args)
+    finally:
+        ledger.close()
+        if args.profile:
+            diagnostics.dump_profile(args.profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,3290 @@
+# Ledger storage, in-memory stores, aggregates and chart drawing shared by
+# the desktop app and the command-line tools. Nothing here imports PyQt6.
+
+import codecs
+import functools
+import heapq
+import itertools
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import sys
+import bisect
+import sqlite3
+import struct
+import threading
+import time
+import urllib.parse
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+# pandas and matplotlib are imported on first use
+
+logger = logging.getLogger(__name__)
+
+# Currencies offered in the app, as "<code> - <symbol>" labels
+CURRENCIES = [
+    "USD - $", "EUR - €", "GBP - £", "JPY - ¥", "CNY - ¥", "RUB - ₽",
+    "AUD - $", "CAD - $", "CHF - Fr", "HKD - $", "SGD - $", "SEK - kr",
+    "KRW - ₩", "TRY - ₺", "INR - ₹", "BRL - R$", "ZAR - R", "AED - د.إ",
+    "THB - ฿", "MXN - $"
+]
+
+_WHITESPACE = re.compile(r'\s*')
+
+# String fields with few distinct values; records share one copy of each
+SHARED_FIELDS = ('type', 'category', 'currency')
+
+
+def iter_transactions(path):
+    # Yields the records of a JSON array file one at a time (see
+    # iter_transaction_chunks)
+    for chunk in iter_transaction_chunks(path):
+        yield from chunk
+
+
+def iter_transaction_chunks(path, chunk_size=1024 * 1024, progress=None):
+    # Yields the records of a JSON array file in lists of a few thousand. The
+    # file is read chunk_size bytes at a time and records are decoded as soon
+    # as they are complete, so memory beyond the records handed out stays
+    # around one chunk instead of the whole document. progress, if given, is
+    # called with (bytes read, file size) after every chunk.
+    #
+    # A raw newline can't occur inside a JSON string, so in the indented
+    # layout snapshots are written in (see write_snapshot_file) a "}" that
+    # starts a line two spaces in closes a record. Everything up to the last
+    # one in the buffer is decoded with a single json.loads; other layouts,
+    # or a buffer where that doesn't parse, go one record at a time.
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    shared = {}
+    batch = []
+    buffer = ''
+    position = 0
+    done = 0
+    size = os.path.getsize(path)
+    # '[' -> first -> separator -> value -> separator ... -> end
+    expecting = '['
+    with open(path, 'rb') as f:
+        while True:
+            position = _WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                data = f.read(chunk_size)
+                done += len(data)
+                if progress is not None and data:
+                    progress(done, size)
+                if not data:
+                    break
+                buffer, position = text.decode(data), 0
+                continue
+
+            char = buffer[position]
+            if expecting == '[':
+                if char != '[':
+                    raise ValueError(f"{path}: expected a JSON array")
+                position += 1
+                expecting = 'first'
+            elif expecting in ('first', 'separator') and char == ']':
+                position += 1
+                expecting = 'end'
+            elif expecting == 'separator':
+                if char != ',':
+                    raise ValueError(f"{path}: expected ',' or ']' between transactions")
+                position += 1
+                expecting = 'value'
+            elif expecting in ('first', 'value'):
+                last = buffer.rfind('\n  }', position)
+                records = None
+                if last >= 0:
+                    try:
+                        records = json.loads('[' + buffer[position:last + 4] + ']')
+                    except ValueError:
+                        pass
+                if records is not None:
+                    position = last + 4
+                else:
+                    try:
+                        record, position = decoder.raw_decode(buffer, position)
+                    except json.JSONDecodeError:
+                        # The record may just run past the end of the buffer
+                        data = f.read(chunk_size)
+                        done += len(data)
+                        if progress is not None and data:
+                            progress(done, size)
+                        if not data:
+                            raise
+                        buffer, position = buffer[position:] + text.decode(data), 0
+                        continue
+                    records = [record]
+                for record in records:
+                    if not isinstance(record, dict):
+                        raise ValueError(f"{path}: transactions must be JSON objects")
+                    for field in SHARED_FIELDS:
+                        value = record.get(field)
+                        if isinstance(value, str):
+                            record[field] = shared.setdefault(value, value)
+                batch += records
+                expecting = 'separator'
+                if len(batch) >= 4096:
+                    yield batch
+                    batch = []
+            else:
+                raise ValueError(f"{path}: unexpected data after the JSON array")
+
+    if expecting != 'end':
+        raise ValueError(f"{path}: truncated JSON array")
+    if batch:
+        yield batch
+
+
+class Diagnostics:
+    # Call counts and wall time of named operations ("add", "save", "chart
+    # pie", ...), for finding out where a slow session spends its time.
+    # Off by default; while off, measure() hands out one shared no-op context
+    # manager, so instrumented code pays an attribute check per call.
+    # Operations may finish on worker threads.
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        # name -> [calls, total seconds, slowest call]
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.profiler = None
+
+    def measure(self, name):
+        return self._measure(name) if self.enabled else _NOT_MEASURED
+
+    @contextmanager
+    def _measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self.lock:
+            entry = self.stats.get(name)
+            if entry is None:
+                self.stats[name] = [1, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def report(self):
+        # [(name, calls, total, mean, slowest)], most total time first
+        with self.lock:
+            rows = [(name, calls, total, total / calls, slowest)
+                    for name, (calls, total, slowest) in self.stats.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+    def start_profile(self):
+        # cProfile of the calling thread until dump_profile()
+        import cProfile
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def dump_profile(self, path):
+        # Writes a pstats file (python -m pstats, snakeviz, ...)
+        profiler, self.profiler = self.profiler, None
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+_NOT_MEASURED = nullcontext()
+
+# FINANCE_DIAGNOSTICS=1 records timings from the start
+diagnostics = Diagnostics(os.environ.get('FINANCE_DIAGNOSTICS') == '1')
+
+
+class JournalStorage:
+    # Ledger persistence as a JSON snapshot plus an append-only journal.
+    #
+    # Every add/edit/delete, and every imported batch, is written as one JSON
+    # line to "<data_file>.journal" instead of rewriting the whole snapshot. Journal entries address records
+    # by their "id" and are idempotent upserts/deletes, so replaying a journal
+    # on top of a snapshot that already contains it yields the same ledger.
+    # Once the journal grows past compact_threshold bytes it is rotated and
+    # folded into a fresh snapshot on a background thread.
+    #
+    # With read_only=True opening never changes the files: a torn journal
+    # tail is skipped instead of truncated and a rotated journal is left for
+    # the next writable open to fold in.
+
+    # load_store() holds the whole ledger in memory
+    lazy = False
+
+    def __init__(self, data_file, compact_threshold=4 * 1024 * 1024, fsync_interval=0.5, read_only=False):
+        self.data_file = data_file
+        self.read_only = read_only
+        self.journal_file = data_file + ".journal"
+        self.rotated_file = data_file + ".journal.old"
+        self.compact_threshold = compact_threshold
+        self.fsync_interval = fsync_interval
+        self.next_id = 1
+
+        self._lock = threading.RLock()
+        self._journal = None
+        self._journal_size = 0
+        self._dirty = False
+        self._sync_timer = None
+        self._compactor = None
+
+    def load_store(self, progress=None):
+        # ColumnarStore with the ledger. The journal is read first; the
+        # snapshot then streams past a chunk of records at a time (see
+        # iter_transaction_chunks) with the journal applied on the way:
+        # records it deleted are skipped, records it changed are taken in
+        # their journal version and the ones it added are restored at the
+        # end. Only one chunk of records exists as dicts at any time.
+        # progress is called with (bytes read, snapshot size).
+        records, deleted = {}, set()
+        # A rotated journal only survives a crash during compaction
+        has_rotated = os.path.exists(self.rotated_file)
+        if has_rotated:
+            self._replay(self.rotated_file, records, deleted)
+        if os.path.exists(self.journal_file):
+            self._replay(self.journal_file, records, deleted)
+            self._journal_size = os.path.getsize(self.journal_file)
+
+        store = ColumnarStore()
+        # Legacy snapshots have no ids; they are numbered after the highest
+        # id in the snapshot, so journal entries written against them replay
+        # onto the same rows
+        legacy = []
+        last_id = 0
+        if os.path.exists(self.data_file):
+            for chunk in iter_transaction_chunks(self.data_file, progress=progress):
+                rows = []
+                for record in chunk:
+                    record_id = record.get('id')
+                    if record_id is None:
+                        legacy.append(record)
+                        continue
+                    if record_id > last_id:
+                        last_id = record_id
+                    if record_id not in deleted:
+                        rows.append(records.pop(record_id, record))
+                store.extend(rows)
+        rows = []
+        for record_id, record in enumerate(legacy, last_id + 1):
+            record['id'] = record_id
+            if record_id not in deleted:
+                rows.append(records.pop(record_id, record))
+        store.extend(rows)
+        store.restore(list(records.values()))
+        # An undone delete re-adds records under their old ids; keep the rows
+        # in id order like the store they were restored into
+        store.sort_by_id()
+        self.next_id = store.last_id() + 1
+
+        if has_rotated and not self.read_only:
+            self.compact(store)
+        return store
+
+    def _replay(self, path, records, deleted=None):
+        # Applies a journal to {id: record}; ids it deletes are also
+        # collected in `deleted` if given (and dropped again if re-added)
+        with open(path, 'rb') as f:
+            lines = f.read().split(b'\n')
+
+        decode = json.JSONDecoder().decode
+        offset = 0
+        for number, line in enumerate(lines):
+            is_last = number == len(lines) - 1
+            if not line:
+                offset += 1
+                continue
+            try:
+                if is_last:
+                    # No trailing newline: the write was torn mid-record
+                    raise ValueError("incomplete journal record")
+                entry = decode(line.decode('utf-8'))
+            except ValueError:
+                if not is_last and any(lines[number + 1:]):
+                    raise ValueError(f"Corrupt journal record in {path} at line {number + 1}")
+                # Drop the torn tail so new entries don't get appended after it
+                if not self.read_only:
+                    with open(path, 'r+b') as f:
+                        f.truncate(offset)
+                break
+
+            if entry['op'] == 'delete':
+                for record_id in entry['ids']:
+                    records.pop(record_id, None)
+                    if deleted is not None:
+                        deleted.add(record_id)
+            elif entry['op'] == 'columns':
+                for record in self._column_records(entry):
+                    records[record['id']] = record
+                if deleted is not None:
+                    deleted.difference_update(entry['columns']['id'])
+            else:
+                record = entry['record']
+                records[record['id']] = record
+                if deleted is not None:
+                    deleted.discard(record['id'])
+            offset += len(line) + 1
+
+    def new_id(self):
+        return self.reserve_ids(1)
+
+    def reserve_ids(self, count):
+        # First of count consecutive new ids
+        with self._lock:
+            first = self.next_id
+            self.next_id += count
+            return first
+
+    def log_add(self, record):
+        self.write_batch([('add', record)])
+
+    def log_edit(self, record):
+        self.write_batch([('edit', record)])
+
+    def log_delete(self, record_ids):
+        self.write_batch([('delete', record_ids)])
+
+    def write_batch(self, operations):
+        # operations: ('add' | 'edit', record) or ('delete', ids), written
+        # with a single write call. A multi-id delete stays on one line, so
+        # a torn write drops the whole delete.
+        entries = []
+        for op, payload in operations:
+            if op == 'delete':
+                entries.append({"op": "delete", "ids": list(payload)})
+            else:
+                entries.append({"op": op, "record": payload})
+        self._append(entries)
+
+    def write_columns(self, columns):
+        # Bulk add of a column batch (see read_statement) with ids, written
+        # as one journal entry holding a list per field: epoch seconds for
+        # the dates and codes into a list of values for the strings, like
+        # ColumnarStore.aggregate_columns(). json encodes and decodes whole
+        # lists far faster than a line per record, and a torn write drops
+        # the batch as a whole.
+        entry = {'op': 'columns', 'columns': {
+            'id': columns['id'].tolist(),
+            'date': np.asarray(columns['date']).astype('datetime64[s]').astype(np.int64).tolist(),
+            'amount': columns['amount'].tolist()
+        }, 'strings': {}}
+        for field in ColumnarStore.CODED_FIELDS:
+            codes = StringCodes()
+            entry['columns'][field] = codes.encode(list(columns[field])).tolist()
+            entry['strings'][field] = codes.values
+        self._write((json.dumps(entry) + "\n").encode('ascii'))
+
+    def finish_columns(self):
+        # write_columns() leaves nothing for later (see SQLiteStorage)
+        pass
+
+    @staticmethod
+    def _column_records(entry):
+        # The records of a write_columns() journal entry
+        columns, strings = entry['columns'], entry['strings']
+        fields = [columns['id'], format_dates(np.array(columns['date'], dtype='datetime64[s]'))]
+        fields += [[strings[field][code] for code in columns[field]] for field in ('type', 'category')]
+        fields += [columns['amount'], [strings['currency'][code] for code in columns['currency']]]
+        return [dict(zip(SQLiteStorage.COLUMNS, values)) for values in zip(*fields)]
+
+    def _append(self, entries):
+        self._write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries).encode('utf-8'))
+
+    def _write(self, data):
+        with self._lock:
+            if self._journal is None:
+                self._journal = open(self.journal_file, 'ab')
+            self._journal.write(data)
+            self._journal.flush()
+            self._journal_size += len(data)
+            self._dirty = True
+
+            # Batch fsyncs: at most one per fsync_interval
+            if self._sync_timer is None:
+                self._sync_timer = threading.Timer(self.fsync_interval, self.sync)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+
+    def sync(self):
+        with self._lock:
+            self._sync_timer = None
+            if self._dirty and self._journal is not None:
+                os.fsync(self._journal.fileno())
+            self._dirty = False
+
+    def needs_compaction(self):
+        return self._journal_size >= self.compact_threshold and not self.is_compacting()
+
+    def is_compacting(self):
+        return self._compactor is not None and self._compactor.is_alive()
+
+    def compact(self, transactions, wait=False):
+        with self._lock:
+            if self.is_compacting():
+                self._compactor.join()
+
+            # Rotate the journal; entries from now on go to a fresh file
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+                self._journal = None
+            self._dirty = False
+            if os.path.exists(self.journal_file):
+                if os.path.exists(self.rotated_file):
+                    # An earlier compaction never finished; keep both journals
+                    with open(self.rotated_file, 'ab') as dst, open(self.journal_file, 'rb') as src:
+                        dst.write(src.read())
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.remove(self.journal_file)
+                else:
+                    os.replace(self.journal_file, self.rotated_file)
+            self._journal_size = 0
+
+            # Records may be edited in place after this point; a columnar
+            # store copies its arrays instead of materialising every row here
+            if isinstance(transactions, ColumnarStore):
+                snapshot = transactions.copy()
+            else:
+                snapshot = [dict(t) for t in transactions]
+            self._compactor = threading.Thread(target=self._write_snapshot, args=(snapshot,), daemon=True)
+            self._compactor.start()
+
+        if wait:
+            self._compactor.join()
+
+    def _write_snapshot(self, snapshot):
+        tmp_file = self.data_file + ".tmp"
+        self.write_snapshot_file(tmp_file, snapshot)
+        os.replace(tmp_file, self.data_file)
+        # Replaying the rotated journal over the new snapshot is harmless,
+        # so a crash before this point loses nothing
+        if os.path.exists(self.rotated_file):
+            os.remove(self.rotated_file)
+
+    # A record of the usual shape as json.dumps(record, indent=2) lays it
+    # out inside the snapshot's array
+    SNAPSHOT_RECORD = ('{\n    "id": %d,\n    "date": "%s",\n    "type": %s,\n    "category": %s,\n'
+                       '    "amount": %r,\n    "currency": %s\n  }')
+
+    @staticmethod
+    def write_snapshot_file(path, snapshot):
+        with open(path, 'w', encoding='utf-8') as f:
+            # Same layout as json.dump(snapshot, indent=2), a block of records
+            # at a time
+            if isinstance(snapshot, ColumnarStore):
+                blocks = JournalStorage._snapshot_blocks(snapshot)
+            else:
+                blocks = (json.dumps(record, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+                          for record in snapshot)
+            f.write("[")
+            separator = "\n  "
+            for block in blocks:
+                f.write(separator)
+                f.write(block)
+                separator = ",\n  "
+            f.write("\n]" if separator != "\n  " else "]")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _snapshot_blocks(store, block_size=16384):
+        # The records of a ColumnarStore as snapshot text, formatted from the
+        # columns with SNAPSHOT_RECORD: each distinct string is JSON-encoded
+        # once. Rows that don't have the usual shape (a missing field, a date
+        # kept verbatim, extra fields or an amount JSON spells differently)
+        # go through json.dumps.
+        columns = store.columns()
+        encoded = {field: [None if value is None else json.dumps(value, ensure_ascii=False)
+                           for value in store.strings[field].values]
+                   for field in ColumnarStore.CODED_FIELDS}
+        special = np.array(sorted(set(store._raw_dates) | set(store._extra)), dtype=np.int64)
+        for start in range(0, len(store), block_size):
+            stop = min(start + block_size, len(store))
+            amounts = columns['amount'][start:stop]
+            unusual = ~np.isfinite(amounts) | np.isin(columns['id'][start:stop], special)
+            fields = [columns['id'][start:stop].tolist(), format_dates(columns['date'][start:stop])]
+            for field in ('type', 'category'):
+                fields.append([encoded[field][code] for code in columns[field][start:stop].tolist()])
+            fields.append(amounts.tolist())
+            fields.append([encoded['currency'][code] for code in columns['currency'][start:stop].tolist()])
+            for field in ColumnarStore.CODED_FIELDS:
+                if None in store.strings[field].values:
+                    unusual |= columns[field][start:stop] == store.strings[field].values.index(None)
+            rows = list(zip(*fields))
+            record = JournalStorage.SNAPSHOT_RECORD
+            if not unusual.any():
+                yield ",\n  ".join([record % row for row in rows])
+                continue
+            unusual = unusual.tolist()
+            yield ",\n  ".join([
+                json.dumps(store[start + i], ensure_ascii=False, indent=2).replace("\n", "\n  ")
+                if unusual[i] else record % row for i, row in enumerate(rows)
+            ])
+
+    def close(self):
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+            self.sync()
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        if self._compactor is not None:
+            self._compactor.join()
+
+
+# Binary snapshots (".fin"): a header, a section table and the sections,
+# each starting at a multiple of SNAPSHOT_ALIGNMENT bytes so the columns map
+# straight into NumPy arrays. All numbers are little-endian.
+#
+#   header    magic, format version, flags, section count, row count and a
+#             CRC-32 of the header and section table together
+#   sections  each listed with its name, offset, length and CRC-32:
+#             ids, times    int64 ids and epoch seconds
+#             amounts       float64
+#             type, category, currency
+#                           int32 codes into the string table
+#             strings       the string table, JSON {field: [values]}
+#             extra         JSON {"dates": {id: date}, "fields": {id: {...}}}
+#                           for dates that don't read back from epoch
+#                           seconds and fields outside the schema
+#
+# A reader refuses versions newer than SNAPSHOT_VERSION.
+SNAPSHOT_MAGIC = b'FINLEDGR'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('<8sHHIQI4x')
+SNAPSHOT_SECTION = struct.Struct('<8sQQI4x')
+SNAPSHOT_ALIGNMENT = 64
+# Rows are in increasing id order
+SNAPSHOT_SORTED = 1
+# Windows can't replace a file while it's mapped, which compaction does;
+# snapshots are read into memory there instead
+MAP_SNAPSHOTS = os.name != 'nt'
+
+
+def write_binary_snapshot(path, store):
+    # Writes a ColumnarStore as a binary snapshot
+    columns = store.columns()
+    sections = [
+        (b'ids', columns['id'].astype('<i8')),
+        (b'times', columns['date'].astype('<i8')),
+        (b'amounts', columns['amount'].astype('<f8'))
+    ]
+    sections += [(field.encode(), columns[field].astype('<i4')) for field in ColumnarStore.CODED_FIELDS]
+    sections.append((b'strings', json.dumps(
+        {field: store.strings[field].values for field in ColumnarStore.CODED_FIELDS}, ensure_ascii=False
+    ).encode('utf-8')))
+    sections.append((b'extra', json.dumps(
+        {'dates': store._raw_dates, 'fields': store._extra}, ensure_ascii=False
+    ).encode('utf-8')))
+
+    table = []
+    offset = SNAPSHOT_HEADER.size + SNAPSHOT_SECTION.size * len(sections)
+    for name, data in sections:
+        offset = -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+        data = memoryview(data).cast('B')
+        table.append((name, offset, data))
+        offset += len(data)
+    entries = b''.join(SNAPSHOT_SECTION.pack(name, offset, len(data), zlib.crc32(data))
+                       for name, offset, data in table)
+    flags = SNAPSHOT_SORTED if store._sorted else 0
+    fields = (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, flags, len(sections), len(store))
+    checksum = zlib.crc32(entries, zlib.crc32(SNAPSHOT_HEADER.pack(*fields, 0)))
+    header = SNAPSHOT_HEADER.pack(*fields, checksum)
+
+    with open(path, 'wb') as f:
+        f.write(header + entries)
+        for name, offset, data in table:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_binary_snapshot(path, verify=True):
+    # ColumnarStore over a binary snapshot. The file is mapped copy-on-write
+    # (see MAP_SNAPSHOTS), so its pages are only read once a row or column
+    # is, and changes to the store never reach the file. The header and
+    # string table are always checked against their checksums; with verify
+    # the columns are too, which reads them through once.
+    with open(path, 'rb') as f:
+        if MAP_SNAPSHOTS and os.fstat(f.fileno()).st_size:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        else:
+            buffer = bytearray(f.read())
+    view = memoryview(buffer)
+
+    if len(buffer) < SNAPSHOT_HEADER.size:
+        raise ValueError(f"{path}: not a ledger snapshot")
+    magic, version, flags, count, rows, checksum = SNAPSHOT_HEADER.unpack_from(buffer)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path}: not a ledger snapshot")
+    if version > SNAPSHOT_VERSION:
+        raise ValueError(f"{path}: snapshot format {version} is newer than this version reads ({SNAPSHOT_VERSION})")
+    end = SNAPSHOT_HEADER.size + SNAPSHOT_SECTION.size * count
+    if len(buffer) < end:
+        raise ValueError(f"{path}: truncated snapshot")
+    header = SNAPSHOT_HEADER.pack(magic, version, flags, count, rows, 0)
+    if zlib.crc32(view[SNAPSHOT_HEADER.size:end], zlib.crc32(header)) != checksum:
+        raise ValueError(f"{path}: corrupt snapshot header")
+
+    sections = {}
+    for i in range(count):
+        name, offset, length, checksum = SNAPSHOT_SECTION.unpack_from(buffer, SNAPSHOT_HEADER.size +
+                                                                      SNAPSHOT_SECTION.size * i)
+        name = name.rstrip(b'\0').decode('ascii')
+        if offset + length > len(buffer):
+            raise ValueError(f"{path}: truncated snapshot")
+        if (verify or name in ('strings', 'extra')) and zlib.crc32(view[offset:offset + length]) != checksum:
+            raise ValueError(f"{path}: corrupt snapshot section '{name}'")
+        sections[name] = (offset, length)
+
+    def column(name, dtype, native):
+        offset, length = sections[name]
+        if length != rows * np.dtype(dtype).itemsize:
+            raise ValueError(f"{path}: snapshot section '{name}' has the wrong size")
+        return np.frombuffer(buffer, dtype=dtype, count=rows, offset=offset).astype(native, copy=False)
+
+    def document(name):
+        offset, length = sections[name]
+        return json.loads(bytes(view[offset:offset + length]).decode('utf-8'))
+
+    try:
+        store = ColumnarStore()
+        store._ids = column('ids', '<i8', np.int64)
+        store._times = column('times', '<i8', np.int64)
+        store._amounts = column('amounts', '<f8', np.float64)
+        store._codes = {field: column(field, '<i4', np.int32) for field in ColumnarStore.CODED_FIELDS}
+        strings = document('strings')
+        extra = document('extra')
+    except KeyError as e:
+        raise ValueError(f"{path}: snapshot has no section {e}")
+    for field in ColumnarStore.CODED_FIELDS:
+        store.strings[field].values = list(strings[field])
+        store.strings[field]._codes = {value: code for code, value in enumerate(strings[field])}
+    store._raw_dates = {int(record_id): date for record_id, date in extra['dates'].items()}
+    store._extra = {int(record_id): fields for record_id, fields in extra['fields'].items()}
+    store._sorted = bool(flags & SNAPSHOT_SORTED)
+    store.size = rows
+    return store
+
+
+class BinaryStorage(JournalStorage):
+    # JournalStorage with a binary snapshot (see read_binary_snapshot), so
+    # opening a ledger maps the columns instead of parsing every record;
+    # the journal is then applied to the store as one batch of deltas. A
+    # JSON ledger given as json_file is converted once on first use.
+    # Checking the columns' checksums on open reads them through (about
+    # 25 ms per million rows); verify=False leaves that out.
+
+    def __init__(self, data_file, json_file=None, verify=True, **options):
+        super().__init__(data_file, **options)
+        self.json_file = json_file
+        self.verify = verify
+
+    def load_store(self, progress=None):
+        if os.path.exists(self.data_file):
+            store = read_binary_snapshot(self.data_file, self.verify)
+        elif self.json_file and not self.read_only and (os.path.exists(self.json_file) or os.path.exists(self.json_file + ".journal")):
+            source = JournalStorage(self.json_file)
+            store = source.load_store()
+            source.close()
+            self._write_snapshot(store)
+        else:
+            store = ColumnarStore()
+
+        # A rotated journal only survives a crash during compaction
+        has_rotated = os.path.exists(self.rotated_file)
+        records, deleted = {}, set()
+        if has_rotated:
+            self._replay(self.rotated_file, records, deleted)
+        if os.path.exists(self.journal_file):
+            self._replay(self.journal_file, records, deleted)
+            self._journal_size = os.path.getsize(self.journal_file)
+
+        removed = [record_id for record_id in deleted if record_id in store]
+        if removed:
+            store.remove(removed)
+        added = []
+        for record_id, record in records.items():
+            if record_id in store:
+                store.update(record_id, **{field: value for field, value in record.items() if field != 'id'})
+            else:
+                added.append(record)
+        store.restore(added)
+        self.next_id = store.last_id() + 1
+
+        if has_rotated and not self.read_only:
+            self.compact(store)
+        return store
+
+    @staticmethod
+    def write_snapshot_file(path, snapshot):
+        write_binary_snapshot(path, snapshot)
+
+
+class SQLiteStorage:
+    # Ledger persistence in an embedded SQLite database. Rows are read on
+    # demand through SQLiteTransactionStore and aggregations run as SQL, so
+    # the ledger is never materialized in memory. On first use the JSON
+    # ledger (snapshot plus journal) is imported once. With read_only=True
+    # the database is opened with mode=ro and never migrated or written.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount REAL NOT NULL,
+            currency TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date);
+        CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions(category);
+        CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(type);
+        CREATE INDEX IF NOT EXISTS idx_transactions_currency ON transactions(currency);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+    COLUMNS = ('id', 'date', 'type', 'category', 'amount', 'currency')
+    INDEXED = ('date', 'category', 'type', 'currency')
+    # Batches from this size up may rebuild the indexes (see write_columns)
+    BULK_ROWS = 50000
+
+    # load_store() returns a store that reads rows on demand
+    lazy = True
+
+    def __init__(self, db_file, json_file=None, default_currency="USD - $", read_only=False):
+        self.db_file = db_file
+        self.read_only = read_only
+        self.json_file = json_file
+        self.default_currency = default_currency
+        self.next_id = 1
+        self.connection = None
+        self.writer = None
+
+    def load_store(self, progress=None):
+        # Opened on a loader thread and used from the GUI thread afterwards,
+        # never concurrently; writes go through a separate connection
+        if self.read_only:
+            uri = f"file:{urllib.parse.quote(os.path.abspath(self.db_file))}?mode=ro"
+            self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            max_id = self.connection.execute("SELECT MAX(id) FROM transactions").fetchone()[0]
+            self.next_id = (max_id or 0) + 1
+            return SQLiteTransactionStore(self.connection)
+        self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+
+        migrated = self.connection.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone()
+        if migrated is None:
+            self._migrate_json()
+
+        max_id = self.connection.execute("SELECT MAX(id) FROM transactions").fetchone()[0]
+        self.next_id = (max_id or 0) + 1
+        return SQLiteTransactionStore(self.connection)
+
+    def _migrate_json(self):
+        source = ""
+        with self.connection:
+            if self.json_file and (os.path.exists(self.json_file) or os.path.exists(self.json_file + ".journal")):
+                journal = JournalStorage(self.json_file)
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?)",
+                    (self._row(t) for t in journal.load_store())
+                )
+                journal.close()
+                source = self.json_file
+            self.connection.execute("INSERT INTO meta (key, value) VALUES ('migrated_from', ?)", (source,))
+
+    def _row(self, record):
+        return (
+            record['id'], record['date'], record['type'], record['category'],
+            record['amount'], record.get('currency', self.default_currency)
+        )
+
+    def new_id(self):
+        return self.reserve_ids(1)
+
+    def reserve_ids(self, count):
+        # First of count consecutive new ids
+        first = self.next_id
+        self.next_id += count
+        return first
+
+    def log_add(self, record):
+        self.write_batch([('add', record)])
+
+    def log_edit(self, record):
+        self.write_batch([('edit', record)])
+
+    def log_delete(self, record_ids):
+        self.write_batch([('delete', record_ids)])
+
+    def _writer(self):
+        if self.writer is None:
+            self.writer = sqlite3.connect(self.db_file, check_same_thread=False)
+            self.writer.execute("PRAGMA synchronous=NORMAL")
+            self.writer.execute("PRAGMA cache_size=-65536")
+        return self.writer
+
+    def write_columns(self, columns):
+        # Bulk add of a column batch (see read_statement) in one transaction.
+        # Maintaining the secondary indexes row by row dominates large
+        # imports, so when the batch is at least as big as the table they
+        # are dropped, and finish_columns() rebuilds them with one sort each
+        # once the rows are committed and in use. Queries work without them
+        # in the meantime, and load_store() recreates any that a crash left
+        # missing.
+        count = len(columns['id'])
+        rows = zip(columns['id'].tolist(), format_dates(columns['date']), columns['type'], columns['category'],
+                   columns['amount'].tolist(), columns['currency'])
+        writer = self._writer()
+        rebuild = count >= max(self.BULK_ROWS, self.next_id - count)
+        with writer:
+            # Explicit, so the DDL is part of the same transaction
+            writer.execute("BEGIN")
+            if rebuild:
+                for column in self.INDEXED:
+                    writer.execute(f"DROP INDEX IF EXISTS idx_transactions_{column}")
+            writer.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def finish_columns(self):
+        # Recreates the indexes write_columns() dropped; a no-op otherwise
+        with self._writer() as writer:
+            for column in self.INDEXED:
+                writer.execute(f"CREATE INDEX IF NOT EXISTS idx_transactions_{column} ON transactions({column})")
+
+    def write_batch(self, operations):
+        # One SQLite transaction per batch
+        self._writer()
+        with self.writer:
+            for op, payload in operations:
+                if op == 'add':
+                    self.writer.execute("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?)", self._row(payload))
+                elif op == 'edit':
+                    self.writer.execute(
+                        "UPDATE transactions SET date = ?, type = ?, category = ?, amount = ?, currency = ? "
+                        "WHERE id = ?",
+                        self._row(payload)[1:] + (payload['id'],)
+                    )
+                else:
+                    self.writer.executemany("DELETE FROM transactions WHERE id = ?", ((i,) for i in payload))
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, transactions=None, wait=False):
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        for connection in (self.writer, self.connection):
+            if connection is not None:
+                connection.close()
+        self.connection = self.writer = None
+
+
+def summarize_expenses(records):
+    # {category: (total, count)} over all expenses
+    totals, counts = {}, {}
+    for t in records:
+        if t['amount'] < 0:
+            totals[t['category']] = totals.get(t['category'], 0.0) - t['amount']
+            counts[t['category']] = counts.get(t['category'], 0) + 1
+    return {category: (totals[category], counts[category]) for category in totals}
+
+
+def summarize_columns(category_codes, categories, amounts):
+    # expense_summary() over columns: category codes into `categories`, amounts
+    expenses = amounts < 0
+    codes = category_codes[expenses]
+    totals = np.bincount(codes, weights=-amounts[expenses], minlength=len(categories))
+    counts = np.bincount(codes, minlength=len(categories))
+    return {categories[code]: (float(totals[code]), int(counts[code])) for code in np.flatnonzero(counts).tolist()}
+
+
+class StringCodes:
+    # Dictionary encoding for a low-cardinality string column: each distinct
+    # value is stored once and rows hold its int32 code. None stands for a
+    # record without the field.
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode(self, values):
+        for value in dict.fromkeys(values):
+            self.code(value)
+        return np.fromiter(map(self._codes.__getitem__, values), dtype=np.int32, count=len(values))
+
+
+class ColumnarStore:
+    # In-memory ledger held column by column: int64 ids and epoch seconds,
+    # float64 amounts and dictionary-encoded type/category/currency, each a
+    # NumPy array with spare capacity. Rows read back as plain dicts equal to
+    # the records that were stored; columns() and frame() expose the arrays
+    # without copying them.
+    #
+    # Row lookups by id are binary searches while ids increase with the row
+    # order (the usual case), otherwise an id -> row dict built on demand.
+
+    FIELDS = frozenset(('id', 'date', 'type', 'category', 'amount', 'currency'))
+    CODED_FIELDS = ('type', 'category', 'currency')
+
+    def __init__(self, transactions=()):
+        self.size = 0
+        # Bumped by every change, so derived data can tell it's stale
+        self.version = 0
+        self._ids = np.empty(64, dtype=np.int64)
+        self._times = np.empty(64, dtype=np.int64)
+        self._amounts = np.empty(64, dtype=np.float64)
+        self._codes = {field: np.empty(64, dtype=np.int32) for field in self.CODED_FIELDS}
+        self.strings = {field: StringCodes() for field in self.CODED_FIELDS}
+        # Dates that don't read back from epoch seconds verbatim, and fields
+        # outside the schema, kept per id so records round-trip unchanged
+        self._raw_dates = {}
+        self._extra = {}
+        self._sorted = True
+        self._index = None
+        self.extend(transactions)
+
+    def _arrays(self):
+        return [('_ids', self._ids), ('_times', self._times), ('_amounts', self._amounts)] + \
+            [(field, self._codes[field]) for field in self.CODED_FIELDS]
+
+    def nbytes(self):
+        # Bytes held by the column arrays, spare capacity included
+        return sum(array.nbytes for name, array in self._arrays())
+
+    def _set_array(self, name, array):
+        if name in self._codes:
+            self._codes[name] = array
+        else:
+            setattr(self, name, array)
+
+    def _reserve(self, size):
+        if size <= len(self._ids):
+            return
+        capacity = max(size, 2 * len(self._ids))
+        for name, array in self._arrays():
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            self._set_array(name, grown)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        # Materialise rows a block at a time to keep per-row overhead low
+        for start in range(0, self.size, 4096):
+            yield from self._records(start, min(start + 4096, self.size))
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            start, stop, step = row.indices(self.size)
+            if step == 1:
+                return self._records(start, max(start, stop))
+            return [self._records(r, r + 1)[0] for r in range(start, stop, step)]
+        if row < 0:
+            row += self.size
+        if not 0 <= row < self.size:
+            raise IndexError(row)
+        return self._records(row, row + 1)[0]
+
+    def __contains__(self, record_id):
+        try:
+            self.row_of(record_id)
+        except KeyError:
+            return False
+        return True
+
+    def _records(self, start, stop):
+        ids = self._ids[start:stop].tolist()
+        dates = np.datetime_as_string(self._times[start:stop].view('datetime64[s]'), unit='s').tolist()
+        amounts = self._amounts[start:stop].tolist()
+        # (field, decoded values or None for plain columns, column), in the
+        # usual key order
+        layout = [(field, self.strings[field].values, self._codes[field][start:stop].tolist())
+                  for field in ('type', 'category')]
+        layout.append(('amount', None, amounts))
+        layout.append(('currency', self.strings['currency'].values, self._codes['currency'][start:stop].tolist()))
+
+        records = []
+        for i, record_id in enumerate(ids):
+            record = {'id': record_id, 'date': self._raw_dates.get(record_id) or dates[i].replace('T', ' ')}
+            for field, values, column in layout:
+                value = column[i] if values is None else values[column[i]]
+                if value is not None:
+                    record[field] = value
+            extra = self._extra.get(record_id)
+            if extra:
+                record.update(extra)
+            records.append(record)
+        return records
+
+    @staticmethod
+    def _format_date(time):
+        return str(np.datetime64(int(time), 's')).replace('T', ' ')
+
+    def get(self, record_id):
+        row = self.row_of(record_id)
+        return self._records(row, row + 1)[0]
+
+    def row_of(self, record_id):
+        ids = self._ids[:self.size]
+        if self._sorted:
+            row = int(np.searchsorted(ids, record_id))
+            if row < self.size and ids[row] == record_id:
+                return row
+            raise KeyError(record_id)
+        if self._index is None:
+            self._index = {record_id: row for row, record_id in enumerate(ids.tolist())}
+        return self._index[record_id]
+
+    def append(self, record):
+        self.extend([record])
+        return self.size - 1
+
+    def extend(self, records):
+        records = records if isinstance(records, list) else list(records)
+        count = len(records)
+        if not count:
+            return
+
+        ids = np.fromiter((record['id'] for record in records), dtype=np.int64, count=count)
+        dates = [record['date'] for record in records]
+        times = to_epoch_seconds(dates)
+        amounts = np.fromiter((record['amount'] for record in records), dtype=np.float64, count=count)
+        self._append_columns(ids, times, amounts,
+                             {field: [record.get(field) for record in records] for field in self.CODED_FIELDS})
+
+        # Dates spelled "YYYY-MM-DD HH:MM:SS" read back from epoch seconds
+        # verbatim; check the rest one by one and remember those that don't
+        text = np.array(dates)
+        if text.dtype == np.dtype('U19'):
+            chars = text.view(np.uint32).reshape(count, 19)
+            usual = (chars[:, 4] == ord('-')) & (chars[:, 7] == ord('-')) & (chars[:, 10] == ord(' ')) & \
+                (chars[:, 13] == ord(':')) & (chars[:, 16] == ord(':')) & (chars[:, 18] != 0)
+        else:
+            usual = np.zeros(count, dtype=bool)
+        for i in np.flatnonzero(~usual).tolist():
+            if self._format_date(times[i]) != dates[i]:
+                self._raw_dates[int(ids[i])] = dates[i]
+
+        for record in records:
+            if not self.FIELDS.issuperset(record):
+                self._extra[record['id']] = {key: value for key, value in record.items() if key not in self.FIELDS}
+
+    def last_id(self):
+        # Highest id, 0 without rows
+        if not self.size:
+            return 0
+        return int(self._ids[self.size - 1] if self._sorted else self._ids[:self.size].max())
+
+    def restore_row(self, record_id):
+        # Row restore() puts a record with this id at
+        if not self._sorted:
+            return self.size
+        return int(np.searchsorted(self._ids[:self.size], record_id))
+
+    def restore(self, records):
+        # Puts removed records back under their own ids (undo): at the rows
+        # the ids sort to while rows are in id order, else at the end.
+        # Appended first, then moved into place with one pass per column.
+        records = sorted(records, key=lambda record: record['id'])
+        if not records:
+            return
+        size, in_order = self.size, self._sorted
+        rows = np.searchsorted(self._ids[:size], [record['id'] for record in records])
+        self.extend(records)
+        if self._sorted or not in_order:
+            return
+        order = np.insert(np.arange(size), rows, np.arange(size, self.size))
+        for name, array in self._arrays():
+            array[:self.size] = array[:self.size][order]
+        self._sorted = True
+        self._index = None
+
+    def sort_by_id(self):
+        # Puts the rows in id order if they aren't, e.g. after loading a
+        # snapshot written with ids out of order
+        if self._sorted:
+            return
+        order = np.argsort(self._ids[:self.size], kind='stable')
+        for name, array in self._arrays():
+            array[:self.size] = array[:self.size][order]
+        self._sorted = True
+        self._index = None
+        self.version += 1
+
+    def extend_columns(self, columns):
+        # Bulk append from a column batch (see read_statement): int64 'id',
+        # datetime64 'date', float64 'amount' and sequences of strings for
+        # the coded fields
+        self._append_columns(
+            np.asarray(columns['id'], dtype=np.int64),
+            np.asarray(columns['date']).astype('datetime64[s]').astype(np.int64),
+            np.asarray(columns['amount'], dtype=np.float64),
+            {field: columns[field] for field in self.CODED_FIELDS}
+        )
+
+    def _append_columns(self, ids, times, amounts, strings):
+        count = len(ids)
+        first, last = self.size, self.size + count
+        increasing = bool(np.all(ids[1:] > ids[:-1]))
+        if not increasing and len(np.unique(ids)) != count:
+            raise ValueError("Duplicate transaction ids")
+        after_last = increasing and (not first or ids[0] > self._ids[first - 1])
+        if not after_last:
+            for record_id in ids.tolist():
+                if record_id in self:
+                    raise ValueError(f"Duplicate transaction id {record_id}")
+
+        self._reserve(last)
+        self._ids[first:last] = ids
+        self._times[first:last] = times
+        self._amounts[first:last] = amounts
+        for field in self.CODED_FIELDS:
+            self._codes[field][first:last] = self.strings[field].encode(strings[field])
+
+        if self._sorted and not after_last:
+            self._sorted = False
+        elif self._index is not None:
+            self._index.update(zip(ids.tolist(), range(first, last)))
+        self.size = last
+        self.version += 1
+
+    def copy(self):
+        # Independent store with the same rows; copies arrays, not records
+        clone = ColumnarStore()
+        for name, array in self._arrays():
+            clone._set_array(name, array[:self.size].copy())
+        for field in self.CODED_FIELDS:
+            clone.strings[field].values = list(self.strings[field].values)
+            clone.strings[field]._codes = dict(self.strings[field]._codes)
+        clone._raw_dates = dict(self._raw_dates)
+        clone._extra = {record_id: dict(extra) for record_id, extra in self._extra.items()}
+        clone._sorted = self._sorted
+        clone.size = self.size
+        return clone
+
+    def update(self, record_id, **fields):
+        row = self.row_of(record_id)
+        self.version += 1
+        for field, value in fields.items():
+            if field == 'id':
+                raise ValueError("Transaction ids can't be changed")
+            if field == 'amount':
+                self._amounts[row] = value
+            elif field == 'date':
+                self._times[row] = to_epoch_seconds(value)
+                self._raw_dates.pop(record_id, None)
+                if self._format_date(self._times[row]) != value:
+                    self._raw_dates[record_id] = value
+            elif field in self._codes:
+                self._codes[field][row] = self.strings[field].code(value)
+            else:
+                self._extra.setdefault(record_id, {})[field] = value
+        return self.get(record_id)
+
+    def mark_saved(self, record_ids):
+        # Every record lives in memory; nothing to release
+        pass
+
+    def _forget(self, removed):
+        for record in removed:
+            self._raw_dates.pop(record['id'], None)
+            self._extra.pop(record['id'], None)
+        # Rows after the removed ones moved up
+        self._index = None
+        self.version += 1
+
+    def remove_rows(self, first, last):
+        removed = self._records(first, last + 1)
+        count = last + 1 - first
+        for name, array in self._arrays():
+            array[first:self.size - count] = array[last + 1:self.size]
+        self.size -= count
+        self._forget(removed)
+        return removed
+
+    def remove(self, record_ids):
+        rows = sorted(self.row_of(record_id) for record_id in set(record_ids))
+        removed = [self._records(row, row + 1)[0] for row in rows]
+        keep = np.ones(self.size, dtype=bool)
+        keep[rows] = False
+        for name, array in self._arrays():
+            kept = array[:self.size][keep]
+            array[:len(kept)] = kept
+        self.size -= len(rows)
+        self._forget(removed)
+        return removed
+
+    def columns(self):
+        # Views of the live columns (valid until the next change): ids,
+        # datetime64[s] dates, amounts and the int32 codes of the string
+        # columns, whose values are in self.strings[field].values
+        columns = {
+            'id': self._ids[:self.size],
+            'date': self._times[:self.size].view('datetime64[s]'),
+            'amount': self._amounts[:self.size]
+        }
+        for field in self.CODED_FIELDS:
+            columns[field] = self._codes[field][:self.size]
+        return columns
+
+    def frame(self):
+        # DataFrame over the columns; the numeric ones are not copied and
+        # the string ones become categoricals over the shared values
+        import pandas as pd
+        columns = self.columns()
+        for field in self.CODED_FIELDS:
+            values = self.strings[field].values
+            if None in values:
+                columns[field] = pd.Categorical(np.array(values, dtype=object)[columns[field]])
+            else:
+                columns[field] = pd.Categorical.from_codes(columns[field], categories=values)
+        return pd.DataFrame(columns, copy=False)
+
+    def expense_summary(self):
+        return summarize_columns(self._codes['category'][:self.size], self.strings['category'].values,
+                                 self._amounts[:self.size])
+
+    def timeline(self):
+        columns = self.columns()
+        return columns['id'], columns['date'], columns['amount']
+
+    def aggregate_columns(self):
+        # (columns(), {coded field: values}) for aggregating in bulk
+        return self.columns(), {field: self.strings[field].values for field in self.CODED_FIELDS}
+
+
+class SQLiteTransactionStore:
+    # ColumnarStore counterpart over an SQLite connection. Only the id
+    # column is held in memory (8 bytes per row); records are fetched a page
+    # at a time for the rows the table view asks for and kept in an LRU cache.
+
+    PAGE_SIZE = 256
+    CACHE_SIZE = 8192
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._ids = array('q', (row[0] for row in connection.execute("SELECT id FROM transactions ORDER BY id")))
+        self.version = 0
+        self._cache = OrderedDict()
+        # Records with writes still queued, pinned outside the LRU cache as
+        # [record, number of pending writes] so they can't be evicted and
+        # re-read stale from the database
+        self._unsaved = {}
+        # ColumnarStore with the same rows, once aggregate_columns() was
+        # asked for
+        self._columns = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def nbytes(self):
+        # The id column and aggregate columns; cached records are bounded by
+        # CACHE_SIZE
+        columns = 0 if self._columns is None else self._columns.nbytes()
+        return self._ids.itemsize * len(self._ids) + columns
+
+    def __iter__(self):
+        # Streams the table merged with the id column: rows deleted but not
+        # yet written are skipped, and records not written yet come from
+        # memory
+        cursor = self.connection.execute(
+            "SELECT id, date, type, category, amount, currency FROM transactions ORDER BY id"
+        )
+        row = next(cursor, None)
+        for record_id in self._ids:
+            while row is not None and row[0] < record_id:
+                row = next(cursor, None)
+            record = self._cached(record_id)
+            if record is None:
+                record = dict(zip(SQLiteStorage.COLUMNS, row))
+            yield record
+
+    def __getitem__(self, row):
+        record_id = self._ids[row]
+        record = self._cached(record_id)
+        if record is None:
+            self._load_page(row - row % self.PAGE_SIZE if row >= 0 else len(self._ids) + row)
+            record = self._cache[record_id]
+        return record
+
+    def __contains__(self, record_id):
+        position = bisect.bisect_left(self._ids, record_id)
+        return position < len(self._ids) and self._ids[position] == record_id
+
+    def _cached(self, record_id):
+        if record_id in self._unsaved:
+            return self._unsaved[record_id][0]
+        record = self._cache.get(record_id)
+        if record is not None:
+            self._cache.move_to_end(record_id)
+        return record
+
+    def _remember(self, record):
+        self._cache[record['id']] = record
+        self._cache.move_to_end(record['id'])
+        while len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def _load_page(self, first_row):
+        page_ids = self._ids[first_row:first_row + self.PAGE_SIZE]
+        cursor = self.connection.execute(
+            "SELECT id, date, type, category, amount, currency FROM transactions "
+            "WHERE id BETWEEN ? AND ? ORDER BY id",
+            (page_ids[0], page_ids[-1])
+        )
+        for row in cursor:
+            # Keep records already cached, they may be newer than the database
+            if row[0] not in self._cache and row[0] not in self._unsaved:
+                self._remember(dict(zip(SQLiteStorage.COLUMNS, row)))
+
+    def get(self, record_id):
+        record = self._cached(record_id)
+        if record is None:
+            row = self.connection.execute(
+                "SELECT id, date, type, category, amount, currency FROM transactions WHERE id = ?",
+                (record_id,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(record_id)
+            record = dict(zip(SQLiteStorage.COLUMNS, row))
+            self._remember(record)
+        return record
+
+    def row_of(self, record_id):
+        if record_id not in self:
+            raise KeyError(record_id)
+        return bisect.bisect_left(self._ids, record_id)
+
+    def append(self, record):
+        if self._ids and record['id'] <= self._ids[-1]:
+            raise ValueError(f"Transaction id {record['id']} is not newer than the ledger")
+        self._ids.append(record['id'])
+        self._pin(record)
+        if self._columns is not None:
+            self._columns.append(record)
+        self.version += 1
+        return len(self._ids) - 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def restore_row(self, record_id):
+        # Row restore() puts a record with this id at
+        return bisect.bisect_left(self._ids, record_id)
+
+    def restore(self, records):
+        # Puts removed records back under their own ids (undo); like new
+        # ones they stay pinned until their write is saved
+        records = sorted(records, key=lambda record: record['id'])
+        if not records:
+            return
+        for record in records:
+            if record['id'] in self:
+                raise ValueError(f"Duplicate transaction id {record['id']}")
+        ids = [record['id'] for record in records]
+        if self._ids and ids[0] < self._ids[-1]:
+            self._ids = array('q', heapq.merge(self._ids, ids))
+        else:
+            self._ids.extend(ids)
+        for record in records:
+            self._pin(record)
+        if self._columns is not None:
+            self._columns.restore(records)
+        self.version += 1
+
+    def extend_columns(self, columns):
+        # The rows of a column batch were written to the database already
+        # (write_columns), so only their ids are added
+        ids = array('q', np.asarray(columns['id'], dtype=np.int64).tolist())
+        if self._ids and ids and ids[0] <= self._ids[-1]:
+            raise ValueError(f"Transaction id {ids[0]} is not newer than the ledger")
+        self._ids.extend(ids)
+        if self._columns is not None:
+            self._columns.extend_columns(columns)
+        self.version += 1
+
+    def update(self, record_id, **fields):
+        record = self.get(record_id)
+        record.update(fields)
+        self._pin(record)
+        if self._columns is not None:
+            self._columns.update(record_id, **fields)
+        self.version += 1
+        return record
+
+    def _pin(self, record):
+        self._cache.pop(record['id'], None)
+        entry = self._unsaved.setdefault(record['id'], [record, 0])
+        entry[1] += 1
+
+    def mark_saved(self, record_ids):
+        for record_id in record_ids:
+            entry = self._unsaved.get(record_id)
+            if entry is not None:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._unsaved[record_id]
+                    self._remember(entry[0])
+
+    def remove_rows(self, first, last):
+        removed = [self[row] for row in range(first, last + 1)]
+        del self._ids[first:last + 1]
+        if self._columns is not None:
+            self._columns.remove_rows(first, last)
+        self.version += 1
+        for record in removed:
+            self._cache.pop(record['id'], None)
+            self._unsaved.pop(record['id'], None)
+        return removed
+
+    def remove(self, record_ids):
+        record_ids = set(record_ids)
+        removed = [self.get(record_id) for record_id in sorted(record_ids)]
+        self._ids = array('q', (i for i in self._ids if i not in record_ids))
+        if self._columns is not None:
+            self._columns.remove(record_ids)
+        self.version += 1
+        for record_id in record_ids:
+            self._cache.pop(record_id, None)
+            self._unsaved.pop(record_id, None)
+        return removed
+
+    def in_sync(self):
+        # Whether the database holds exactly the store's rows, i.e. no write
+        # is still queued. The SQL aggregations below are only valid then;
+        # otherwise callers fall back to aggregate_columns().
+        if self._unsaved:
+            return False
+        return self.connection.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == len(self._ids)
+
+    def _rows(self):
+        # Every row as a tuple of COLUMNS in id order. Records with writes
+        # still queued are taken from memory, so the rows line up with the
+        # store's either way.
+        rows = self.connection.execute(
+            "SELECT id, date, type, category, amount, currency FROM transactions ORDER BY id"
+        ).fetchall()
+        if self._unsaved or len(rows) != len(self._ids):
+            by_id = {row[0]: row for row in rows}
+            for record, count in self._unsaved.values():
+                by_id[record['id']] = tuple(record.get(field) for field in SQLiteStorage.COLUMNS)
+            rows = [by_id[record_id] for record_id in self._ids]
+        return rows
+
+    def expense_summary(self):
+        if not self.in_sync():
+            return summarize_expenses(dict(zip(SQLiteStorage.COLUMNS, row)) for row in self._rows())
+        rows = self.connection.execute(
+            "SELECT category, -SUM(amount), COUNT(*) FROM transactions WHERE amount < 0 GROUP BY category"
+        )
+        return {category: (float(total), count) for category, total, count in rows}
+
+    def timeline(self):
+        if self.in_sync():
+            return self.balance_columns()[:3]
+        rows = sorted(((row[0], row[1], row[4]) for row in self._rows()), key=lambda row: (row[1], row[0]))
+        return (
+            np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+            [row[1] for row in rows],
+            np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+        )
+
+    def _distinct(self, field):
+        # Values of a coded field, read from its index
+        return [row[0] for row in self.connection.execute(f"SELECT DISTINCT {field} FROM transactions")]
+
+    def balance_columns(self, where="", params=()):
+        # (ids, datetime64 dates, amounts, currency codes, currency values)
+        # of the rows matching `where` (see where()), in table order. SQLite
+        # turns the dates into epoch seconds and the currencies into codes,
+        # so the rows go straight into arrays without a tuple per row.
+        currencies = self._distinct('currency')
+        code = "CASE currency" + "".join(f" WHEN ? THEN {i}" for i in range(len(currencies))) + " END" \
+            if currencies else "0"
+        dtype = [('id', np.int64), ('time', np.int64), ('amount', np.float64), ('currency', np.int64)]
+        params = tuple(currencies) + tuple(params)
+        try:
+            rows = np.fromiter(self.connection.execute(
+                f"SELECT id, CAST(strftime('%s', date) AS INTEGER), amount, {code} FROM transactions{where}", params
+            ), dtype=dtype)
+            times = rows['time']
+        except TypeError:
+            # A date SQLite can't read; to_epoch_seconds guesses its format
+            rows = np.fromiter(self.connection.execute(
+                f"SELECT id, 0, amount, {code} FROM transactions{where}", params), dtype=dtype)
+            times = to_epoch_seconds([row[0] for row in self.connection.execute(
+                f"SELECT date FROM transactions{where}", params[len(currencies):])])
+        return rows['id'], np.ascontiguousarray(times).view('datetime64[s]'), rows['amount'], \
+            rows['currency'], currencies
+
+    def daily_totals(self, where="", params=()):
+        # Totals of the rows matching `where` per day, category and currency,
+        # grouped in SQL: a dict of 'day' (days since epoch), 'category' and
+        # 'currency' codes with their values under 'categories' and
+        # 'currencies', 'income', 'expenses' (positive), 'count' and
+        # 'expense_count' arrays
+        groups = self.connection.execute(
+            "SELECT COALESCE(date(date), date) AS day, category, currency, "
+            "SUM(CASE WHEN amount < 0 THEN 0 ELSE amount END), SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END), "
+            f"COUNT(*), SUM(amount < 0) FROM transactions{where} GROUP BY day, category, currency", params
+        ).fetchall()
+        days, categories, currencies, income, expenses, counts, expense_counts = \
+            zip(*groups) if groups else ((),) * 7
+        category_codes, currency_codes = StringCodes(), StringCodes()
+        return {
+            'day': np.floor_divide(to_epoch_seconds(list(days)), 86400) if days else np.empty(0, dtype=np.int64),
+            'category': category_codes.encode(categories),
+            'categories': category_codes.values,
+            'currency': currency_codes.encode(currencies),
+            'currencies': currency_codes.values,
+            'income': np.array(income, dtype=np.float64),
+            'expenses': np.array(expenses, dtype=np.float64),
+            'count': np.array(counts, dtype=np.int64),
+            'expense_count': np.array(expense_counts, dtype=np.int64)
+        }
+
+    def where(self, query, default_currency):
+        # (" WHERE ..." or "", parameters) selecting the rows that match a
+        # TransactionQuery. Type, category and currency values are checked
+        # in Python once per distinct value, like TransactionIndex does, and
+        # the dates are compared as the ledger writes them so the indexes
+        # apply.
+        conditions, params = [], []
+        for field in TransactionIndex.CODED_FIELDS:
+            values = self._distinct(field)
+            accepted = [value for value in values if query.accepts(field, value, default_currency)]
+            if len(accepted) < len(values):
+                conditions.append(f"{field} IN (SELECT value FROM json_each(?))")
+                params.append(json.dumps(accepted))
+        if query.start_time is not None:
+            # A bare date sorts before every time on that day
+            start = format_dates([np.datetime64(query.start_time, 's')])[0]
+            conditions.append("date >= ?")
+            params.append(start[:10] if start.endswith(" 00:00:00") else start)
+        if query.end_time is not None:
+            conditions.append("date <= ?")
+            params.append(format_dates([np.datetime64(query.end_time, 's')])[0])
+        if query.min_amount is not None:
+            conditions.append("ABS(amount) >= ?")
+            params.append(query.min_amount)
+        if query.max_amount is not None:
+            conditions.append("ABS(amount) <= ?")
+            params.append(query.max_amount)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), tuple(params)
+
+    def select(self, query, default_currency):
+        # Sorted positions of the rows matching `query`, selected in SQL
+        where, params = self.where(query, default_currency)
+        ids = np.fromiter((row[0] for row in self.connection.execute(f"SELECT id FROM transactions{where}", params)),
+                          dtype=np.int64)
+        ids.sort()
+        return np.searchsorted(np.array(self._ids, dtype=np.int64), ids).astype(np.int64)
+
+    def aggregate_columns(self):
+        # Same shape as ColumnarStore.aggregate_columns(): the table is read
+        # in one query the first time, after that the columns are only
+        # changed along with the store
+        if self._columns is None:
+            rows = self._rows()
+            columns = {
+                'id': np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+                'date': to_epoch_seconds([row[1] for row in rows]).view('datetime64[s]') if rows
+                else np.empty(0, dtype='datetime64[s]'),
+                'amount': np.fromiter((row[4] for row in rows), dtype=np.float64, count=len(rows))
+            }
+            for field in ColumnarStore.CODED_FIELDS:
+                position = SQLiteStorage.COLUMNS.index(field)
+                columns[field] = [row[position] for row in rows]
+            self._columns = ColumnarStore()
+            self._columns.extend_columns(columns)
+        return self._columns.aggregate_columns()
+
+
+class CategoryTotals:
+    # Running expense total per category, updated by deltas on every
+    # add/edit/delete so the pie chart never regroups the ledger. With
+    # verify=True every read is checked against a full recompute.
+
+    def __init__(self, summary, verify=False, summarize=None):
+        self.verify = verify
+        # Full recompute used by check(); store.expense_summary() by default
+        self.summarize = summarize
+        self.reset(summary)
+
+    def reset(self, summary):
+        self.totals = {category: total for category, (total, count) in summary.items()}
+        self.counts = {category: count for category, (total, count) in summary.items()}
+
+    def add(self, record):
+        if record['amount'] < 0:
+            category = record['category']
+            self.totals[category] = self.totals.get(category, 0.0) - record['amount']
+            self.counts[category] = self.counts.get(category, 0) + 1
+
+    def remove(self, record):
+        if record['amount'] < 0:
+            category = record['category']
+            self.counts[category] -= 1
+            if self.counts[category]:
+                self.totals[category] += record['amount']
+            else:
+                # Drop the category outright instead of leaving rounding residue
+                del self.counts[category]
+                del self.totals[category]
+
+    def replace(self, old_record, new_record):
+        self.remove(old_record)
+        self.add(new_record)
+
+    def expenses_by_category(self, store=None):
+        if self.verify and store is not None:
+            self.check(store)
+        import pandas as pd
+        categories = sorted(self.totals)
+        return pd.Series([self.totals[c] for c in categories], index=pd.Index(categories, name='category'),
+                         name='amount', dtype=float)
+
+    def check(self, store):
+        # Compare against a full recompute; on mismatch log it and resync
+        summary = self.summarize(store) if self.summarize else store.expense_summary()
+        expected = {category: total for category, (total, count) in summary.items()}
+        mismatched = [
+            category for category in set(expected) | set(self.totals)
+            if category not in expected or category not in self.totals
+            or not math.isclose(expected[category], self.totals[category], rel_tol=1e-9, abs_tol=1e-6)
+        ]
+        if mismatched:
+            logger.warning("Incremental category totals drifted for %s; resynchronizing", sorted(mismatched))
+            self.reset(summary)
+        return not mismatched
+
+
+def to_epoch_seconds(dates):
+    # Transaction date strings (or a single one) to int64 seconds since epoch
+    single = isinstance(dates, str)
+    try:
+        values = np.array([dates] if single else dates, dtype='datetime64[s]')
+    except ValueError:
+        # Not ISO 8601; let pandas guess the format
+        import pandas as pd
+        values = pd.to_datetime(pd.Series([dates] if single else dates, dtype=object)).to_numpy(dtype='datetime64[s]')
+    values = values.astype(np.int64)
+    return int(values[0]) if single else values
+
+
+def format_dates(dates):
+    # datetime64 dates to the ledger's "YYYY-MM-DD HH:MM:SS" strings
+    dates = np.asarray(dates).astype('datetime64[s]')
+    text = np.datetime_as_string(dates, unit='s')
+    if len(text) and np.all((dates >= np.datetime64('0000-01-01')) & (dates < np.datetime64('10000-01-01'))):
+        # Four-digit years: fixed width, so swap the 'T' for a space in place
+        text = text.astype('U19')
+        text.view(np.uint32).reshape(len(text), 19)[:, 10] = ord(' ')
+        return text.tolist()
+    return [date.replace('T', ' ') for date in text.tolist()]
+
+
+class BalanceIndex:
+    # Running balance ordered by (date, id), held in NumPy arrays with spare
+    # capacity. Appending a transaction newer than the last one is O(1);
+    # edits and out-of-order inserts/deletes re-accumulate only the suffix
+    # after the affected position. Balance lookups are binary searches.
+
+    def __init__(self, ids=(), dates=(), amounts=()):
+        ids = np.asarray(ids, dtype=np.int64)
+        times = to_epoch_seconds(dates) if len(ids) else np.empty(0, dtype=np.int64)
+        amounts = np.asarray(amounts, dtype=np.float64)
+        order = np.lexsort((ids, times))
+
+        self.size = len(order)
+        capacity = max(64, 2 * self.size)
+        self.times = np.empty(capacity, dtype=np.int64)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.amounts = np.empty(capacity, dtype=np.float64)
+        self.balances = np.empty(capacity, dtype=np.float64)
+        self.times[:self.size] = times[order]
+        self.ids[:self.size] = ids[order]
+        self.amounts[:self.size] = amounts[order]
+        np.cumsum(self.amounts[:self.size], out=self.balances[:self.size])
+
+    @classmethod
+    def from_store(cls, store):
+        return cls(*store.timeline())
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, size):
+        if size <= len(self.times):
+            return
+        capacity = max(size, 2 * len(self.times))
+        for name in ('times', 'ids', 'amounts', 'balances'):
+            grown = np.empty(capacity, dtype=getattr(self, name).dtype)
+            grown[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, grown)
+
+    def _position(self, time, record_id):
+        # Insertion point of (time, record_id) in the (time, id) ordering
+        lo = int(np.searchsorted(self.times[:self.size], time, 'left'))
+        hi = int(np.searchsorted(self.times[:self.size], time, 'right'))
+        return lo + int(np.searchsorted(self.ids[lo:hi], record_id))
+
+    def _reaccumulate(self, position):
+        opening = self.balances[position - 1] if position else 0.0
+        suffix = self.balances[position:self.size]
+        np.cumsum(self.amounts[position:self.size], out=suffix)
+        suffix += opening
+
+    def add(self, record):
+        time = to_epoch_seconds(record['date'])
+        n = self.size
+        self._reserve(n + 1)
+
+        if n == 0 or (time, record['id']) > (self.times[n - 1], self.ids[n - 1]):
+            self.times[n] = time
+            self.ids[n] = record['id']
+            self.amounts[n] = record['amount']
+            self.balances[n] = (self.balances[n - 1] if n else 0.0) + record['amount']
+            self.size += 1
+            return
+
+        position = self._position(time, record['id'])
+        for column in (self.times, self.ids, self.amounts):
+            column[position + 1:n + 1] = column[position:n]
+        self.times[position] = time
+        self.ids[position] = record['id']
+        self.amounts[position] = record['amount']
+        self.size += 1
+        self._reaccumulate(position)
+
+    def remove(self, record):
+        position = self._position(to_epoch_seconds(record['date']), record['id'])
+        if position >= self.size or self.ids[position] != record['id']:
+            raise KeyError(record['id'])
+        n = self.size
+        for column in (self.times, self.ids, self.amounts):
+            column[position:n - 1] = column[position + 1:n]
+        self.size -= 1
+        self._reaccumulate(position)
+
+    def replace(self, old_record, new_record):
+        if old_record['date'] != new_record['date']:
+            self.remove(old_record)
+            self.add(new_record)
+            return
+        position = self._position(to_epoch_seconds(old_record['date']), old_record['id'])
+        delta = new_record['amount'] - old_record['amount']
+        self.amounts[position] = new_record['amount']
+        self.balances[position:self.size] += delta
+
+    def _balance_through(self, time, side):
+        # Balance after the transactions before epoch second `time`, or at
+        # it too with side='right'; a binary search over the sorted times
+        position = int(np.searchsorted(self.times[:self.size], time, side))
+        return float(self.balances[position - 1]) if position else 0.0
+
+    def balance_at(self, date):
+        # Balance after every transaction dated at or before `date`
+        return self._balance_through(to_epoch_seconds(str(date)), 'right')
+
+    def change_between(self, start, end):
+        # Net amount of the transactions dated from `start` to `end`, both
+        # inclusive
+        return self._balance_through(to_epoch_seconds(str(end)), 'right') - \
+            self._balance_through(to_epoch_seconds(str(start)), 'left')
+
+    def series(self, start=None, end=None):
+        # (datetime64 dates, balances) views, optionally clipped to [start, end]
+        times = self.times[:self.size]
+        first = int(np.searchsorted(times, to_epoch_seconds(str(start)), 'left')) if start is not None else 0
+        last = int(np.searchsorted(times, to_epoch_seconds(str(end)), 'right')) if end is not None else self.size
+        return times[first:last].view('datetime64[s]'), self.balances[first:last]
+
+
+def currency_code(label):
+    # "EUR - €" -> "EUR"; plain codes pass through
+    return label.split(' - ')[0].strip()
+
+
+@functools.lru_cache(maxsize=None)
+def currency_symbol(label):
+    # "EUR - €" -> "€", parsed once per label
+    return label.split(' - ')[1]
+
+
+class ExchangeRates:
+    # Historical exchange rates: one row per date, one column per currency
+    # code, each value the units of that currency per unit of a common base
+    # currency (whose own column, if listed, is all 1). A transaction is
+    # converted at the latest rates dated on or before it; dates before the
+    # first row use the first row. Gaps in a column carry the previous rate
+    # forward.
+    #
+    # Currencies without a column are kept at face value, with a warning
+    # logged once per currency.
+
+    def __init__(self, dates, codes, table):
+        self.times = to_epoch_seconds(dates)
+        self.codes = list(codes)
+        self.table = np.asarray(table, dtype=np.float64)
+        self.column = {code: i for i, code in enumerate(self.codes)}
+        self.missing = set()
+        # Rates dated at midnight convert a whole day's rows alike, so daily
+        # totals can be converted instead of every row
+        self.daily = bool(np.all(self.times % 86400 == 0))
+
+    @classmethod
+    def load(cls, path):
+        # CSV with a date column followed by one column per currency code
+        import pandas as pd
+        frame = pd.read_csv(path, skipinitialspace=True)
+        if frame.shape[1] < 2 or frame.empty:
+            raise ValueError(f"{path}: expected a date column and at least one currency column")
+        dates = pd.to_datetime(frame.iloc[:, 0], format='ISO8601')
+        rates = frame.iloc[:, 1:].apply(pd.to_numeric, errors='coerce')
+        rates.columns = [currency_code(str(column)).upper() for column in rates.columns]
+        rates.index = dates.to_numpy(dtype='datetime64[s]')
+        rates = rates.dropna(axis=1, how='all')
+        rates = rates[~rates.index.duplicated(keep='last')].sort_index().ffill().bfill()
+        if rates.empty or (rates.to_numpy() <= 0).any():
+            raise ValueError(f"{path}: exchange rates must be positive numbers")
+        return cls(rates.index.to_numpy(), rates.columns, rates.to_numpy())
+
+    def _columns(self, labels):
+        columns = []
+        for label in labels:
+            code = currency_code(label)
+            if code not in self.column and code not in self.missing:
+                self.missing.add(code)
+                logger.warning("No exchange rates for %s; its amounts are not converted", code)
+            columns.append(self.column.get(code, -1))
+        return np.array(columns, dtype=np.intp)
+
+    def factors(self, dates, currency_codes, currencies, target):
+        # Per-row factors into `target` for rows dated `dates` (datetime64 or
+        # epoch seconds) whose currency is currencies[currency_codes[row]]
+        count = len(currency_codes)
+        factors = np.ones(count)
+        target_column = self._columns([target])[0]
+        if target_column < 0 or not count:
+            return factors
+        source = self._columns(currencies)[currency_codes]
+        rows = np.searchsorted(self.times, np.asarray(dates).astype('datetime64[s]').astype(np.int64), 'right') - 1
+        np.maximum(rows, 0, out=rows)
+        known = np.flatnonzero(source >= 0)
+        rows = rows[known]
+        factors[known] = self.table[rows, target_column] / self.table[rows, source[known]]
+        return factors
+
+    def convert(self, record, target, default_currency):
+        # One record's amount in `target`, computed exactly as in bulk
+        factor = self.factors([to_epoch_seconds(record['date'])], np.zeros(1, dtype=np.intp),
+                              [record.get('currency') or default_currency], target)
+        return float(record['amount'] * factor[0])
+
+
+class CurrencyAggregates:
+    # Expense totals and running balance of a store in any reporting
+    # currency. Each currency's CategoryTotals and BalanceIndex are built on
+    # first use from a vectorized conversion of the whole ledger and then
+    # kept current by the same add/remove/replace deltas as a single pair,
+    # so switching back and forth between currencies costs nothing.
+    # Converted amount columns are memoized per currency until the store
+    # changes; the least recently used ones beyond MAX_CURRENCIES are dropped.
+    # Rollups per currency are built on first use and maintained the same way.
+    #
+    # Without rates every currency shares the unconverted aggregates.
+    #
+    # Over an SQLiteTransactionStore with no writes pending they are built
+    # in SQL (daily totals and rows read straight into arrays) instead of
+    # from aggregate_columns(), so the table is never held in memory; with
+    # rates this needs rates dated at midnight (see ExchangeRates.daily).
+
+    MAX_CURRENCIES = 4
+
+    def __init__(self, rates=None, default_currency=CURRENCIES[0], verify=False):
+        self.rates = rates
+        self.default_currency = default_currency
+        self.verify = verify
+        self.store = None
+        self._columns = None
+        self._aggregates = OrderedDict()
+        self._rollups = OrderedDict()
+        self._amounts = OrderedDict()
+
+    def reset(self, store):
+        # Starts over for `store`
+        self.store = store
+        self._columns = None
+        self._aggregates.clear()
+        self._rollups.clear()
+        self._amounts.clear()
+
+    def _key(self, currency):
+        return None if self.rates is None else currency_code(currency)
+
+    def columns(self):
+        # store.aggregate_columns(), read again only after the store changed
+        if self._columns is None or self._columns[0] != self.store.version:
+            self._columns = (self.store.version,) + self.store.aggregate_columns()
+        return self._columns[1:]
+
+    def amounts(self, currency):
+        # Converted amounts aligned with columns()
+        key = self._key(currency)
+        cached = self._amounts.get(key)
+        if cached is not None and cached[0] == self.store.version:
+            self._amounts.move_to_end(key)
+            return cached[1]
+        columns, strings = self.columns()
+        amounts = columns['amount']
+        if self.rates is not None:
+            currencies = [value or self.default_currency for value in strings['currency']]
+            amounts = amounts * self.rates.factors(columns['date'], columns['currency'], currencies, currency)
+        self._amounts[key] = (self.store.version, amounts)
+        while len(self._amounts) > self.MAX_CURRENCIES:
+            self._amounts.popitem(last=False)
+        return amounts
+
+    def _summarize(self, currency):
+        if self.rates is None:
+            return lambda store: store.expense_summary()
+        def summarize(store):
+            columns, strings = self.columns()
+            return summarize_columns(columns['category'], strings['category'], self.amounts(currency))
+        return summarize
+
+    def _in_sql(self):
+        return isinstance(self.store, SQLiteTransactionStore) and (self.rates is None or self.rates.daily) \
+            and self.store.in_sync()
+
+    def _daily(self, currency, where="", params=()):
+        # (daily totals, income, expenses) in `currency` over the rows
+        # matching `where`, see SQLiteTransactionStore.daily_totals()
+        totals = self.store.daily_totals(where, params)
+        income, expenses = totals['income'], totals['expenses']
+        if self.rates is not None:
+            currencies = [value or self.default_currency for value in totals['currencies']]
+            factors = self.rates.factors(totals['day'].astype('datetime64[D]'), totals['currency'], currencies,
+                                         currency)
+            income, expenses = income * factors, expenses * factors
+        return totals, income, expenses
+
+    @staticmethod
+    def _daily_summary(totals, expenses):
+        # {category: (expense total, count)} of daily totals
+        spending = totals['expense_count'] > 0
+        codes = totals['category'][spending]
+        spent = np.bincount(codes, weights=expenses[spending], minlength=len(totals['categories']))
+        counts = np.bincount(codes, weights=totals['expense_count'][spending], minlength=len(totals['categories']))
+        return {totals['categories'][code]: (float(spent[code]), int(counts[code]))
+                for code in np.flatnonzero(counts).tolist()}
+
+    def _timeline(self, currency, where="", params=()):
+        # (ids, dates, amounts in `currency`) of the rows matching `where`
+        ids, dates, amounts, codes, currencies = self.store.balance_columns(where, params)
+        if self.rates is not None:
+            currencies = [value or self.default_currency for value in currencies]
+            amounts = amounts * self.rates.factors(dates, codes, currencies, currency)
+        return ids, dates, amounts
+
+    def _entry(self, currency):
+        # [CategoryTotals, BalanceIndex] of `currency`, each None until used
+        key = self._key(currency)
+        entry = self._aggregates.get(key)
+        if entry is not None:
+            self._aggregates.move_to_end(key)
+            return entry
+        entry = self._aggregates[key] = [None, None]
+        while len(self._aggregates) > self.MAX_CURRENCIES:
+            self._aggregates.popitem(last=False)
+        return entry
+
+    def category_totals(self, currency):
+        # CategoryTotals in `currency`, built on first use
+        entry = self._entry(currency)
+        if entry[0] is None:
+            if self.rates is None:
+                entry[0] = CategoryTotals(self.store.expense_summary(), self.verify)
+                return entry[0]
+            if self._in_sql():
+                totals, income, expenses = self._daily(currency)
+                summary = self._daily_summary(totals, expenses)
+            else:
+                columns, strings = self.columns()
+                summary = summarize_columns(columns['category'], strings['category'], self.amounts(currency))
+            entry[0] = CategoryTotals(summary, self.verify, self._summarize(currency))
+        return entry[0]
+
+    def balance_index(self, currency):
+        # BalanceIndex in `currency`, built on first use
+        entry = self._entry(currency)
+        if entry[1] is None:
+            if self.rates is None:
+                entry[1] = BalanceIndex.from_store(self.store)
+            elif self._in_sql():
+                entry[1] = BalanceIndex(*self._timeline(currency))
+            else:
+                columns, strings = self.columns()
+                entry[1] = BalanceIndex(columns['id'], columns['date'], self.amounts(currency))
+        return entry[1]
+
+    def in_currency(self, currency):
+        # (CategoryTotals, BalanceIndex) in `currency`
+        return self.category_totals(currency), self.balance_index(currency)
+
+    def rollups(self, currency):
+        # Rollups in `currency`, built on first use like in_currency()
+        key = self._key(currency)
+        rollups = self._rollups.get(key)
+        if rollups is not None:
+            self._rollups.move_to_end(key)
+            return rollups
+        if self._in_sql():
+            rollups = Rollups.from_daily(*self._daily(currency))
+        else:
+            columns, strings = self.columns()
+            rollups = Rollups(columns['date'], columns['category'], strings['category'], self.amounts(currency))
+        self._rollups[key] = rollups
+        while len(self._rollups) > self.MAX_CURRENCIES:
+            self._rollups.popitem(last=False)
+        return rollups
+
+    def subset_rollups(self, currency, query, index):
+        # Rollups over the rows matching `query`, which `index` (the store's
+        # TransactionIndex) selects unless the query runs in SQL
+        if self._in_sql():
+            return Rollups.from_daily(*self._daily(currency, *self.store.where(query, self.default_currency)))
+        rows = index.select(query)
+        columns, strings = self.columns()
+        return Rollups(columns['date'][rows], columns['category'][rows], strings['category'],
+                       self.amounts(currency)[rows])
+
+    def subset(self, currency, query, index):
+        # (expense summary, BalanceIndex) in `currency` over the rows
+        # matching `query`, selected like in subset_rollups()
+        if self._in_sql():
+            where, params = self.store.where(query, self.default_currency)
+            totals, income, expenses = self._daily(currency, where, params)
+            return self._daily_summary(totals, expenses), BalanceIndex(*self._timeline(currency, where, params))
+        rows = index.select(query)
+        columns, strings = self.columns()
+        amounts = self.amounts(currency)[rows]
+        summary = summarize_columns(columns['category'][rows], strings['category'], amounts)
+        return summary, BalanceIndex(columns['id'][rows], columns['date'][rows], amounts)
+
+    def _converted(self, record, key):
+        if key is None:
+            return record
+        return dict(record, amount=self.rates.convert(record, key, self.default_currency))
+
+    def _maintained(self):
+        # (currency key, aggregate) for everything kept up to date
+        for key, entry in self._aggregates.items():
+            for aggregate in entry:
+                if aggregate is not None:
+                    yield key, aggregate
+        yield from self._rollups.items()
+
+    def add(self, record):
+        converted = {}
+        for key, aggregate in self._maintained():
+            if key not in converted:
+                converted[key] = self._converted(record, key)
+            aggregate.add(converted[key])
+
+    def remove(self, record):
+        converted = {}
+        for key, aggregate in self._maintained():
+            if key not in converted:
+                converted[key] = self._converted(record, key)
+            aggregate.remove(converted[key])
+
+    def replace(self, old_record, new_record):
+        converted = {}
+        for key, aggregate in self._maintained():
+            if key not in converted:
+                converted[key] = (self._converted(old_record, key), self._converted(new_record, key))
+            aggregate.replace(*converted[key])
+
+
+class Rollups:
+    # Materialized totals per day, week (from Monday), month and year:
+    # income, expenses and count per bucket, and expenses per category per
+    # bucket. Built in bulk from columns, then kept current by the same
+    # add/remove/replace deltas as CategoryTotals, so period charts read a
+    # few hundred buckets instead of scanning the ledger. Expenses are
+    # positive totals, as in CategoryTotals.
+
+    PERIODS = ('day', 'week', 'month', 'year')
+
+    def __init__(self, dates=(), category_codes=(), categories=(), amounts=()):
+        amounts = np.asarray(amounts, dtype=np.float64)
+        expenses = amounts < 0
+        self._build(np.asarray(dates).astype('datetime64[s]').astype(np.int64),
+                    np.asarray(category_codes, dtype=np.int64), categories,
+                    np.where(expenses, 0.0, amounts), np.where(expenses, -amounts, 0.0),
+                    np.ones(len(amounts), dtype=np.int64), expenses.astype(np.int64))
+
+    @classmethod
+    def from_daily(cls, totals, income, expenses):
+        # Rollups from SQLiteTransactionStore.daily_totals() groups, with
+        # their income and expenses given separately (e.g. converted)
+        rollups = cls.__new__(cls)
+        rollups._build(totals['day'] * 86400, totals['category'].astype(np.int64), totals['categories'],
+                       income, expenses, totals['count'], totals['expense_count'])
+        return rollups
+
+    def _build(self, times, codes, categories, income, expenses, counts, expense_counts):
+        # From groups of rows (single rows or pre-summed ones): their time,
+        # category code, income, expenses (positive), row count and expense
+        # row count
+        self.totals = {}
+        self.categories = {}
+        spending = expense_counts > 0
+        for period in self.PERIODS:
+            buckets = self.buckets(period, times)
+            keys, inverse = np.unique(buckets, return_inverse=True)
+            earned = np.bincount(inverse, weights=income, minlength=len(keys))
+            spent = np.bincount(inverse, weights=expenses, minlength=len(keys))
+            count = np.bincount(inverse, weights=counts, minlength=len(keys)).astype(np.int64)
+            self.totals[period] = {key: [i, e, c] for key, i, e, c in
+                                   zip(keys.tolist(), earned.tolist(), spent.tolist(), count.tolist())}
+
+            # Expense totals per (bucket, category) pair
+            pairs = buckets[spending] * max(len(categories), 1) + codes[spending]
+            keys, inverse = np.unique(pairs, return_inverse=True)
+            spent = np.bincount(inverse, weights=expenses[spending], minlength=len(keys))
+            count = np.bincount(inverse, weights=expense_counts[spending], minlength=len(keys)).astype(np.int64)
+            bucket_of, code_of = np.divmod(keys, max(len(categories), 1))
+            self.categories[period] = {(bucket, categories[code]): [e, c] for bucket, code, e, c in
+                                       zip(bucket_of.tolist(), code_of.tolist(), spent.tolist(), count.tolist())}
+
+    @staticmethod
+    def buckets(period, times):
+        # Bucket numbers of int64 epoch seconds
+        days = np.floor_divide(times, 86400)
+        if period == 'day':
+            return days
+        if period == 'week':
+            # 1970-01-01 was a Thursday; weeks start on Monday
+            return np.floor_divide(days + 3, 7)
+        unit = 'M' if period == 'month' else 'Y'
+        return days.astype('datetime64[D]').astype(f'datetime64[{unit}]').astype(np.int64)
+
+    @staticmethod
+    def starts(period, buckets):
+        # First day of each bucket as datetime64[D]
+        buckets = np.asarray(buckets, dtype=np.int64)
+        if period == 'day':
+            return buckets.astype('datetime64[D]')
+        if period == 'week':
+            return (buckets * 7 - 3).astype('datetime64[D]')
+        unit = 'M' if period == 'month' else 'Y'
+        return buckets.astype(f'datetime64[{unit}]').astype('datetime64[D]')
+
+    def _apply(self, record, sign):
+        time = np.array([to_epoch_seconds(record['date'])], dtype=np.int64)
+        amount = record['amount']
+        expense = -amount if amount < 0 else 0.0
+        income = 0.0 if amount < 0 else amount
+        buckets = [(period, int(self.buckets(period, time)[0])) for period in self.PERIODS]
+        if sign < 0:
+            # A record that was never added would leave negative counts
+            # behind; fail before changing anything, like CategoryTotals
+            for period, bucket in buckets:
+                if bucket not in self.totals[period] or (
+                        amount < 0 and (bucket, record['category']) not in self.categories[period]):
+                    raise KeyError(f"Transaction {record.get('id')} is not in the {period} rollups")
+        for period, bucket in buckets:
+            self._add_to(self.totals[period], bucket, (sign * income, sign * expense), sign)
+            if amount < 0:
+                self._add_to(self.categories[period], (bucket, record['category']), (sign * expense,), sign)
+
+    @staticmethod
+    def _add_to(table, key, values, sign):
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = [0.0] * len(values) + [0]
+        entry[-1] += sign
+        if not entry[-1]:
+            # Drop the bucket outright instead of leaving rounding residue
+            del table[key]
+            return
+        for i, value in enumerate(values):
+            entry[i] += value
+
+    def add(self, record):
+        self._apply(record, 1)
+
+    def remove(self, record):
+        self._apply(record, -1)
+
+    def replace(self, old_record, new_record):
+        self.remove(old_record)
+        self.add(new_record)
+
+    def series(self, period):
+        # (bucket start dates, income, expenses, net) in date order
+        table = self.totals[period]
+        keys = sorted(table)
+        income = np.array([table[key][0] for key in keys], dtype=np.float64)
+        expenses = np.array([table[key][1] for key in keys], dtype=np.float64)
+        return self.starts(period, keys), income, expenses, income - expenses
+
+    def category_series(self, period, top=8, other="Other"):
+        # (bucket start dates, category labels, expenses as a labels x
+        # buckets array) for the `top` categories by total, the rest summed
+        # under `other`
+        table = self.categories[period]
+        keys = sorted({bucket for bucket, category in table})
+        totals = {}
+        for (bucket, category), (spent, count) in table.items():
+            totals[category] = totals.get(category, 0.0) + spent
+        labels = sorted(totals, key=totals.get, reverse=True)
+        if len(labels) > top:
+            labels = labels[:top - 1] + [other]
+        row = {category: labels.index(category) if category in labels else len(labels) - 1 for category in totals}
+        column = {bucket: i for i, bucket in enumerate(keys)}
+        values = np.zeros((len(labels), len(keys)))
+        for (bucket, category), (spent, count) in table.items():
+            values[row[category], column[bucket]] += spent
+        return self.starts(period, keys), labels, values
+
+
+class TransactionQuery:
+    # A filter over transactions; empty fields don't restrict. `text` is
+    # matched case-insensitively inside the category, dates are
+    # "YYYY-MM-DD" (or with a time) and both ends are inclusive, and the
+    # amount bounds apply to the absolute amount, as the table shows it.
+    # Raises ValueError for dates that can't be read.
+
+    def __init__(self, text="", type=None, currency=None, start=None, end=None, min_amount=None,
+                 max_amount=None):
+        self.text = text.strip().casefold()
+        self.type = type
+        self.currency = currency
+        self.start = start or None
+        self.end = end or None
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+        self.start_time = self._time(self.start, 0)
+        self.end_time = self._time(self.end, 1)
+
+    @staticmethod
+    def _time(date, after):
+        # Epoch seconds of a bound; a bare end date covers the whole day
+        if date is None:
+            return None
+        value = np.datetime64(date.strip())
+        if after and value.dtype == np.dtype('datetime64[D]'):
+            return int((value + 1).astype('datetime64[s]').astype(np.int64)) - 1
+        return int(value.astype('datetime64[s]').astype(np.int64))
+
+    def key(self):
+        # Hashable identity of the filter, e.g. for caching what it selects
+        return (self.text, self.type, self.currency, self.start_time, self.end_time, self.min_amount,
+                self.max_amount)
+
+    def is_empty(self):
+        return not self.text and all(value is None for value in (
+            self.type, self.currency, self.start, self.end, self.min_amount, self.max_amount))
+
+    def without_dates(self):
+        return TransactionQuery(self.text, self.type, self.currency, None, None, self.min_amount, self.max_amount)
+
+    def accepts(self, field, value, default_currency):
+        # Whether a type/category/currency value passes
+        if field == 'category':
+            return self.text in (value or "").casefold()
+        if field == 'currency':
+            return self.currency is None or (value or default_currency) == self.currency
+        return self.type is None or value == self.type
+
+    def matches(self, record, default_currency):
+        if not all(self.accepts(field, record.get(field), default_currency) for field in ('type', 'category',
+                                                                                        'currency')):
+            return False
+        time = to_epoch_seconds(record['date'])
+        amount = abs(record['amount'])
+        return (self.start_time is None or time >= self.start_time) and \
+            (self.end_time is None or time <= self.end_time) and \
+            (self.min_amount is None or amount >= self.min_amount) and \
+            (self.max_amount is None or amount <= self.max_amount)
+
+
+class TransactionIndex:
+    # Filter indexes over a store's rows: an inverted index (row positions
+    # per value) for type, category and currency, and the rows sorted by
+    # date and by absolute amount. select() starts from whichever index
+    # yields the fewest candidates and checks the other conditions on those
+    # alone, so narrow queries cost little even over a million rows.
+    #
+    # Rows appended since the build are checked one by one. The owner calls
+    # changed() after edits and removals (or bulk appends), and the indexes
+    # are rebuilt on the next query. `columns` can supply the store's
+    # aggregate_columns() from elsewhere, e.g. CurrencyAggregates.columns,
+    # so a database-backed store is read once for both. A database-backed
+    # store with no writes pending is queried in SQL instead.
+
+    CODED_FIELDS = ('type', 'category', 'currency')
+    MAX_TAIL = 4096
+    # Candidate sets above 1/SCAN_FRACTION of the rows are scanned instead
+    SCAN_FRACTION = 8
+
+    def __init__(self, store, default_currency=CURRENCIES[0], columns=None):
+        self.store = store
+        self.default_currency = default_currency
+        self.source = columns or store.aggregate_columns
+        self.size = 0
+        self.dirty = True
+
+    def changed(self):
+        self.dirty = True
+
+    def _build(self):
+        columns, strings = self.source()
+        self.size = len(columns['id'])
+        self.codes = {}
+        self.inverted = {}
+        for field in self.CODED_FIELDS:
+            codes = self.codes[field] = np.array(columns[field])
+            order = np.argsort(codes, kind='stable')
+            self.inverted[field] = (list(strings[field]), order,
+                                    np.searchsorted(codes[order], np.arange(len(strings[field]) + 1)))
+        self.times = columns['date'].astype(np.int64)
+        self.by_time = np.argsort(self.times, kind='stable')
+        self.sorted_times = self.times[self.by_time]
+        self.amounts = np.abs(columns['amount'])
+        self.by_amount = np.argsort(self.amounts, kind='stable')
+        self.sorted_amounts = self.amounts[self.by_amount]
+        self.dirty = False
+
+    def _mask(self, query, allowed, rows):
+        # Which of `rows` (positions or a slice) pass every condition
+        mask = np.ones(len(self.times[rows]), dtype=bool)
+        for field, accepted in allowed.items():
+            mask &= accepted[self.codes[field][rows]]
+        for values, low, high in ((self.times, query.start_time, query.end_time),
+                                  (self.amounts, query.min_amount, query.max_amount)):
+            if low is not None:
+                mask &= values[rows] >= low
+            if high is not None:
+                mask &= values[rows] <= high
+        return mask
+
+    @staticmethod
+    def _range(sorted_values, order, low, high):
+        first = 0 if low is None else int(np.searchsorted(sorted_values, low, 'left'))
+        last = len(sorted_values) if high is None else int(np.searchsorted(sorted_values, high, 'right'))
+        return max(last - first, 0), lambda: order[first:max(first, last)]
+
+    def select(self, query):
+        # Sorted positions of the rows matching `query`
+        size = len(self.store)
+        if query.is_empty():
+            return np.arange(size, dtype=np.int64)
+        if isinstance(self.store, SQLiteTransactionStore) and self.store.in_sync():
+            return self.store.select(query, self.default_currency)
+        if self.dirty or size < self.size or size - self.size > self.MAX_TAIL:
+            self._build()
+
+        allowed = {}
+        candidates = []
+        for field in self.CODED_FIELDS:
+            values, order, starts = self.inverted[field]
+            accepted = np.array([query.accepts(field, value, self.default_currency) for value in values],
+                                dtype=bool)
+            if accepted.all():
+                continue
+            allowed[field] = accepted
+            codes = np.flatnonzero(accepted)
+            candidates.append((int(np.diff(starts)[codes].sum()), lambda order=order, starts=starts, codes=codes:
+                               np.concatenate([order[starts[c]:starts[c + 1]] for c in codes])
+                               if len(codes) else np.empty(0, dtype=np.int64)))
+        if query.start_time is not None or query.end_time is not None:
+            candidates.append(self._range(self.sorted_times, self.by_time, query.start_time, query.end_time))
+        if query.min_amount is not None or query.max_amount is not None:
+            candidates.append(self._range(self.sorted_amounts, self.by_amount, query.min_amount, query.max_amount))
+
+        count, fetch = min(candidates, key=lambda candidate: candidate[0]) if candidates else (self.size, None)
+        if fetch is None or count > self.size // self.SCAN_FRACTION:
+            # Not selective: one pass over whole columns beats gathering
+            rows = np.flatnonzero(self._mask(query, allowed, slice(None)))
+        else:
+            rows = fetch()
+            rows = np.sort(rows[self._mask(query, allowed, rows)])
+
+        tail = [row for row in range(self.size, size) if query.matches(self.store[row], self.default_currency)]
+        if tail:
+            rows = np.concatenate([rows, np.array(tail, dtype=np.int64)])
+        return rows.astype(np.int64, copy=False)
+
+
+# Accepted header names per field of a CSV statement, in order of preference
+STATEMENT_COLUMNS = {
+    'date': ('date', 'transaction date', 'booking date', 'posting date', 'posted'),
+    'amount': ('amount', 'value', 'sum'),
+    'type': ('type', 'transaction type'),
+    'category': ('category', 'payee', 'description', 'name', 'memo'),
+    'currency': ('currency',)
+}
+
+# Type column values understood besides the income/expense labels
+INCOME_TYPES = {'income', 'credit', 'deposit', 'cr'}
+EXPENSE_TYPES = {'expense', 'debit', 'withdrawal', 'payment', 'dr'}
+
+
+def _read_csv_statement(path):
+    import pandas as pd
+    raw = pd.read_csv(path, dtype=str, keep_default_na=False, skipinitialspace=True)
+    headers = {str(name).strip().lower(): name for name in raw.columns}
+    frame = pd.DataFrame(index=raw.index)
+    for field, names in STATEMENT_COLUMNS.items():
+        for name in names:
+            if name in headers:
+                frame[field] = raw[headers[name]]
+                break
+    missing = {'date', 'amount'} - set(frame.columns)
+    if missing:
+        raise ValueError(f"{path}: no {' or '.join(sorted(missing))} column")
+    # Row i is on line i + 2, after the header
+    return frame, np.arange(2, len(frame) + 2), "line"
+
+
+def _read_ofx_statement(path):
+    # OFX/QFX (SGML or XML flavour): one <STMTTRN> block per transaction
+    import pandas as pd
+    with open(path, encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    currency = re.search(r'<CURDEF>\s*([^<\s]+)', text)
+    rows = []
+    for block in re.findall(r'<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|</BANKTRANLIST>)', text, re.S | re.I):
+        fields = {tag.upper(): value.strip() for tag, value in re.findall(r'<(\w+)>([^<\r\n]*)', block)}
+        posted = fields.get('DTPOSTED', '')
+        rows.append({
+            # YYYYMMDD[HHMMSS[.XXX]][[offset:TZ]]
+            'date': posted[:14] if posted[:14].isdigit() else posted[:8],
+            'amount': fields.get('TRNAMT', ''),
+            'category': fields.get('NAME') or fields.get('PAYEE') or fields.get('MEMO', ''),
+            'currency': fields.get('CURRENCY') or (currency.group(1) if currency else '')
+        })
+    frame = pd.DataFrame(rows, columns=['date', 'amount', 'category', 'currency'], dtype=str)
+    return frame, np.arange(1, len(frame) + 1), "transaction"
+
+
+def _read_qif_statement(path):
+    # QIF: one field per line (D date, T/U amount, P payee, L category),
+    # records end with ^
+    import pandas as pd
+    rows, lines = [], []
+    record, start = {}, None
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for number, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if not line or line.startswith('!'):
+                continue
+            if line.startswith('^'):
+                if record:
+                    rows.append(record)
+                    lines.append(start)
+                record, start = {}, None
+                continue
+            start = start or number
+            code, value = line[0], line[1:].strip()
+            if code == 'D':
+                # 1/15'24 -> 1/15/24
+                record['date'] = value.replace("'", "/").replace(' ', '')
+            elif code in 'TU':
+                record.setdefault('amount', value.replace(',', ''))
+            elif code == 'L':
+                record['category'] = value.strip('[]')
+            elif code == 'P':
+                record.setdefault('payee', value)
+    if record:
+        rows.append(record)
+        lines.append(start)
+    frame = pd.DataFrame(rows, columns=['date', 'amount', 'category', 'payee'], dtype=str).fillna('')
+    frame['category'] = frame['category'].where(frame['category'] != '', frame['payee'])
+    return frame.drop(columns='payee'), np.array(lines, dtype=np.int64), "line"
+
+
+def _strip_labels(series):
+    # str.strip for a column with few distinct values: strips each distinct
+    # value once instead of every row
+    import pandas as pd
+    codes, uniques = pd.factorize(series)
+    stripped = np.array([value.strip() for value in uniques] + [''], dtype=object)
+    return pd.Series(stripped[codes], index=series.index)
+
+
+STATEMENT_READERS = {'.ofx': _read_ofx_statement, '.qfx': _read_ofx_statement, '.qif': _read_qif_statement}
+
+
+def read_statement(path, income_label="Income", expense_label="Expense", currency=None, currencies=None,
+                   default_category="Uncategorized", dayfirst=False):
+    # Parses a CSV, OFX/QFX or QIF statement with vectorized validation.
+    # Returns (columns, errors): columns holds the valid rows as a datetime64
+    # 'date' array, a float64 'amount' array and 'type'/'category'/
+    # 'currency' object arrays, ready for ColumnarStore.extend_columns once
+    # an 'id' array is added; errors lists "line N: problem" for every
+    # skipped row.
+    #
+    # Amounts follow the ledger's sign convention: a type column (income/
+    # expense, credit/debit, ...) decides the sign, otherwise the sign
+    # decides the type. Currencies may be given as labels ("USD - $") or
+    # codes ("USD") when currencies lists the known labels; rows without
+    # one get currency.
+    import pandas as pd
+    reader = STATEMENT_READERS.get(os.path.splitext(path)[1].lower(), _read_csv_statement)
+    frame, positions, unit = reader(path)
+    count = len(frame)
+    problems = {}
+    bad = np.zeros(count, dtype=bool)
+
+    def reject(mask, describe):
+        for i in np.flatnonzero(mask & ~bad).tolist():
+            problems[i] = describe(i)
+        bad[mask] = True
+
+    # Both parsers skip surrounding whitespace (or retry without it)
+    text = frame['amount']
+    amounts = pd.to_numeric(text, errors='coerce').to_numpy(dtype=np.float64)
+    reject(~np.isfinite(amounts), lambda i: f"invalid amount {text.iat[i]!r}")
+
+    text = frame['date']
+    dates = pd.to_datetime(text, errors='coerce', format='ISO8601')
+    retry = dates.isna().to_numpy()
+    if retry.any():
+        retried = text[retry].str.strip()
+        parsed = pd.to_datetime(retried, errors='coerce', format='ISO8601')
+        # Anything else (e.g. 15.01.2024, 1/15/24, 20240115) row by row
+        unparsed = parsed.isna() & (retried != '')
+        if unparsed.any():
+            parsed[unparsed] = pd.to_datetime(retried[unparsed], errors='coerce', format='mixed', dayfirst=dayfirst)
+        dates[retry] = parsed
+    if isinstance(dates.dtype, pd.DatetimeTZDtype):
+        dates = dates.dt.tz_localize(None)
+    dates = dates.to_numpy(dtype='datetime64[s]')
+    reject(np.isnat(dates), lambda i: f"invalid date {text.iat[i]!r}")
+
+    expenses = amounts < 0
+    if 'type' in frame:
+        text = _strip_labels(frame['type'])
+        kind = text.str.lower()
+        is_income = kind.isin(INCOME_TYPES | {income_label.lower()}).to_numpy()
+        is_expense = kind.isin(EXPENSE_TYPES | {expense_label.lower()}).to_numpy()
+        given = (text != '').to_numpy()
+        reject(given & ~is_income & ~is_expense, lambda i: f"unknown type {text.iat[i]!r}")
+        expenses = np.where(given, is_expense, expenses)
+        amounts = np.where(expenses, -np.abs(amounts), np.abs(amounts))
+    types = np.where(expenses, expense_label, income_label).astype(object)
+
+    if 'category' in frame:
+        categories = _strip_labels(frame['category'])
+        categories = categories.where(categories != '', default_category).to_numpy(dtype=object)
+    else:
+        categories = np.full(count, default_category, dtype=object)
+
+    text = _strip_labels(frame['currency']) if 'currency' in frame else pd.Series([''] * count, dtype=object)
+    if currencies:
+        labels = {label: label for label in currencies}
+        labels.update((label.split(' - ')[0], label) for label in currencies)
+        currency_labels = text.map(labels)
+        reject((currency_labels.isna() & (text != '')).to_numpy(), lambda i: f"unknown currency {text.iat[i]!r}")
+        text = currency_labels.fillna('')
+    currency_values = text.where(text != '', currency).to_numpy(dtype=object)
+    reject(pd.isna(currency_values), lambda i: "no currency")
+
+    keep = ~bad
+    columns = {
+        'date': dates[keep],
+        'amount': amounts[keep],
+        'type': types[keep],
+        'category': categories[keep],
+        'currency': currency_values[keep]
+    }
+    errors = [f"{unit} {positions[i]}: {problems[i]}" for i in sorted(problems)]
+    return columns, errors
+
+
+class CommandLog:
+    # Undo/redo history of ledger changes. Each entry is one user action,
+    # however many records it touched, kept as the change it made:
+    #   ('add', records)              records that were added
+    #   ('delete', records)           records that were removed
+    #   ('edit', [(before, after)])   records before and after an edit
+    # undo() returns the inverse change to apply and redo() the change
+    # itself, so either is a delta on the store and aggregates rather than a
+    # reload. Only the last `depth` actions are kept.
+
+    INVERSES = {'add': 'delete', 'delete': 'add'}
+
+    def __init__(self, depth=100):
+        self.undo_stack = deque(maxlen=depth)
+        self.redo_stack = []
+
+    @property
+    def depth(self):
+        return self.undo_stack.maxlen
+
+    def set_depth(self, depth):
+        # Keeps the most recent actions that still fit
+        self.undo_stack = deque(self.undo_stack, maxlen=depth)
+        del self.redo_stack[:max(len(self.redo_stack) - depth, 0)]
+
+    def record(self, kind, changes):
+        # A new action; whatever was undone before can't be redone anymore
+        self.undo_stack.append((kind, changes))
+        self.redo_stack.clear()
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def undo(self):
+        kind, changes = self.undo_stack.pop()
+        self.redo_stack.append((kind, changes))
+        return self.inverse(kind, changes)
+
+    def redo(self):
+        kind, changes = self.redo_stack.pop()
+        self.undo_stack.append((kind, changes))
+        return kind, changes
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    @classmethod
+    def inverse(cls, kind, changes):
+        if kind == 'edit':
+            return kind, [(after, before) for before, after in changes]
+        return cls.INVERSES[kind], changes
+
+
+class Ledger:
+    # A ledger opened without the GUI: its storage, store and aggregates
+    # (see CurrencyAggregates; pass rates to report in other currencies).
+
+    def __init__(self, storage, rates=None):
+        self.storage = storage
+        self.transactions = storage.load_store()
+        self.aggregates = CurrencyAggregates(rates)
+        self.refresh_aggregates()
+
+    def refresh_aggregates(self):
+        self.aggregates.reset(self.transactions)
+
+    def import_statement(self, path, **options):
+        # Bulk import of a statement file (see read_statement) as one storage
+        # write; returns (imported count, errors)
+        columns, errors = read_statement(path, **options)
+        count = len(columns['amount'])
+        first = self.storage.reserve_ids(count)
+        columns['id'] = np.arange(first, first + count, dtype=np.int64)
+        self.storage.write_columns(columns)
+        self.storage.finish_columns()
+        self.transactions.extend_columns(columns)
+        self.refresh_aggregates()
+        if self.storage.needs_compaction():
+            self.storage.compact(self.transactions, wait=True)
+        return count, errors
+
+    def import_records(self, records, chunk_size=10000):
+        # Appends records under new ids, one storage batch per chunk, in a
+        # single pass over the input; returns how many were imported
+        count = 0
+        chunk = []
+        for record in records:
+            record = dict(record)
+            record.pop('id', None)
+            chunk.append({'id': self.storage.new_id(), **record})
+            if len(chunk) == chunk_size:
+                count += self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            count += self._import_chunk(chunk)
+
+        if isinstance(self.storage, SQLiteStorage):
+            # The rows are in the database; pick up their ids
+            self.transactions = SQLiteTransactionStore(self.storage.connection)
+        self.refresh_aggregates()
+        if self.storage.needs_compaction():
+            self.storage.compact(self.transactions, wait=True)
+        return count
+
+    def _import_chunk(self, chunk):
+        self.storage.write_batch([('add', record) for record in chunk])
+        if not isinstance(self.storage, SQLiteStorage):
+            self.transactions.extend(chunk)
+        return len(chunk)
+
+    def close(self):
+        self.storage.close()
+
+
+# Exact sums are Python ints in units of 2**-EXACT_SCALE, which represents
+# every float64 (the smallest subnormal is 2**-1074, and np.frexp's
+# mantissas carry 53 more bits)
+EXACT_SCALE = 1127
+
+
+def exact_sums(keys, values):
+    # {key: exact sum of the values with that key} for int64 keys. Unlike
+    # float sums these don't depend on the order of the additions, so
+    # partial sums over any split of the rows merge to the same total.
+    # Each value is a 53-bit integer mantissa times a power of two; the
+    # mantissas are summed per (key, exponent) in two 26/27-bit halves,
+    # whose float64 bincounts stay exact below 2**26 rows.
+    mantissas, exponents = np.frexp(np.asarray(values, dtype=np.float64))
+    mantissas = (mantissas * 2.0 ** 53).astype(np.int64)
+    high, low = mantissas >> 26, mantissas & (2 ** 26 - 1)
+    combined = np.asarray(keys, dtype=np.int64) * 4096 + (exponents + 2048)
+    groups, inverse = np.unique(combined, return_inverse=True)
+    high = np.bincount(inverse, weights=high, minlength=len(groups))
+    low = np.bincount(inverse, weights=low, minlength=len(groups))
+    keys, exponents = np.divmod(groups, 4096)
+
+    sums = {}
+    for key, exponent, h, l in zip(keys.tolist(), (exponents - 2048).tolist(), high.tolist(), low.tolist()):
+        sums[key] = sums.get(key, 0) + (((int(h) << 26) + int(l)) << (exponent - 53 + EXACT_SCALE))
+    return sums
+
+
+def exact_float(total):
+    # Correctly rounded float of an exact sum
+    return total / (1 << EXACT_SCALE)
+
+
+def ledger_partial(path, currency=CURRENCIES[0], rates=None, period='month'):
+    # Partial aggregates of one ledger file (JSON, SQLite for ".db" or a
+    # binary snapshot for ".fin") in
+    # `currency`, with exact sums so they merge without rounding (see
+    # LedgerReport). Runs in the worker processes of aggregate_ledgers, so
+    # the file is opened read-only: a report never truncates, compacts or
+    # migrates a ledger another process may have open. A ledger imported
+    # into but never compacted is only a journal so far.
+    if not os.path.exists(path) and not os.path.exists(path + ".journal"):
+        raise FileNotFoundError(path)
+    if path.endswith('.db'):
+        storage = SQLiteStorage(path, read_only=True)
+    elif path.endswith('.fin'):
+        storage = BinaryStorage(path, read_only=True)
+    else:
+        storage = JournalStorage(path, read_only=True)
+    try:
+        aggregates = Ledger(storage, rates).aggregates
+        columns, strings = aggregates.columns()
+        amounts = np.asarray(aggregates.amounts(currency), dtype=np.float64)
+        times = np.asarray(columns['date']).astype('datetime64[s]').astype(np.int64)
+        codes = np.asarray(columns['category'], dtype=np.int64)
+    finally:
+        storage.close()
+
+    categories = strings['category']
+    expenses = amounts < 0
+    buckets = Rollups.buckets(period, times)
+    pairs = buckets[expenses] * max(len(categories), 1) + codes[expenses]
+    pair_counts = dict(zip(*(array.tolist() for array in np.unique(pairs, return_counts=True))))
+    code_counts = np.bincount(codes[expenses], minlength=len(categories))
+    return {
+        'path': path,
+        'count': len(amounts),
+        'first': int(times.min()) if len(times) else None,
+        'last': int(times.max()) if len(times) else None,
+        'net': exact_sums(np.zeros(len(amounts), dtype=np.int64), amounts).get(0, 0),
+        'categories': {categories[code]: [total, int(code_counts[code])]
+                       for code, total in exact_sums(codes[expenses], -amounts[expenses]).items()},
+        'income': exact_sums(buckets[~expenses], amounts[~expenses]),
+        'expenses': exact_sums(buckets[expenses], -amounts[expenses]),
+        'counts': dict(zip(*(array.tolist() for array in np.unique(buckets, return_counts=True)))),
+        'category_expenses': {(pair // max(len(categories), 1), categories[pair % max(len(categories), 1)]):
+                              [total, pair_counts[pair]]
+                              for pair, total in exact_sums(pairs, -amounts[expenses]).items()}
+    }
+
+
+class LedgerReport:
+    # Aggregates over several ledger files, merged from ledger_partial()s:
+    #   summary    {category: (expense total, count)}, as CategoryTotals takes
+    #   rollups    a Rollups holding `period` only
+    #   files      per file, in date order: path, count, first and last date
+    #              and the balance before and after it, chained across files
+    #   balance    the final balance
+    # The partials' sums are exact, so the result is the same however the
+    # transactions are split into files and whichever order they finish in.
+
+    def __init__(self, partials, period='month'):
+        self.period = period
+        totals, counts = {}, {}
+        income, expenses, bucket_counts, category_expenses = {}, {}, {}, {}
+        for partial in partials:
+            for category, (total, count) in partial['categories'].items():
+                totals[category] = totals.get(category, 0) + total
+                counts[category] = counts.get(category, 0) + count
+            for table, part in ((income, partial['income']), (expenses, partial['expenses']),
+                                (bucket_counts, partial['counts'])):
+                for key, value in part.items():
+                    table[key] = table.get(key, 0) + value
+            for key, (total, count) in partial['category_expenses'].items():
+                entry = category_expenses.setdefault(key, [0, 0])
+                entry[0] += total
+                entry[1] += count
+
+        self.summary = {category: (exact_float(totals[category]), counts[category]) for category in totals}
+        self.rollups = Rollups()
+        self.rollups.totals[period] = {
+            bucket: [exact_float(income.get(bucket, 0)), exact_float(expenses.get(bucket, 0)), count]
+            for bucket, count in bucket_counts.items()
+        }
+        self.rollups.categories[period] = {key: [exact_float(total), count]
+                                           for key, (total, count) in category_expenses.items()}
+
+        # Empty files sort last; ties keep the path order
+        ordered = sorted(partials, key=lambda partial: (partial['first'] is None, partial['first'] or 0,
+                                                        partial['path']))
+        self.files = []
+        balance = 0
+        for partial in ordered:
+            opening, balance = balance, balance + partial['net']
+            self.files.append({
+                'path': partial['path'],
+                'count': partial['count'],
+                'first': None if partial['first'] is None else np.datetime64(partial['first'], 's'),
+                'last': None if partial['last'] is None else np.datetime64(partial['last'], 's'),
+                'opening': exact_float(opening),
+                'closing': exact_float(balance)
+            })
+        self.balance = exact_float(balance)
+        # Exact running balance at the end of each bucket
+        self._nets = {bucket: income.get(bucket, 0) - expenses.get(bucket, 0) for bucket in bucket_counts}
+
+    def balances(self):
+        # (bucket start dates, balance at the end of each bucket)
+        keys = sorted(self._nets)
+        running = list(itertools.accumulate(self._nets[key] for key in keys))
+        return Rollups.starts(self.period, keys), np.array([exact_float(value) for value in running],
+                                                           dtype=np.float64)
+
+
+def aggregate_ledgers(paths, currency=CURRENCIES[0], rates=None, period='month', workers=None):
+    # LedgerReport over several ledger files (e.g. one per year), one file
+    # per task on a process pool of `workers` processes (default: one per
+    # CPU). workers=1 reads them in this process; the result is identical.
+    paths = list(paths)
+    if workers == 1 or len(paths) < 2:
+        partials = [ledger_partial(path, currency, rates, period) for path in paths]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(ledger_partial, paths, [currency] * len(paths), [rates] * len(paths),
+                                     [period] * len(paths)))
+    return LedgerReport(partials, period)
+
+
+def decimate_minmax(x, y, buckets):
+    # Reduce a sorted series to the first, last, min and max point of each of
+    # `buckets` equal-width x intervals. At one bucket per pixel the plotted
+    # line is visually identical to the full one.
+    n = len(x)
+    if n <= 4 * buckets:
+        return x, y
+
+    edges = np.linspace(x[0], x[-1], buckets + 1)[:-1]
+    starts = np.unique(np.searchsorted(x, edges, 'left'))
+    ends = np.append(starts[1:], n) - 1
+    bucket = np.repeat(np.arange(len(starts)), ends - starts + 1)
+
+    keep = [starts, ends]
+    for extreme in (np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)):
+        candidates = np.flatnonzero(y == extreme[bucket])
+        _, first = np.unique(bucket[candidates], return_index=True)
+        keep.append(candidates[first])
+
+    keep = np.unique(np.concatenate(keep))
+    return x[keep], y[keep]
+
+
+class BalanceTrendLine:
+    # Balance line plus fill drawn from a decimated copy of the series sized
+    # to the axes width. The visible range is re-decimated whenever the view
+    # is zoomed, panned or resized, and markers are only drawn while few
+    # enough points are on screen.
+
+    MARKER_THRESHOLD = 200
+
+    def __init__(self, ax, dates, balances, line_style, fill_style):
+        self.ax = ax
+        self.marker = line_style.get('marker', 'None')
+        self._updating = False
+        self._timer = None
+
+        self.line, = ax.plot([], [], **line_style)
+        self.fill = ax.fill_between([], [], **fill_style)
+        ax.xaxis_date()
+        self.set_series(dates, balances)
+        ax.callbacks.connect('xlim_changed', self.on_view_changed)
+
+    def set_series(self, dates, balances):
+        # Matplotlib date numbers: days since 1970-01-01
+        self.x = np.asarray(dates).astype('datetime64[s]').astype(np.int64) / 86400.0
+        self.y = np.asarray(balances, dtype=np.float64)
+        self.ax.set_autoscale_on(True)
+        self.update(full_range=True)
+
+    def connect(self, timer):
+        # xlim_changed fires while matplotlib is still resolving the limits,
+        # so re-decimation runs from `timer` instead: a short single-shot
+        # timer of the canvas, whose owner calls refresh() from it and
+        # on_view_changed() on resizes. Its delay also coalesces the stream
+        # of events from a pan drag. The canvas keeps one timer for every
+        # line it shows, so replaced lines leave no timers or callbacks.
+        self._timer = timer
+
+    def on_view_changed(self, *args):
+        if self._timer is not None and not self._updating:
+            self._timer.start()
+
+    def cancel(self):
+        # Drops a pending re-decimation
+        if self._timer is not None:
+            self._timer.stop()
+
+    def refresh(self):
+        self.update()
+        self.ax.figure.canvas.draw_idle()
+
+    def visible_points(self, full_range=False):
+        first, last = 0, len(self.x)
+        if not full_range:
+            low, high = self.ax.get_xlim()
+            # One point beyond each edge keeps the line running off-screen
+            first = max(int(np.searchsorted(self.x, low, 'left')) - 1, 0)
+            last = min(int(np.searchsorted(self.x, high, 'right')) + 1, len(self.x))
+        buckets = max(int(self.ax.bbox.width), 1)
+        return decimate_minmax(self.x[first:last], self.y[first:last], buckets)
+
+    def update(self, full_range=False):
+        self._updating = True
+        try:
+            x, y = self.visible_points(full_range)
+            self.line.set_data(x, y)
+            self.line.set_marker(self.marker if len(x) <= self.MARKER_THRESHOLD else 'None')
+            # Fill polygon runs along the line and back along zero
+            self.fill.set_verts([np.concatenate([
+                np.column_stack([x, y]),
+                np.column_stack([x[::-1], np.zeros(len(x))])
+            ])])
+            if full_range:
+                self.ax.relim()
+                if len(x):
+                    self.ax.update_datalim([(x[0], 0.0), (x[-1], 0.0)])
+                self.ax.autoscale_view()
+        finally:
+            self._updating = False
+        return len(x)
+
+
+class ChartCache:
+    # Chart results and rendered images by (chart, filter, currency, period,
+    # ledger version) keys, least recently used dropped beyond `budget`
+    # bytes. Entries of an older ledger version can never be hit again, so
+    # invalidate() drops them all once the version moves on.
+
+    def __init__(self, budget=64 * 2 ** 20):
+        self.budget = budget
+        self.size = 0
+        self.version = None
+        self.entries = OrderedDict()
+
+    def invalidate(self, version):
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        nbytes = self.sizeof(value) if nbytes is None else nbytes
+        if nbytes > self.budget:
+            return
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= previous[1]
+        self.entries[key] = (value, nbytes)
+        self.size += nbytes
+        while self.size > self.budget:
+            value, dropped = self.entries.popitem(last=False)[1]
+            self.size -= dropped
+
+    @classmethod
+    def sizeof(cls, value):
+        # Rough footprint of a chart result: arrays, pandas objects and
+        # tuples or lists of them
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (tuple, list)):
+            return sys.getsizeof(value) + sum(cls.sizeof(item) for item in value)
+        if hasattr(value, 'memory_usage'):
+            return int(value.memory_usage(deep=True))
+        return sys.getsizeof(value)
+
+
+class ChartFigure:
+    # One figure showing the expense pie, the balance trend or a period
+    # chart (income/expense bars, category areas) at a time, with only the
+    # axes of the chart shown. Switching to another kind of chart removes
+    # the previous one's axes and artists; showing the same kind again
+    # updates artist data in place, so repeated charts allocate no new
+    # figures or axes. The period charts draw at most a few hundred buckets
+    # and are simply redrawn. Has no canvas of its own: save() renders to a
+    # file, and the GUI keeps one on its Qt canvas, drawn off its thread.
+    # See use_style().
+
+    PIE_COLORS = ['#4a86e8', '#ff9900', '#9c27b0', '#e53935', '#43a047', 
+                  '#795548', '#607d8b', '#f44336', '#3f51b5', '#009688',
+                  '#ff5722', '#8bc34a', '#ffc107', '#03a9f4', '#673ab7']
+    PIE_LABEL_DISTANCE = 1.1
+    PIE_PCT_DISTANCE = 0.85
+
+    STYLE = 'dark_background'
+
+    @classmethod
+    def use_style(cls):
+        # Sets matplotlib's global rcParams, which artists read when they
+        # are made: call once before the first figure, on the thread that
+        # owns the charts
+        import matplotlib.style
+        matplotlib.style.use(cls.STYLE)
+
+    def __init__(self, figsize=(8, 6), dpi=100):
+        from matplotlib.figure import Figure
+
+        # A bare Figure is not registered with pyplot's figure manager
+        self.figure = Figure(figsize=figsize, dpi=dpi, facecolor='#252525')
+        # The shown chart's axes and kind ('pie', 'trend' or 'period')
+        self.ax = None
+        self.kind = None
+        self.pie_labels = None
+        self.pie_artists = None
+        self.trend_line = None
+
+    def clear(self):
+        # Removes the shown chart, leaving an empty figure
+        if self.ax is not None:
+            self.ax.remove()
+        self.ax = None
+        self.kind = None
+        self.pie_labels = None
+        self.pie_artists = None
+        self.trend_line = None
+
+    def use_axes(self, kind):
+        # The axes for a chart of `kind`, made anew if another kind is shown
+        if kind != self.kind:
+            self.clear()
+            self.ax = self.figure.add_subplot()
+            self.kind = kind
+        return self.ax
+
+    def show_pie(self, expenses, title):
+        self.use_axes('pie')
+        labels = list(expenses.index)
+        if labels == self.pie_labels:
+            self._update_pie(expenses.to_numpy(dtype=float))
+        else:
+            self._build_pie(expenses, title)
+        self.figure.tight_layout()
+
+    def _build_pie(self, expenses, title):
+        # New category set: the wedges themselves have to be rebuilt
+        ax = self.ax
+        ax.clear()
+        wedges, texts, autotexts = ax.pie(
+            expenses, 
+            labels=expenses.index,
+            autopct='%1.1f%%',
+            textprops={'fontsize': 10, 'color': '#f0f0f0', 'fontweight': 'bold'},
+            pctdistance=self.PIE_PCT_DISTANCE,
+            labeldistance=self.PIE_LABEL_DISTANCE,
+            colors=self.PIE_COLORS,
+            wedgeprops={'edgecolor': '#252525', 'linewidth': 2, 'antialiased': True},
+            shadow=True
+        )
+        
+        # Configure appearance
+        ax.set_title(title, fontsize=16, pad=20, color='#f0f0f0', fontweight='bold')
+        
+        # Add legend with improved styling
+        ax.legend(
+            wedges, 
+            expenses.index,
+            title="Categories",
+            loc="center left",
+            bbox_to_anchor=(1, 0, 0.5, 1),
+            fontsize=10,
+            frameon=False,
+            title_fontsize=12
+        )
+        ax.axis('equal')
+
+        self.pie_labels = list(expenses.index)
+        self.pie_artists = (wedges, texts, autotexts)
+
+    def _update_pie(self, values):
+        # Same categories: move the existing wedges and labels, the same
+        # geometry Axes.pie uses (start at 0 degrees, counterclockwise)
+        wedges, texts, autotexts = self.pie_artists
+        fractions = values / values.sum()
+        theta1 = 0.0
+        for wedge, text, autotext, fraction in zip(wedges, texts, autotexts, fractions):
+            theta2 = theta1 + fraction
+            wedge.set_theta1(360 * theta1)
+            wedge.set_theta2(360 * theta2)
+
+            middle = np.pi * (theta1 + theta2)
+            x, y = np.cos(middle), np.sin(middle)
+            text.set_position((self.PIE_LABEL_DISTANCE * x, self.PIE_LABEL_DISTANCE * y))
+            text.set_horizontalalignment('left' if x > 0 else 'right')
+            autotext.set_position((self.PIE_PCT_DISTANCE * x, self.PIE_PCT_DISTANCE * y))
+            autotext.set_text('%1.1f%%' % (100 * fraction))
+            theta1 = theta2
+
+    def show_trend(self, dates, balances, title, xlabel, ylabel):
+        ax = self.use_axes('trend')
+
+        if self.trend_line is None:
+            # Balance line and fill with improved styling, decimated to the
+            # axes width so large ledgers stay responsive
+            self.trend_line = BalanceTrendLine(
+                ax,
+                dates,
+                balances,
+                line_style=dict(
+                    marker='o', 
+                    linestyle='-', 
+                    linewidth=3, 
+                    color='#4a86e8',
+                    markersize=8,
+                    markerfacecolor='#252525',
+                    markeredgewidth=2,
+                    markeredgecolor='#4a86e8'
+                ),
+                fill_style=dict(
+                    alpha=0.3, 
+                    color='#4a86e8'
+                )
+            )
+            
+            # Grid setup with improved styling
+            ax.grid(True, linestyle='--', alpha=0.3, color='#505050', linewidth=0.8)
+            
+            # Axis formatting with improved styling
+            ax.spines['top'].set_visible(False)
+            ax.spines['right'].set_visible(False)
+            ax.spines['left'].set_color('#505050')
+            ax.spines['bottom'].set_color('#505050')
+            
+            # Улучшенное форматирование меток осей
+            ax.tick_params(axis='both', colors='#e0e0e0', labelsize=10)
+        else:
+            self.trend_line.set_series(dates, balances)
+
+        # Configure appearance with improved styling
+        ax.set_title(title, fontsize=16, pad=20, color='#f0f0f0', fontweight='bold')
+        ax.set_xlabel(xlabel, fontsize=12, color='#e0e0e0', fontweight='bold')
+        ax.set_ylabel(ylabel, fontsize=12, color='#e0e0e0', fontweight='bold')
+        self.figure.tight_layout()
+
+    # Approximate length of each period in days, for bar widths
+    PERIOD_DAYS = {'day': 1, 'week': 7, 'month': 30, 'year': 365}
+
+    def _period_axes(self, title, xlabel, ylabel):
+        ax = self.use_axes('period')
+        ax.clear()
+        ax.grid(True, axis='y', linestyle='--', alpha=0.3, color='#505050', linewidth=0.8)
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['left'].set_color('#505050')
+        ax.spines['bottom'].set_color('#505050')
+        ax.tick_params(axis='both', colors='#e0e0e0', labelsize=10)
+        ax.tick_params(axis='x', labelrotation=30)
+        ax.set_title(title, fontsize=16, pad=20, color='#f0f0f0', fontweight='bold')
+        ax.set_xlabel(xlabel, fontsize=12, color='#e0e0e0', fontweight='bold')
+        ax.set_ylabel(ylabel, fontsize=12, color='#e0e0e0', fontweight='bold')
+        return ax
+
+    def show_period_bars(self, period, starts, income, expenses, title, labels, xlabel, ylabel):
+        # Income and expense bars side by side per bucket, net as a line;
+        # labels are the (income, expenses, net) legend entries
+        import matplotlib.dates as mdates
+        ax = self._period_axes(title, xlabel, ylabel)
+        x = mdates.date2num(starts)
+        width = 0.4 * self.PERIOD_DAYS[period]
+        ax.bar(x, income, width=width, align='edge', color='#66bb6a', label=labels[0])
+        ax.bar(x + width, expenses, width=width, align='edge', color='#ff5252', label=labels[1])
+        ax.plot(x + width, income - expenses, color='#4a86e8', marker='o', markersize=4, linewidth=2,
+                label=labels[2])
+        ax.axhline(0, color='#505050', linewidth=0.8)
+        ax.xaxis_date()
+        ax.legend(loc='upper left', fontsize=10, frameon=False)
+        self.figure.tight_layout()
+
+    def show_category_areas(self, starts, categories, values, title, xlabel, ylabel):
+        # Expenses per category stacked over time; values is categories x buckets
+        import matplotlib.dates as mdates
+        ax = self._period_axes(title, xlabel, ylabel)
+        colors = [self.PIE_COLORS[i % len(self.PIE_COLORS)] for i in range(len(categories))]
+        ax.stackplot(mdates.date2num(starts), values, labels=categories, colors=colors, alpha=0.85)
+        ax.xaxis_date()
+        ax.legend(loc='center left', bbox_to_anchor=(1, 0.5), fontsize=10, frameon=False, title="Categories",
+                  title_fontsize=12)
+        self.figure.tight_layout()
+
+    def save(self, path, format=None):
+        # Renders with the figure's own canvas (Agg for raster formats), so
+        # no GUI toolkit is involved; the format follows path's extension
+        self.figure.savefig(path, format=format, facecolor=self.figure.get_facecolor())
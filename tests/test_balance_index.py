@@ -0,0 +1,96 @@
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import finance_cli
+from finance_core import BalanceIndex, to_epoch_seconds
+
+
+def make_records(count, seed=0):
+    rng = random.Random(seed)
+    return [{'id': i, 'date': f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00:00",
+             'amount': round(rng.uniform(-200, 200), 2)}
+            for i in range(1, count + 1)]
+
+
+def brute_balance(records, date):
+    return sum(r['amount'] for r in records if to_epoch_seconds(r['date']) <= to_epoch_seconds(date))
+
+
+def brute_change(records, start, end):
+    start, end = to_epoch_seconds(start), to_epoch_seconds(end)
+    return sum(r['amount'] for r in records if start <= to_epoch_seconds(r['date']) <= end)
+
+
+PROBES = ['2023-12-31', '2024-01-01', '2024-03-15 12:00:00', '2024-06-30 23:59:59', '2024-12-31 23:59:59']
+
+
+def check(index, records):
+    for date in PROBES:
+        assert index.balance_at(date) == pytest.approx(brute_balance(records, date))
+    for start, end in zip(PROBES, PROBES[1:]):
+        assert index.change_between(start, end) == pytest.approx(brute_change(records, start, end))
+
+
+def test_empty_index():
+    index = BalanceIndex()
+    assert index.balance_at('2024-01-01') == 0.0
+    assert index.change_between('2024-01-01', '2024-12-31') == 0.0
+
+
+def test_matches_brute_force_after_edits():
+    records = make_records(300)
+    index = BalanceIndex([r['id'] for r in records], [r['date'] for r in records], [r['amount'] for r in records])
+    check(index, records)
+
+    # Out-of-order inserts land in the middle of the prefix sums
+    rng = random.Random(1)
+    for record in make_records(50, seed=2):
+        record['id'] += 1000
+        records.append(record)
+        index.add(record)
+    check(index, records)
+
+    for record in rng.sample(records, 40):
+        records.remove(record)
+        index.remove(record)
+    check(index, records)
+
+    for position in rng.sample(range(len(records)), 40):
+        old = records[position]
+        new = dict(old, amount=old['amount'] + 10)
+        if position % 2:
+            new['date'] = '2024-07-01 08:00:00'
+        records[position] = new
+        index.replace(old, new)
+    check(index, records)
+
+
+def test_bounds_are_inclusive():
+    index = BalanceIndex([1, 2, 3], ['2024-01-01', '2024-01-02', '2024-01-02'], [10.0, -3.0, -2.0])
+    assert index.balance_at('2024-01-01') == 10.0
+    assert index.balance_at('2024-01-02') == 5.0
+    assert index.change_between('2024-01-02', '2024-01-02') == -5.0
+    assert index.change_between('2024-01-01', '2024-01-01') == 10.0
+
+
+def test_cli_balance_at_and_change(tmp_path, capsys):
+    ledger = tmp_path / 'ledger.json'
+    ledger.write_text(json.dumps([
+        {'id': 1, 'date': '2024-01-01 10:00:00', 'type': 'Income', 'category': 'a', 'amount': 100.0, 'currency': 'USD - $'},
+        {'id': 2, 'date': '2024-01-05 18:00:00', 'type': 'Expense', 'category': 'b', 'amount': -30.0, 'currency': 'USD - $'},
+        {'id': 3, 'date': '2024-02-01 00:00:00', 'type': 'Income', 'category': 'c', 'amount': 50.0, 'currency': 'USD - $'},
+    ]))
+
+    # A bare date covers the whole day
+    finance_cli.main(['--ledger', str(ledger), 'balance', '--at', '2024-01-05', '--format', 'json'])
+    assert json.loads(capsys.readouterr().out) == {'date': '2024-01-05', 'balance': 70.0}
+
+    finance_cli.main(['--ledger', str(ledger), 'balance', '--change', '--start', '2024-01-02', '--end', '2024-02-01',
+                      '--format', 'json'])
+    assert json.loads(capsys.readouterr().out)['change'] == 20.0
@@ -0,0 +1,130 @@
+import gc
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from matplotlib.figure import Figure
+
+from finance_core import ChartFigure
+
+
+def count_figures():
+    # Bare Figures are not registered with pyplot, so they are counted on the heap
+    gc.collect()
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, Figure))
+
+
+def count_artists(figure):
+    return len(figure.findobj())
+
+
+def show_every_chart(chart):
+    # The same data every time, so tick counts stay put; showing a chart again
+    # still updates its artists in place
+    expenses = pd.Series([10.0, 20.0, 30.0], index=['food', 'fuel', 'rent'])
+    chart.show_pie(expenses, "Expenses")
+    yield 'pie'
+    dates = np.arange('2024-01-01', '2024-03-01', dtype='datetime64[D]')
+    chart.show_trend(dates, np.cumsum(np.full(len(dates), 1.0)), "Balance", "Date", "Amount")
+    yield 'trend'
+    starts = np.array(['2024-01-01', '2024-02-01'], dtype='datetime64[D]').astype(object)
+    chart.show_period_bars('month', starts, np.array([5.0, 6.0]), np.array([3.0, 4.0]), "Periods",
+                           ("Income", "Expenses", "Net"), "Month", "Amount")
+    yield 'bars'
+    chart.show_category_areas(starts, ['food', 'fuel'], np.array([[1.0, 2.0], [3.0, 4.0]]), "Categories",
+                              "Month", "Amount")
+    yield 'areas'
+
+
+def test_chart_figure_reuses_one_figure_and_axes():
+    ChartFigure.use_style()
+    chart = ChartFigure()
+    assert chart.figure.axes == []
+
+    counts = {}
+    for kind in show_every_chart(chart):
+        counts[kind] = count_artists(chart.figure)
+        chart.figure.canvas.draw()
+    figures = count_figures()
+
+    for i in range(20):
+        for kind in show_every_chart(chart):
+            # Only the shown chart's axes exist
+            assert len(chart.figure.axes) == 1
+            assert count_artists(chart.figure) == counts[kind]
+            chart.figure.canvas.draw()
+    assert count_figures() == figures
+
+    chart.clear()
+    assert chart.figure.axes == []
+    assert chart.trend_line is None
+
+
+def test_window_chart_switching_stays_flat(tmp_path, monkeypatch):
+    pytest.importorskip('PyQt6')
+    monkeypatch.setenv('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt6.QtWidgets import QApplication
+    import finance_calculator
+
+    shutil.copytree(os.path.join(ROOT, 'icons'), tmp_path / 'icons')
+    monkeypatch.chdir(tmp_path)
+    app = QApplication.instance() or QApplication([])
+    # Loads are started by wait_loaded, not by the first paint
+    finance_calculator.startup_timer.mark('first paint')
+    window = finance_calculator.FinanceCalculator()
+    window.wait_loaded()
+    for i in range(60):
+        window.amount_edit.setText(str(10 + i))
+        window.type_combo.setCurrentIndex(i % 2)
+        window.category_edit.setText(f"category-{i % 5}")
+        window.add_transaction()
+    window.resize(1000, 800)
+    window.show()
+    app.processEvents()
+
+    surface = None
+    charts = [window.show_expense_pie_chart, window.show_balance_trend, window.show_period_chart,
+              window.show_category_trend]
+
+    def switch(rounds):
+        for i in range(rounds):
+            for show in charts:
+                # Cleared, so every switch renders into the figure again
+                window.chart_cache.clear()
+                show()
+                surface.wait()
+                app.processEvents()
+                assert len(surface.figure.axes) == 1
+
+    try:
+        window.ensure_stats_tab()
+        window.tab_widget.setCurrentWidget(window.stats_tab)
+        surface = window.chart_surface
+        switch(2)
+        figures = count_figures()
+        artists = count_artists(surface.figure)
+        callbacks = sum(len(handlers) for handlers in surface.canvas.callbacks.callbacks.values())
+        widgets = len(QApplication.allWidgets())
+
+        switch(10)
+        assert count_figures() == figures
+        # The last chart shown is the same kind as before
+        assert count_artists(surface.figure) == artists
+        assert sum(len(handlers) for handlers in surface.canvas.callbacks.callbacks.values()) == callbacks
+        assert len(QApplication.allWidgets()) == widgets
+
+        # Re-rendering the chart already shown also adds nothing
+        for i in range(10):
+            window.chart_cache.clear()
+            window.show_category_trend()
+            surface.wait()
+        assert count_artists(surface.figure) == artists
+    finally:
+        window.close()